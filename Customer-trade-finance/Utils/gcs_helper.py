@@ -1,10 +1,10 @@
-from google.cloud import storage
 import pandas as pd
 import tempfile
  
 def download_blob_as_df(gcs_path: str) -> pd.DataFrame:
     assert gcs_path.startswith("gs://")
     bucket_name, blob_path = gcs_path[5:].split("/", 1)
+    from google.cloud import storage
  
     storage_client = storage.Client()
     bucket = storage_client.bucket(bucket_name)
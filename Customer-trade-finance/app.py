@@ -1,15 +1,25 @@
 import streamlit as st
 import pandas as pd
 import os
-import numpy as np
 import json
 from dotenv import load_dotenv
-from vertex_predict import predict_from_vertex
+from vertex_predict import predict_from_vertex, parity_check, BACKENDS, PREDICTION_BACKEND
+from prediction_parser import parse_predictions
+from results_view import render_prediction_table, render_schema_report
+from feature_schema import get_schema, SchemaValidationError, MODE_REPAIR, MODE_REJECT
+from job_queue import JobQueue
 from utils.gcs_helper import download_blob_as_df
 
 # Load environment variables
 load_dotenv()
 
+
+@st.cache_resource
+def get_job_queue():
+    # One queue and worker pool per server process, shared by all sessions
+    return JobQueue().start()
+
+
 # Title
 st.title("Customer 360 Trade Finance Risk Prediction")
 
@@ -33,88 +43,123 @@ elif uploaded_file:
     except Exception as e:
         st.error(f"Failed to read uploaded file: {e}") # Added error details
 
+# Results belong to the data they were predicted from; a new or removed input clears them
+data_source = gcs_path or ((uploaded_file.name, uploaded_file.size) if uploaded_file else None)
+if st.session_state.get("data_source") != data_source:
+    st.session_state.data_source = data_source
+    st.session_state.prediction_results = None
+
 # Run prediction
 if df is not None:
     st.subheader("Uploaded Data")
     st.dataframe(df)
 
-    # Ensure correct types
-    columns_to_cast_as_string = [
-        'Years_in_Operation', 'Annual_Revenue', 'Customer_Id', 'Company_ID', 'Profitability_Status',
-        'Requested_Guarantee', 'Total_Requested_Guarantee', 'Max_Requested_Guarantee',
-        'On_Time_Payment_Rate', 'Avg_Days_Late', 'Product_Mix', 'Country', 'Counterparty_Country','Profit_Margin','Debt_to_Equity','Credit_Score','Previous_BGs',
-        'Total_BG_Value','Default_Count','Transaction_Value','Requested_Guarantee','Total_Requested_Guarantee','Max_Requested_Guarantee','On_Time_Payment_Rate','Avg_Days_Late','Cash_Flow_Gap_Days'
-    ]
+    # Validate and coerce against the endpoint's feature schema before any Vertex call
+    feature_schema = get_schema(endpoint_id=os.getenv("VERTEX_ENDPOINT_ID"))
+    validation_mode = st.radio("Invalid values", [MODE_REPAIR, MODE_REJECT], horizontal=True,
+                               help="repair: null out unparseable values and clip out-of-range ones; reject: drop rows holding them")
+    # IDs follow the uploaded row numbers, so they are assigned before reject mode drops any rows
+    row_ids = pd.Series([f"CUST000{i+1}" for i in range(len(df))], index=df.index)
+    try:
+        df, schema_report, rejected_rows = feature_schema.validate(df, mode=validation_mode)
+    except SchemaValidationError as e:
+        st.error(f"Input does not match feature schema '{feature_schema.version}': {e}")
+        st.dataframe(e.report, hide_index=True)
+        st.stop()
+    render_schema_report(feature_schema, schema_report, rejected_rows)
+    customer_ids = row_ids.drop(rejected_rows.index).tolist()
 
-    for col in columns_to_cast_as_string:
-        if col in df.columns:
-            df[col] = df[col].apply(lambda x: str(x) if pd.notnull(x) else x)
+    # "local" scores in-process with the exported model; "auto" falls back to it when Vertex fails
+    backend = st.radio("Scoring backend", BACKENDS, index=BACKENDS.index(PREDICTION_BACKEND), horizontal=True)
 
-    # Replace NaN with None
-    df = df.where(pd.notnull(df), None)
+    run_in_background = st.toggle("Run in background", value=True, help="Queue the prediction as a job so page reruns do not discard it.")
 
     if st.button("Predict"):
+        if run_in_background:
+            try:
+                job_id = get_job_queue().submit(
+                    df.to_dict(orient="records"),
+                    customer_ids=customer_ids,
+                    endpoint_id=os.getenv("VERTEX_ENDPOINT_ID"),
+                    project=os.getenv("PROJECT_ID"),
+                    location=os.getenv("REGION"),
+                    backend=backend
+                )
+                # Job IDs live in session state so the job panel survives reruns
+                st.session_state.setdefault("prediction_jobs", []).append(job_id)
+                st.success(f"Prediction job {job_id} queued.")
+            except Exception as e:
+                st.error(f"Failed to queue prediction job: {e}")
+        else:
+            try:
+                # Prepare instances for batch prediction
+                instances = df.to_dict(orient="records")
+
+                # Call Vertex AI
+                response = predict_from_vertex(
+                    endpoint_id=os.getenv("VERTEX_ENDPOINT_ID"),
+                    project=os.getenv("PROJECT_ID"),
+                    location=os.getenv("REGION"),
+                    instance_list=instances,
+                    backend=backend
+                )
+
+                if not response or not hasattr(response, 'predictions') or not response.predictions:
+                    st.session_state.prediction_results = None
+                    st.warning("No predictions received from the model.")
+                else:
+                    # Parse all predictions in one pass; keep them across reruns for paging/sorting
+                    st.session_state.prediction_results = parse_predictions(response.predictions, customer_ids)
+
+            except Exception as e:
+                st.error(f"Prediction failed: {e}")
+
+    if backend != "vertex" and st.button("Run Parity Check (local vs Vertex)"):
         try:
-            # Prepare instances for batch prediction
-            instances = df.to_dict(orient="records")
-
-            # Call Vertex AI
-            response = predict_from_vertex(
+            report = parity_check(
                 endpoint_id=os.getenv("VERTEX_ENDPOINT_ID"),
                 project=os.getenv("PROJECT_ID"),
                 location=os.getenv("REGION"),
-                instance_list=instances
+                instance_list=df.to_dict(orient="records")
             )
-
-            st.subheader("Prediction Results")
-
-            if not response or not hasattr(response, 'predictions') or not response.predictions:
-                st.warning("No predictions received from the model.")
+            if report["passed"]:
+                st.success(f"Local model matches Vertex on {report['sample_size']} sampled rows.")
+            elif report["inconclusive"]:
+                st.warning("Parity check inconclusive: local and Vertex predictions share no comparable class scores.")
             else:
-                for i, prediction in enumerate(response.predictions):
-                    predicted_class = "Unknown"
-                    confidence = 0.0
-
-                    try:
-                        # Try Format 1: displayName + confidence
-                        if 'displayName' in prediction and 'confidence' in prediction:
-                            predicted_class = prediction['displayName']
-                            confidence_val = prediction['confidence']
-                            if isinstance(confidence_val, (int, float)):
-                                confidence = float(confidence_val)
-                            else:
-                                st.warning(f"Record {i+1}: Invalid confidence format for displayName format.")
-
-                        # Try Format 2: classes + scores
-                        elif 'classes' in prediction and 'scores' in prediction:
-                            if prediction['scores'] and prediction['classes']:
-                                scores = np.array(prediction['scores'])
-                                classes = prediction['classes']
-                                if scores.size > 0 and len(classes) == scores.size:
-                                    idx = np.argmax(scores)
-                                    predicted_class = classes[idx]
-                                    confidence_val = scores[idx]
-                                    if isinstance(confidence_val, (int, float)):
-                                        confidence = float(confidence_val)
-                                    else:
-                                        st.warning(f"Record {i+1}: Invalid confidence format for classes/scores format.")
-                                else:
-                                    st.warning(f"Record {i+1}: Mismatch or empty scores/classes in classes/scores format.")
-                            else:
-                                st.warning(f"Record {i+1}: Empty scores or classes found.")
-                        else:
-                            st.warning(f"Record {i+1}: Unrecognized prediction format.")
-
-                        # Display result
-                        if isinstance(confidence, (int, float)):
-                            st.write(f"**CUST000{i+1}:** Predicted Class = {predicted_class}, Confidence = {round(confidence * 100, 2)}%")
-                        else:
-                            st.write(f"**CUST000{i+1}:** Predicted Class = {predicted_class}, Confidence = N/A (Invalid format)")
-
-                    except Exception as parse_err:
-                        st.error(f"Prediction parsing failed for record {i+1}: {parse_err}")
-                        # Optional: log raw data for debugging
-                        # st.write(f"**Record {i+1}:** Raw prediction data: {prediction}")
-
+                st.warning("Local model diverges from Vertex on the sampled rows.")
+            st.json(report)
         except Exception as e:
-            st.error(f"Prediction failed: {e}")
\ No newline at end of file
+            st.error(f"Parity check failed: {e}")
+
+
+# --- Background Prediction Jobs ---
+if st.session_state.get("prediction_jobs"):
+    job_queue = get_job_queue()
+    st.subheader("Prediction Jobs")
+
+    metrics = job_queue.metrics()
+    m1, m2, m3, m4 = st.columns(4)
+    m1.metric("Active jobs", metrics["active_jobs"])
+    m2.metric("Queued shards", metrics["queued_shards"])
+    m3.metric("Queued instances", metrics["queued_instances"])
+    m4.metric("Throughput (inst/s, 5 min)", f"{metrics['instances_per_sec']:.1f}")
+    st.button("Refresh job status")
+
+    for job_id in reversed(st.session_state.prediction_jobs):
+        job = job_queue.status(job_id)
+        if job is None:
+            continue
+        st.write(f"**Job {job_id}** ({job['n_instances']} instances, backend: {job['backend']}) - {job['status']}")
+        st.progress(job["progress"], text=f"{job['shards_done']}/{job['n_shards']} shards done")
+        with st.expander("Shard progress"):
+            st.dataframe(job_queue.shards(job_id), hide_index=True)
+        if job["status"] == "failed":
+            st.error(job["error"])
+        if job["status"] in ("done", "failed") and st.button("Show results", key=f"show_{job_id}"):
+            st.session_state.prediction_results = job_queue.result(job_id)
+            st.rerun()
+
+if st.session_state.get("prediction_results") is not None:
+    st.subheader("Prediction Results")
+    render_prediction_table(st.session_state.prediction_results)
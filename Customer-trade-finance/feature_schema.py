@@ -0,0 +1,251 @@
+import os
+import re
+from dataclasses import dataclass, field
+import numpy as np
+import pandas as pd
+
+# Default schema version, and optional per-endpoint overrides as
+# "endpoint_id:version,endpoint_id:version"
+DEFAULT_SCHEMA_VERSION = os.getenv("VERTEX_SCHEMA_VERSION", "customer360_v1")
+ENDPOINT_SCHEMA_MAP = os.getenv("ENDPOINT_SCHEMA_MAP", "")
+
+MODE_REPAIR = "repair"
+MODE_REJECT = "reject"
+
+
+class SchemaValidationError(ValueError):
+    """Raised when a payload cannot be made to fit the schema (e.g. a required column is missing)."""
+
+    def __init__(self, message, report=None):
+        super().__init__(message)
+        self.report = report
+
+
+@dataclass(frozen=True)
+class FeatureSpec:
+    name: str                      # column name the endpoint expects
+    dtype: str = "number"          # "number", "integer" or "string"
+    required: bool = False         # rows with a null here are rejected
+    aliases: tuple = ()            # other spellings accepted on input
+    min_value: float | None = None
+    max_value: float | None = None
+    allowed: tuple | None = None   # permitted values for categorical strings
+    as_string: bool = False        # send numbers as strings (AutoML tabular payloads)
+
+
+def normalize_column_name(name) -> str:
+    return re.sub(r"[\s\-]+", "_", str(name).strip()).lower()
+
+
+@dataclass
+class FeatureSchema:
+    version: str
+    features: list
+    drop_unknown: bool = True
+    _alias_map: dict = field(default_factory=dict, init=False, repr=False)
+    _validators: list = field(default_factory=list, init=False, repr=False)
+    _by_name: dict = field(default_factory=dict, init=False, repr=False)
+
+    def __post_init__(self):
+        self.compile()
+
+    def compile(self):
+        """Precomputes the name lookup and one vectorized validator per column."""
+        self._alias_map = {}
+        self._by_name = {spec.name: spec for spec in self.features}
+        for spec in self.features:
+            for alias in (spec.name, *spec.aliases):
+                self._alias_map[normalize_column_name(alias)] = spec.name
+        self._validators = [(spec, _compile_validator(spec)) for spec in self.features]
+
+    @property
+    def columns(self) -> list:
+        return [spec.name for spec in self.features]
+
+    def spec(self, name: str) -> FeatureSpec:
+        return self._by_name[name]
+
+    def internal_names(self) -> dict:
+        """Maps lowercase internal names to the names the endpoint expects."""
+        return {normalize_column_name(spec.name): spec.name for spec in self.features}
+
+    def canonicalize_columns(self, df: pd.DataFrame) -> tuple:
+        """Renames known aliases to canonical names; returns (frame, unknown columns)."""
+        rename, unknown = {}, []
+        for col in df.columns:
+            canonical = self._alias_map.get(normalize_column_name(col))
+            if canonical is None:
+                unknown.append(col)
+            elif canonical != col:
+                rename[col] = canonical
+        return df.rename(columns=rename), unknown
+
+    def validate(self, df: pd.DataFrame, mode: str = MODE_REPAIR) -> tuple:
+        """
+        Validates and coerces every column in one vectorized pass.
+
+        mode="repair" nulls out unparseable values and clips out-of-range values;
+        mode="reject" drops every row holding an invalid value. Rows missing a
+        required value are always dropped. Returns (clean frame with None for
+        nulls, per-column report, rejected rows). Raises SchemaValidationError
+        when a required column is missing entirely.
+        """
+        if mode not in (MODE_REPAIR, MODE_REJECT):
+            raise ValueError(f"Unknown validation mode '{mode}'.")
+
+        frame, unknown = self.canonicalize_columns(df)
+        n = len(frame)
+        bad_rows = np.zeros(n, dtype=bool)
+        reasons = np.full(n, "", dtype=object)
+        report = []
+        out = {}
+
+        missing_required = [spec.name for spec in self.features if spec.required and spec.name not in frame.columns]
+        if missing_required:
+            report = pd.DataFrame([{"column": c, "status": "missing required column"} for c in missing_required])
+            raise SchemaValidationError(f"Missing required column(s): {missing_required}", report)
+
+        for spec, validator in self._validators:
+            if spec.name not in frame.columns:
+                report.append({"column": spec.name, "status": "missing", "invalid": 0,
+                               "out_of_range": 0, "null_required": 0, "examples": ""})
+                continue
+
+            values, invalid, out_of_range, clipped = validator(frame[spec.name])
+            null_required = values.isna().to_numpy() & spec.required & ~invalid
+
+            if mode == MODE_REJECT:
+                row_bad = invalid | out_of_range | null_required
+            else:
+                values = clipped
+                row_bad = null_required | (invalid & spec.required)
+            bad_rows |= row_bad
+            reasons[row_bad] = reasons[row_bad] + f"{spec.name};"
+
+            examples = frame.loc[invalid | out_of_range, spec.name].astype(str).unique()[:3]
+            report.append({
+                "column": spec.name,
+                "status": "ok" if not (invalid.any() or out_of_range.any() or null_required.any()) else
+                          ("rejected rows" if mode == MODE_REJECT else "repaired"),
+                "invalid": int(invalid.sum()),
+                "out_of_range": int(out_of_range.sum()),
+                "null_required": int(null_required.sum()),
+                "examples": ", ".join(examples),
+            })
+            out[spec.name] = _to_payload(values, spec)
+
+        for col in unknown:
+            report.append({"column": col, "status": "dropped (unknown)" if self.drop_unknown else "passed through",
+                           "invalid": 0, "out_of_range": 0, "null_required": 0, "examples": ""})
+            if not self.drop_unknown:
+                out[col] = frame[col].astype(object).where(frame[col].notna(), None)
+
+        clean = pd.DataFrame(out, index=frame.index)
+        rejected = df.loc[bad_rows].assign(_rejected_columns=reasons[bad_rows])
+        return clean.loc[~bad_rows].reset_index(drop=True), pd.DataFrame(report), rejected
+
+
+def _compile_validator(spec: FeatureSpec):
+    """Builds the column validator for one spec: returns (values, invalid, out_of_range, clipped)."""
+
+    if spec.dtype in ("number", "integer"):
+        def validate_numeric(series: pd.Series):
+            values = pd.to_numeric(series, errors="coerce")
+            invalid = (series.notna() & values.isna()).to_numpy(copy=True)
+            if spec.dtype == "integer":
+                fractional = values.notna() & (values % 1 != 0)
+                invalid = invalid | fractional.to_numpy()
+                values = values.mask(fractional)
+            out_of_range = np.zeros(len(series), dtype=bool)
+            if spec.min_value is not None:
+                out_of_range |= (values < spec.min_value).to_numpy()
+            if spec.max_value is not None:
+                out_of_range |= (values > spec.max_value).to_numpy()
+            clipped = values.clip(lower=spec.min_value, upper=spec.max_value)
+            return values, invalid, out_of_range, clipped
+        return validate_numeric
+
+    def validate_string(series: pd.Series):
+        values = series.astype("string").str.strip()
+        values = values.mask(values.eq("").fillna(False))
+        invalid = np.zeros(len(series), dtype=bool)
+        if spec.allowed is not None:
+            invalid = (values.notna() & ~values.isin(spec.allowed)).to_numpy(dtype=bool)
+        clipped = values.mask(invalid)
+        return values, invalid, np.zeros(len(series), dtype=bool), clipped
+    return validate_string
+
+
+def _to_payload(values: pd.Series, spec: FeatureSpec) -> pd.Series:
+    """Converts a validated column into JSON-ready values (None for nulls)."""
+    notna = values.notna().to_numpy()
+    if spec.dtype == "integer":
+        values = values.astype("Int64")
+    if spec.as_string and spec.dtype != "string":
+        values = values.astype(str)
+    return values.astype(object).where(notna, None)
+
+
+# --- Registry ---
+# customer360_v1: columns used by app.py / main.py; AutoML tabular endpoint taking string values
+CUSTOMER360_V1 = FeatureSchema("customer360_v1", [
+    FeatureSpec("Customer_Id", "string", aliases=("customer_id", "Customer_ID")),
+    FeatureSpec("Company_ID", "string", aliases=("company_id",)),
+    FeatureSpec("Years_in_Operation", "number", min_value=0, as_string=True),
+    FeatureSpec("Annual_Revenue", "number", min_value=0, as_string=True),
+    FeatureSpec("Profitability_Status", "string"),
+    FeatureSpec("Profit_Margin", "number", as_string=True),
+    FeatureSpec("Debt_to_Equity", "number", as_string=True),
+    FeatureSpec("Credit_Score", "number", min_value=0, as_string=True),
+    FeatureSpec("Previous_BGs", "integer", min_value=0, as_string=True, aliases=("previous_bg",)),
+    FeatureSpec("Total_BG_Value", "number", min_value=0, as_string=True),
+    FeatureSpec("Default_Count", "integer", min_value=0, as_string=True),
+    FeatureSpec("Transaction_Value", "number", min_value=0, as_string=True),
+    FeatureSpec("Requested_Guarantee", "number", min_value=0, as_string=True),
+    FeatureSpec("Total_Requested_Guarantee", "number", min_value=0, as_string=True),
+    FeatureSpec("Max_Requested_Guarantee", "number", min_value=0, as_string=True),
+    FeatureSpec("On_Time_Payment_Rate", "number", min_value=0, as_string=True),
+    FeatureSpec("Avg_Days_Late", "number", min_value=0, as_string=True),
+    FeatureSpec("Cash_Flow_Gap_Days", "number", as_string=True),
+    FeatureSpec("Product_Mix", "string"),
+    FeatureSpec("Country", "string"),
+    FeatureSpec("Counterparty_Country", "string"),
+], drop_unknown=False)
+
+# customer360_v2: columns used by updated.py; numeric values sent as numbers
+CUSTOMER360_V2 = FeatureSchema("customer360_v2", [
+    FeatureSpec("Customer_ID", "string", aliases=("customer_id", "Customer_Id")),
+    FeatureSpec("Company_Name", "string"),
+    FeatureSpec("Total_BG_Value", "number", min_value=0),
+    FeatureSpec("Default_Count", "integer", min_value=0),
+    FeatureSpec("Transaction_Count", "integer", min_value=0),
+    FeatureSpec("Requested_Guarantee", "number", min_value=0),
+    FeatureSpec("Profit_Margin", "number"),
+    FeatureSpec("Debt_to_Equity", "number"),
+    FeatureSpec("Credit_Score", "number", min_value=0),
+    FeatureSpec("Previous_BG", "integer", min_value=0),
+    FeatureSpec("Max_Requested_Guarantee", "number", min_value=0),
+    FeatureSpec("On_Time_Payment_Rate", "number", min_value=0),
+    FeatureSpec("Avg_Days_Late", "number", min_value=0),
+    FeatureSpec("Product_Mix", "number"),
+    FeatureSpec("Counter_Party_Count", "integer", min_value=0),
+    FeatureSpec("Cash_Flow_Gap_Days", "number"),
+])
+
+SCHEMAS = {schema.version: schema for schema in (CUSTOMER360_V1, CUSTOMER360_V2)}
+
+
+def _parse_endpoint_map(raw: str) -> dict:
+    pairs = (item.split(":", 1) for item in raw.split(",") if ":" in item)
+    return {endpoint.strip(): version.strip() for endpoint, version in pairs}
+
+
+ENDPOINT_SCHEMAS = _parse_endpoint_map(ENDPOINT_SCHEMA_MAP)
+
+
+def get_schema(version: str | None = None, endpoint_id: str | None = None, default: str | None = None) -> FeatureSchema:
+    """Looks up a schema by explicit version, else by endpoint, else default / DEFAULT_SCHEMA_VERSION."""
+    version = version or ENDPOINT_SCHEMAS.get(str(endpoint_id)) or default or DEFAULT_SCHEMA_VERSION
+    if version not in SCHEMAS:
+        raise KeyError(f"Unknown feature schema '{version}'. Registered: {sorted(SCHEMAS)}")
+    return SCHEMAS[version]
@@ -0,0 +1,324 @@
+import os
+import json
+import time
+import uuid
+import shutil
+import sqlite3
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeoutError
+from contextlib import closing
+import pandas as pd
+from prediction_parser import parse_predictions
+
+JOB_DB_PATH = os.getenv("JOB_DB_PATH", "jobs/jobs.db")
+JOB_DIR = os.getenv("JOB_DIR", "jobs")
+JOB_WORKERS = int(os.getenv("JOB_WORKERS", "2"))
+JOB_SHARD_SIZE = int(os.getenv("JOB_SHARD_SIZE", "1000"))
+POLL_INTERVAL_SECONDS = 0.5
+# A predictor call running longer than this fails its shard; the worker moves on
+PREDICT_TIMEOUT_SECONDS = float(os.getenv("PREDICT_TIMEOUT_SECONDS", "300"))
+# Running shards older than this are assumed orphaned by a dead process and re-queued.
+# Must exceed PREDICT_TIMEOUT_SECONDS so a live worker's shard is never taken from it.
+STALE_SHARD_SECONDS = max(600.0, 2 * PREDICT_TIMEOUT_SECONDS)
+STALE_SWEEP_INTERVAL_SECONDS = 60
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    job_id TEXT PRIMARY KEY,
+    status TEXT NOT NULL,
+    endpoint_id TEXT,
+    project TEXT,
+    location TEXT,
+    backend TEXT,
+    n_instances INTEGER NOT NULL,
+    n_shards INTEGER NOT NULL,
+    created_at REAL NOT NULL,
+    finished_at REAL,
+    error TEXT
+);
+CREATE TABLE IF NOT EXISTS shards (
+    job_id TEXT NOT NULL,
+    shard_idx INTEGER NOT NULL,
+    status TEXT NOT NULL,
+    n_instances INTEGER NOT NULL,
+    started_at REAL,
+    finished_at REAL,
+    error TEXT,
+    PRIMARY KEY (job_id, shard_idx)
+);
+CREATE INDEX IF NOT EXISTS idx_shards_status ON shards (status, job_id, shard_idx);
+CREATE INDEX IF NOT EXISTS idx_shards_finished ON shards (finished_at);
+"""
+
+
+def _default_predictor(job: dict, instances: list):
+    from vertex_predict import predict_from_vertex
+    return predict_from_vertex(
+        endpoint_id=job["endpoint_id"],
+        project=job["project"],
+        location=job["location"],
+        instance_list=instances,
+        backend=job["backend"],
+    )
+
+
+class JobQueue:
+    """
+    SQLite-backed prediction job queue served by background worker threads.
+
+    A submitted job is split into shards of shard_size instances; shard inputs
+    and parsed results are stored as files under job_dir so jobs survive
+    Streamlit reruns and process restarts. Workers claim queued shards from the
+    database, score them with predictor(job, instances) and record progress.
+    """
+
+    def __init__(self, db_path: str = JOB_DB_PATH, job_dir: str = JOB_DIR, num_workers: int = JOB_WORKERS,
+                 shard_size: int = JOB_SHARD_SIZE, predictor=None):
+        self.db_path = db_path
+        self.job_dir = job_dir
+        self.num_workers = num_workers
+        self.shard_size = shard_size
+        self.predictor = predictor or _default_predictor
+        self._stop = threading.Event()
+        self._workers = []
+
+        os.makedirs(self.job_dir, exist_ok=True)
+        if os.path.dirname(self.db_path):
+            os.makedirs(os.path.dirname(self.db_path), exist_ok=True)
+        with closing(self._connect()) as conn:
+            conn.executescript(SCHEMA)
+            self._requeue_stale(conn)
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(self.db_path, timeout=30, isolation_level=None)
+        conn.row_factory = sqlite3.Row
+        conn.execute("PRAGMA journal_mode=WAL")
+        return conn
+
+    def _shard_path(self, job_id: str, shard_idx: int, kind: str) -> str:
+        suffix = "json" if kind == "input" else "parquet"
+        return os.path.join(self.job_dir, job_id, f"{kind}_{shard_idx:05d}.{suffix}")
+
+    # --- Workers ---
+    def start(self):
+        if self._workers:
+            return self
+        for i in range(self.num_workers):
+            worker = threading.Thread(target=self._worker_loop, name=f"prediction-worker-{i}", daemon=True)
+            worker.start()
+            self._workers.append(worker)
+        return self
+
+    def stop(self, timeout: float = 5.0):
+        self._stop.set()
+        for worker in self._workers:
+            worker.join(timeout)
+        self._workers = []
+        self._stop.clear()
+
+    def _requeue_stale(self, conn):
+        """Shards left running by a crashed or killed process go back on the queue."""
+        requeued = conn.execute(
+            "UPDATE shards SET status = 'queued', started_at = NULL WHERE status = 'running' AND started_at < ?",
+            (time.time() - STALE_SHARD_SECONDS,),
+        ).rowcount
+        if requeued:
+            logging.warning(f"Re-queued {requeued} stale prediction shard(s).")
+
+    def _claim_shard(self, conn):
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            row = conn.execute(
+                "SELECT job_id, shard_idx FROM shards WHERE status = 'queued' ORDER BY rowid LIMIT 1"
+            ).fetchone()
+            if row is not None:
+                conn.execute(
+                    "UPDATE shards SET status = 'running', started_at = ? WHERE job_id = ? AND shard_idx = ?",
+                    (time.time(), row["job_id"], row["shard_idx"]),
+                )
+                conn.execute("UPDATE jobs SET status = 'running' WHERE job_id = ? AND status = 'queued'", (row["job_id"],))
+            conn.execute("COMMIT")
+            return row
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+
+    def _worker_loop(self):
+        conn = self._connect()
+        next_sweep = time.monotonic() + STALE_SWEEP_INTERVAL_SECONDS
+        while not self._stop.is_set():
+            try:
+                if time.monotonic() >= next_sweep:
+                    self._requeue_stale(conn)
+                    next_sweep = time.monotonic() + STALE_SWEEP_INTERVAL_SECONDS
+                claimed = self._claim_shard(conn)
+            except sqlite3.OperationalError as e:
+                logging.warning(f"Could not claim prediction shard: {e}")
+                claimed = None
+            if claimed is None:
+                self._stop.wait(POLL_INTERVAL_SECONDS)
+                continue
+            self._run_shard(conn, claimed["job_id"], claimed["shard_idx"])
+        conn.close()
+
+    def _run_shard(self, conn, job_id: str, shard_idx: int):
+        try:
+            row = conn.execute("SELECT * FROM jobs WHERE job_id = ?", (job_id,)).fetchone()
+            if row is None:
+                raise LookupError(f"job {job_id} no longer exists")
+            job = dict(row)
+            with open(self._shard_path(job_id, shard_idx, "input"), "r", encoding="utf-8") as f:
+                shard_input = json.load(f)
+            instances = shard_input["instances"]
+            response = self._predict(job, instances)
+            predictions = getattr(response, "predictions", None) or []
+            if len(predictions) != len(instances):
+                raise ValueError(f"endpoint returned {len(predictions)} prediction(s) for {len(instances)} instance(s)")
+            result = parse_predictions(predictions, shard_input["customer_ids"])
+            result.to_parquet(self._shard_path(job_id, shard_idx, "result"), index=False)
+            conn.execute(
+                "UPDATE shards SET status = 'done', finished_at = ? WHERE job_id = ? AND shard_idx = ?",
+                (time.time(), job_id, shard_idx),
+            )
+        except Exception as e:
+            logging.error(f"Prediction job {job_id} shard {shard_idx} failed: {e}")
+            try:
+                conn.execute(
+                    "UPDATE shards SET status = 'failed', finished_at = ?, error = ? WHERE job_id = ? AND shard_idx = ?",
+                    (time.time(), str(e), job_id, shard_idx),
+                )
+            except sqlite3.Error as db_error:
+                # Left 'running'; the stale sweep re-queues it
+                logging.warning(f"Could not mark prediction job {job_id} shard {shard_idx} failed: {db_error}")
+        try:
+            self._update_job_status(conn, job_id)
+        except sqlite3.Error as e:
+            logging.warning(f"Could not update status of prediction job {job_id}: {e}")
+
+    def _predict(self, job: dict, instances: list):
+        # A hung call is abandoned (its thread cannot be killed) rather than holding the worker forever
+        pool = ThreadPoolExecutor(max_workers=1)
+        try:
+            return pool.submit(self.predictor, job, instances).result(timeout=PREDICT_TIMEOUT_SECONDS)
+        except FutureTimeoutError:
+            raise TimeoutError(f"predictor call timed out after {PREDICT_TIMEOUT_SECONDS:g}s") from None
+        finally:
+            pool.shutdown(wait=False)
+
+    def _update_job_status(self, conn, job_id: str):
+        counts = dict(conn.execute(
+            "SELECT status, COUNT(*) FROM shards WHERE job_id = ? GROUP BY status", (job_id,)
+        ).fetchall())
+        if counts.get("queued", 0) or counts.get("running", 0):
+            return
+        if counts.get("failed", 0):
+            error = conn.execute(
+                "SELECT error FROM shards WHERE job_id = ? AND status = 'failed' LIMIT 1", (job_id,)
+            ).fetchone()[0]
+            conn.execute("UPDATE jobs SET status = 'failed', finished_at = ?, error = ? WHERE job_id = ?",
+                         (time.time(), f"{counts['failed']} shard(s) failed: {error}", job_id))
+        else:
+            conn.execute("UPDATE jobs SET status = 'done', finished_at = ? WHERE job_id = ?", (time.time(), job_id))
+
+    # --- Client API ---
+    def submit(self, instances: list, customer_ids=None, endpoint_id=None, project=None,
+               location=None, backend=None) -> str:
+        """Queues a prediction job and returns its job ID."""
+        job_id = uuid.uuid4().hex[:12]
+        if customer_ids is None:
+            customer_ids = [f"UnknownCustID_{i+1}" for i in range(len(instances))]
+        customer_ids = [str(c) for c in customer_ids]
+
+        os.makedirs(os.path.join(self.job_dir, job_id), exist_ok=True)
+        shard_rows = []
+        for shard_idx, start in enumerate(range(0, len(instances), self.shard_size)):
+            shard_instances = instances[start:start + self.shard_size]
+            with open(self._shard_path(job_id, shard_idx, "input"), "w", encoding="utf-8") as f:
+                json.dump({"instances": shard_instances,
+                           "customer_ids": customer_ids[start:start + self.shard_size]}, f, default=str)
+            shard_rows.append((job_id, shard_idx, "queued", len(shard_instances)))
+
+        with closing(self._connect()) as conn:
+            conn.execute("BEGIN")
+            conn.execute(
+                "INSERT INTO jobs (job_id, status, endpoint_id, project, location, backend, n_instances, n_shards, created_at) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (job_id, "queued" if shard_rows else "done", endpoint_id, project, location, backend,
+                 len(instances), len(shard_rows), time.time()),
+            )
+            conn.executemany("INSERT INTO shards (job_id, shard_idx, status, n_instances) VALUES (?, ?, ?, ?)", shard_rows)
+            conn.execute("COMMIT")
+        logging.info(f"Submitted prediction job {job_id}: {len(instances)} instances in {len(shard_rows)} shards.")
+        return job_id
+
+    def status(self, job_id: str) -> dict | None:
+        """Job row plus per-shard progress counts."""
+        with closing(self._connect()) as conn:
+            job = conn.execute("SELECT * FROM jobs WHERE job_id = ?", (job_id,)).fetchone()
+            if job is None:
+                return None
+            job = dict(job)
+            counts = dict(conn.execute(
+                "SELECT status, COUNT(*) FROM shards WHERE job_id = ? GROUP BY status", (job_id,)
+            ).fetchall())
+        job["shards_done"] = counts.get("done", 0)
+        job["shards_failed"] = counts.get("failed", 0)
+        job["shards_running"] = counts.get("running", 0)
+        job["progress"] = (job["shards_done"] + job["shards_failed"]) / job["n_shards"] if job["n_shards"] else 1.0
+        return job
+
+    def shards(self, job_id: str) -> pd.DataFrame:
+        with closing(self._connect()) as conn:
+            rows = conn.execute(
+                "SELECT shard_idx, status, n_instances, started_at, finished_at, error FROM shards "
+                "WHERE job_id = ? ORDER BY shard_idx", (job_id,)
+            ).fetchall()
+        shards = pd.DataFrame([dict(r) for r in rows])
+        if not shards.empty:
+            shards["latency_s"] = shards["finished_at"] - shards["started_at"]
+        return shards
+
+    def result(self, job_id: str) -> pd.DataFrame | None:
+        """Concatenated parsed results of all finished shards, in submission order."""
+        job = self.status(job_id)
+        if job is None or job["status"] not in ("done", "failed"):
+            return None
+        frames = [
+            pd.read_parquet(self._shard_path(job_id, i, "result"))
+            for i in range(job["n_shards"])
+            if os.path.exists(self._shard_path(job_id, i, "result"))
+        ]
+        return pd.concat(frames, ignore_index=True) if frames else pd.DataFrame()
+
+    def delete(self, job_id: str):
+        with closing(self._connect()) as conn:
+            conn.execute("DELETE FROM shards WHERE job_id = ?", (job_id,))
+            conn.execute("DELETE FROM jobs WHERE job_id = ?", (job_id,))
+        shutil.rmtree(os.path.join(self.job_dir, job_id), ignore_errors=True)
+
+    def metrics(self, window_seconds: int = 300) -> dict:
+        """Queue depth and recent throughput."""
+        since = time.time() - window_seconds
+        with closing(self._connect()) as conn:
+            queued_shards, queued_instances = conn.execute(
+                "SELECT COUNT(*), COALESCE(SUM(n_instances), 0) FROM shards WHERE status = 'queued'"
+            ).fetchone()
+            running_shards = conn.execute("SELECT COUNT(*) FROM shards WHERE status = 'running'").fetchone()[0]
+            active_jobs = conn.execute("SELECT COUNT(*) FROM jobs WHERE status IN ('queued', 'running')").fetchone()[0]
+            recent_shards, recent_instances = conn.execute(
+                "SELECT COUNT(*), COALESCE(SUM(n_instances), 0) FROM shards WHERE status = 'done' AND finished_at >= ?",
+                (since,),
+            ).fetchone()
+            recent_jobs = conn.execute(
+                "SELECT COUNT(*) FROM jobs WHERE status = 'done' AND finished_at >= ?", (since,)
+            ).fetchone()[0]
+        return {
+            "active_jobs": active_jobs,
+            "queued_shards": queued_shards,
+            "queued_instances": queued_instances,
+            "running_shards": running_shards,
+            "shards_per_min": recent_shards * 60 / window_seconds,
+            "instances_per_sec": recent_instances / window_seconds,
+            "jobs_per_min": recent_jobs * 60 / window_seconds,
+        }
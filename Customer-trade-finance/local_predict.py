@@ -0,0 +1,76 @@
+import os
+import numpy as np
+import pandas as pd
+
+# Exported model artifact: a joblib file holding either a fitted classifier
+# (anything with predict_proba/classes_, e.g. a scikit-learn Pipeline) or a
+# dict {"model": classifier, "features": [ordered input column names]}.
+LOCAL_MODEL_PATH = os.getenv("LOCAL_MODEL_PATH", "model/model.joblib")
+LOCAL_BATCH_SIZE = 10000
+
+_model_cache = {}
+
+
+class LocalPredictionResponse:
+    """Mirrors the part of the Vertex PredictResponse the apps use (.predictions)."""
+
+    def __init__(self, predictions, deployed_model_id="local"):
+        self.predictions = predictions
+        self.deployed_model_id = deployed_model_id
+
+
+def local_model_available(model_path: str | None = None) -> bool:
+    return os.path.exists(model_path or LOCAL_MODEL_PATH)
+
+
+def load_local_model(model_path: str | None = None):
+    """Loads the exported artifact once per (path, mtime) and returns (model, feature_names)."""
+    import joblib
+
+    model_path = model_path or LOCAL_MODEL_PATH
+    cache_key = (os.path.abspath(model_path), os.path.getmtime(model_path))
+    if cache_key not in _model_cache:
+        artifact = joblib.load(model_path)
+        if isinstance(artifact, dict):
+            model, features = artifact["model"], artifact.get("features")
+        else:
+            model, features = artifact, getattr(artifact, "feature_names_in_", None)
+        _model_cache.clear()
+        _model_cache[cache_key] = (model, list(features) if features is not None else None)
+    return _model_cache[cache_key]
+
+
+def _coerce_numeric(frame: pd.DataFrame) -> pd.DataFrame:
+    """Vertex payloads carry numbers as strings; turn fully numeric columns back into numbers."""
+    for col in frame.columns:
+        if frame[col].dtype != object:
+            continue
+        converted = pd.to_numeric(frame[col], errors="coerce")
+        if converted.notna().sum() == frame[col].notna().sum():
+            frame[col] = converted
+    return frame
+
+
+def predict_from_local(instance_list, model_path: str | None = None, batch_size: int = LOCAL_BATCH_SIZE):
+    """
+    Scores instances in-process with the exported model artifact.
+    The whole batch is turned into one frame and scored with vectorized
+    predict_proba calls; output uses the Vertex classes/scores format.
+    """
+    model, features = load_local_model(model_path)
+
+    frame = pd.DataFrame.from_records(instance_list)
+    if features is not None:
+        frame = frame.reindex(columns=features)
+    frame = _coerce_numeric(frame)
+
+    if frame.empty:
+        return LocalPredictionResponse([])
+
+    probs = np.vstack([
+        model.predict_proba(frame.iloc[start:start + batch_size])
+        for start in range(0, len(frame), batch_size)
+    ])
+    classes = [str(c) for c in model.classes_]
+    predictions = [{"classes": classes, "scores": row} for row in probs.tolist()]
+    return LocalPredictionResponse(predictions)
@@ -1,10 +1,12 @@
 import streamlit as st
 import pandas as pd
 import os
-import numpy as np
 import json
 from dotenv import load_dotenv
 from vertex_predict import predict_from_vertex
+from prediction_parser import parse_predictions
+from results_view import render_prediction_table, render_schema_report
+from feature_schema import get_schema, SchemaValidationError, MODE_REPAIR, MODE_REJECT
 from utils.gcs_helper import download_blob_as_df
 
 # Load environment variables
@@ -23,6 +25,8 @@ uploaded_file = st.file_uploader("...or upload a CSV file", type=["csv"], key="f
 # Button to trigger data loading and processing
 if st.button("Load Data"):
     df = None
+    # Results from the previous data no longer apply
+    st.session_state.prediction_results = None
     if gcs_path:
         try:
             df = download_blob_as_df(gcs_path)
@@ -70,20 +74,20 @@ if 'df' in st.session_state and st.session_state.df is not None:
         st.warning("No 'Customer_Id' column found or it is empty.")
 
 
-    # Ensure correct types (moved this logic to be processed only after data loading)
-    columns_to_cast_as_string = [
-        'Years_in_Operation', 'Annual_Revenue', 'Customer_Id', 'Company_ID', 'Profitability_Status',
-        'Requested_Guarantee', 'Total_Requested_Guarantee', 'Max_Requested_Guarantee',
-        'On_Time_Payment_Rate', 'Avg_Days_Late', 'Product_Mix', 'Country', 'Counterparty_Country','Profit_Margin','Debt_to_Equity','Credit_Score','Previous_BGs',
-        'Total_BG_Value','Default_Count','Transaction_Value','Requested_Guarantee','Total_Requested_Guarantee','Max_Requested_Guarantee','On_Time_Payment_Rate','Avg_Days_Late','Cash_Flow_Gap_Days'
-    ]
-
-    for col in columns_to_cast_as_string:
-        if col in df.columns:
-            df[col] = df[col].apply(lambda x: str(x) if pd.notnull(x) else x)
-
-    # Replace NaN with None
-    df = df.where(pd.notnull(df), None)
+    # Validate and coerce against the endpoint's feature schema before any Vertex call
+    feature_schema = get_schema(endpoint_id=os.getenv("VERTEX_ENDPOINT_ID"))
+    validation_mode = st.radio("Invalid values", [MODE_REPAIR, MODE_REJECT], horizontal=True,
+                               help="repair: null out unparseable values and clip out-of-range ones; reject: drop rows holding them")
+    try:
+        df, schema_report, rejected_rows = feature_schema.validate(df, mode=validation_mode)
+    except SchemaValidationError as e:
+        st.error(f"Input does not match feature schema '{feature_schema.version}': {e}")
+        st.dataframe(e.report, hide_index=True)
+        st.stop()
+    render_schema_report(feature_schema, schema_report, rejected_rows)
+    # Rejected rows are gone from df; keep the ID list aligned with what is sent
+    if 'Customer_Id' in df.columns:
+        ids_to_display = df['Customer_Id'].tolist()
 
     # --- Prediction Trigger ---
     if st.button("Run Prediction"):
@@ -99,59 +103,16 @@ if 'df' in st.session_state and st.session_state.df is not None:
                 instance_list=instances
             )
 
-            st.subheader("Prediction Results")
-
             if not response or not hasattr(response, 'predictions') or not response.predictions:
+                st.session_state.prediction_results = None
                 st.warning("No predictions received from the model.")
             else:
-                for i, prediction in enumerate(response.predictions):
-                    predicted_class = "Unknown"
-                    confidence = 0.0
-
-                    try:
-                        # Try Format 1: displayName + confidence
-                        if 'displayName' in prediction and 'confidence' in prediction:
-                            predicted_class = prediction['displayName']
-                            confidence_val = prediction['confidence']
-                            if isinstance(confidence_val, (int, float)):
-                                confidence = float(confidence_val)
-                            else:
-                                st.warning(f"Record {i+1}: Invalid confidence format for displayName format.")
-
-                        # Try Format 2: classes + scores
-                        elif 'classes' in prediction and 'scores' in prediction:
-                            if prediction['scores'] and prediction['classes']:
-                                scores = np.array(prediction['scores'])
-                                classes = prediction['classes']
-                                if scores.size > 0 and len(classes) == scores.size:
-                                    idx = np.argmax(scores)
-                                    predicted_class = classes[idx]
-                                    confidence_val = scores[idx]
-                                    if isinstance(confidence_val, (int, float)):
-                                        confidence = float(confidence_val)
-                                    else:
-                                        st.warning(f"Record {i+1}: Invalid confidence format for classes/scores format.")
-                                else:
-                                    st.warning(f"Record {i+1}: Mismatch or empty scores/classes in classes/scores format.")
-                            else:
-                                st.warning(f"Record {i+1}: Empty scores or classes found.")
-                        else:
-                            st.warning(f"Record {i+1}: Unrecognized prediction format.")
-
-                        # Display result
-                        if isinstance(confidence, (int, float)):
-                            # Use the customer ID from the original DataFrame
-                            # Ensure we don't go out of bounds if prediction length != customer_id length
-                            cust_id_display = ids_to_display[i] if i < len(ids_to_display) else f"UnknownCustID_{i+1}"
-                            st.write(f"**{cust_id_display}:** Predicted Class = {predicted_class}, Confidence = {round(confidence * 100, 2)}%")
-                        else:
-                            cust_id_display = ids_to_display[i] if i < len(ids_to_display) else f"UnknownCustID_{i+1}"
-                            st.write(f"**{cust_id_display}:** Predicted Class = {predicted_class}, Confidence = N/A (Invalid format)")
-
-                    except Exception as parse_err:
-                        st.error(f"Prediction parsing failed for record {i+1}: {parse_err}")
-                        # Optional: log raw data for debugging
-                        # st.write(f"**Record {i+1}:** Raw prediction data: {prediction}")
+                # Parse all predictions in one pass; keep them across reruns for paging/sorting
+                st.session_state.prediction_results = parse_predictions(response.predictions, ids_to_display)
 
         except Exception as e:
-            st.error(f"Prediction failed: {e}")
\ No newline at end of file
+            st.error(f"Prediction failed: {e}")
+
+    if st.session_state.get("prediction_results") is not None:
+        st.subheader("Prediction Results")
+        render_prediction_table(st.session_state.prediction_results)
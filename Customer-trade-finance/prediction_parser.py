@@ -0,0 +1,109 @@
+import numpy as np
+import pandas as pd
+
+# Status values recorded per row instead of emitting one st.warning per record
+STATUS_OK = "ok"
+STATUS_INVALID_CONFIDENCE = "invalid confidence"
+STATUS_MISMATCHED = "empty or mismatched scores/classes"
+STATUS_INVALID_SCORES = "invalid scores"
+STATUS_UNRECOGNIZED = "unrecognized format"
+
+SCORE_COLUMN_PREFIX = "score_"
+
+
+def _as_dict(prediction) -> dict:
+    """Vertex returns proto MapComposite objects; plain dicts pass through."""
+    if isinstance(prediction, dict):
+        return prediction
+    try:
+        return dict(prediction)
+    except (TypeError, ValueError):
+        return {}
+
+
+def parse_predictions(predictions, customer_ids=None) -> pd.DataFrame:
+    """
+    Parses Vertex AI prediction outputs into a columnar result.
+
+    Handles both response formats (displayName + confidence, classes + scores).
+    classes/scores rows are stacked into one score matrix and the predicted class
+    is picked with a single batched argmax. Returns one row per prediction with
+    customer_id, predicted_class, confidence, confidence_pct, status and one
+    score_<class> column per class seen in the response.
+    """
+    records = [_as_dict(p) for p in (predictions or [])]
+    n = len(records)
+
+    predicted = np.full(n, "Unknown", dtype=object)
+    confidence = np.full(n, np.nan)
+    status = np.full(n, STATUS_OK, dtype=object)
+
+    # Group classes/scores rows by their class vector so each group fills one dense block
+    groups = {}
+    for i, record in enumerate(records):
+        if "displayName" in record and "confidence" in record:
+            predicted[i] = record["displayName"]
+            confidence_val = record["confidence"]
+            if isinstance(confidence_val, (int, float)):
+                confidence[i] = confidence_val
+            else:
+                status[i] = STATUS_INVALID_CONFIDENCE
+        elif "classes" in record and "scores" in record:
+            classes = tuple(str(c) for c in (record["classes"] or ()))
+            scores = list(record["scores"] or ())
+            if not classes or len(classes) != len(scores):
+                status[i] = STATUS_MISMATCHED
+                continue
+            rows, blocks = groups.setdefault(classes, ([], []))
+            rows.append(i)
+            blocks.append(scores)
+        else:
+            status[i] = STATUS_UNRECOGNIZED
+
+    # Ordered union of all class labels -> score matrix columns
+    all_classes = list(dict.fromkeys(c for classes in groups for c in classes))
+    class_pos = {c: j for j, c in enumerate(all_classes)}
+    score_matrix = np.full((n, len(all_classes)), np.nan)
+
+    for classes, (rows, blocks) in groups.items():
+        rows = np.asarray(rows)
+        try:
+            block = np.asarray(blocks, dtype=float)
+        except (TypeError, ValueError):
+            # Slow path only for groups holding a malformed row
+            block = np.full((len(rows), len(classes)), np.nan)
+            for r, scores in enumerate(blocks):
+                try:
+                    block[r] = np.asarray(scores, dtype=float)
+                except (TypeError, ValueError):
+                    status[rows[r]] = STATUS_INVALID_SCORES
+        cols = np.asarray([class_pos[c] for c in classes])
+        score_matrix[np.ix_(rows, cols)] = block
+
+    if all_classes:
+        has_scores = ~np.isnan(score_matrix).all(axis=1)
+        best = np.where(np.isnan(score_matrix), -np.inf, score_matrix).argmax(axis=1)
+        class_labels = np.asarray(all_classes, dtype=object)
+        predicted[has_scores] = class_labels[best[has_scores]]
+        confidence[has_scores] = score_matrix[has_scores, best[has_scores]]
+
+    if customer_ids is None:
+        customer_ids = []
+    customer_ids = list(customer_ids)[:n]
+    customer_ids += [f"UnknownCustID_{i+1}" for i in range(len(customer_ids), n)]
+
+    result = pd.DataFrame({
+        "customer_id": customer_ids,
+        "predicted_class": predicted,
+        "confidence": confidence,
+        "confidence_pct": np.round(confidence * 100, 2),
+        "status": status,
+    })
+    scores_df = pd.DataFrame(score_matrix, columns=[f"{SCORE_COLUMN_PREFIX}{c}" for c in all_classes])
+    return pd.concat([result, scores_df], axis=1)
+
+
+def score_matrix(results: pd.DataFrame) -> np.ndarray:
+    """Returns the (n_rows, n_classes) score matrix held in a parsed result frame."""
+    score_cols = [c for c in results.columns if c.startswith(SCORE_COLUMN_PREFIX)]
+    return results[score_cols].to_numpy(dtype=float)
@@ -0,0 +1,66 @@
+import io
+import math
+import streamlit as st
+import pandas as pd
+
+PAGE_SIZE_OPTIONS = [50, 100, 500, 1000]
+
+
+@st.cache_data(show_spinner=False)
+def _to_csv_bytes(df: pd.DataFrame) -> bytes:
+    return df.to_csv(index=False).encode("utf-8")
+
+
+@st.cache_data(show_spinner=False)
+def _to_parquet_bytes(df: pd.DataFrame) -> bytes:
+    buffer = io.BytesIO()
+    df.to_parquet(buffer, index=False)
+    return buffer.getvalue()
+
+
+def render_prediction_table(results: pd.DataFrame, key: str = "predictions"):
+    """
+    Renders parsed predictions as one sortable, paginated table with CSV/Parquet download.
+    Sorting is applied to the whole result before slicing so pages stay consistent.
+    """
+    if results is None or results.empty:
+        st.warning("No predictions received from the model.")
+        return
+
+    # Summarise problem rows once instead of warning per record
+    issues = results.loc[results["status"] != "ok", "status"].value_counts()
+    for issue, count in issues.items():
+        st.warning(f"{count} record(s): {issue}.")
+
+    st.write(results["predicted_class"].value_counts().rename("count"))
+
+    col1, col2, col3, col4 = st.columns(4)
+    sort_col = col1.selectbox("Sort by", results.columns.tolist(), index=results.columns.get_loc("confidence"), key=f"{key}_sort")
+    ascending = col2.toggle("Ascending", value=False, key=f"{key}_asc")
+    page_size = col3.selectbox("Rows per page", PAGE_SIZE_OPTIONS, key=f"{key}_page_size")
+    n_pages = max(1, math.ceil(len(results) / page_size))
+    page = col4.number_input(f"Page (1-{n_pages})", min_value=1, max_value=n_pages, value=1, step=1, key=f"{key}_page")
+
+    sorted_results = results.sort_values(sort_col, ascending=ascending, kind="stable", na_position="last")
+    start = (int(page) - 1) * page_size
+    st.dataframe(sorted_results.iloc[start:start + page_size], use_container_width=True, hide_index=True)
+    st.caption(f"Showing rows {start + 1}-{min(start + page_size, len(results))} of {len(results)}")
+
+    dl1, dl2 = st.columns(2)
+    dl1.download_button("Download CSV", _to_csv_bytes(results), file_name="predictions.csv", mime="text/csv", key=f"{key}_csv")
+    try:
+        dl2.download_button("Download Parquet", _to_parquet_bytes(results), file_name="predictions.parquet", mime="application/octet-stream", key=f"{key}_parquet")
+    except ImportError as e:
+        dl2.caption(f"Parquet download unavailable: {e}")
+
+
+def render_schema_report(schema, report: pd.DataFrame, rejected: pd.DataFrame, key: str = "schema"):
+    """Shows the per-column validation report and any rejected rows before prediction."""
+    problems = report[~report["status"].isin(["ok", "missing"])] if not report.empty else report
+    label = f"Schema check ({schema.version}): {len(rejected)} row(s) rejected, {len(problems)} column(s) flagged"
+    with st.expander(label, expanded=len(rejected) > 0):
+        st.dataframe(report, use_container_width=True, hide_index=True)
+        if not rejected.empty:
+            st.write("Rejected rows (not sent for prediction):")
+            st.dataframe(rejected, use_container_width=True)
+            st.download_button("Download rejected rows", _to_csv_bytes(rejected), file_name="rejected_rows.csv", mime="text/csv", key=f"{key}_rejected")
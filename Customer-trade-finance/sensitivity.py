@@ -0,0 +1,121 @@
+import numpy as np
+import pandas as pd
+from prediction_parser import parse_predictions
+
+# Relative perturbations applied to each selected feature (0.0 = unchanged baseline)
+DEFAULT_STEPS = [-0.3, -0.2, -0.1, 0.0, 0.1, 0.2, 0.3]
+DEFAULT_MAX_INSTANCES = 20000
+# Instances per predictor call; keeps online prediction payloads under the request size limit
+DEFAULT_SCORING_BATCH_SIZE = 1000
+
+# Bookkeeping columns added to the grid; stripped before scoring
+GRID_COLUMNS = ["_row", "_feature", "_step", "_value"]
+
+
+def fit_steps_to_budget(steps, n_rows: int, n_features: int, max_instances: int) -> list:
+    """
+    Thins the step list evenly (always keeping both ends and the baseline) so
+    n_rows * n_features * len(steps) stays within max_instances.
+    """
+    steps = sorted(set(float(s) for s in steps) | {0.0})
+    per_feature_budget = max_instances // max(1, n_rows * n_features)
+    if per_feature_budget < 2:
+        raise ValueError(
+            f"Budget of {max_instances} instances is too small for {n_rows} rows x {n_features} features "
+            f"(need at least {2 * n_rows * n_features})."
+        )
+    if len(steps) <= per_feature_budget:
+        return steps
+    keep = np.unique(np.linspace(0, len(steps) - 1, per_feature_budget - 1).round().astype(int))
+    return sorted(set(steps[i] for i in keep) | {0.0})
+
+
+def build_perturbation_grid(df: pd.DataFrame, features, steps, integer_features=()) -> pd.DataFrame:
+    """
+    Builds every (row, feature, step) variant of df in one vectorized pass.
+    Each variant copies the row and scales one feature by (1 + step); integer
+    columns, and integer_features, are rounded back to integers.
+    """
+    steps = np.asarray(steps, dtype=float)
+    n_rows, n_steps = len(df), len(steps)
+    frames = []
+    for feature in features:
+        base = pd.to_numeric(df[feature], errors="coerce").to_numpy(dtype=float)
+        grid = df.iloc[np.repeat(np.arange(n_rows), n_steps)].reset_index(drop=True)
+        values = np.repeat(base, n_steps) * (1 + np.tile(steps, n_rows))
+        if feature in integer_features or pd.api.types.is_integer_dtype(df[feature]):
+            values = np.round(values)
+        grid[feature] = values
+        grid["_row"] = np.repeat(np.arange(n_rows), n_steps)
+        grid["_feature"] = feature
+        grid["_step"] = np.tile(steps, n_rows)
+        grid["_value"] = values
+        frames.append(grid)
+    return pd.concat(frames, ignore_index=True)
+
+
+def run_sensitivity(df: pd.DataFrame, features, predictor, steps=None, customer_ids=None,
+                    max_instances: int = DEFAULT_MAX_INSTANCES,
+                    batch_size: int = DEFAULT_SCORING_BATCH_SIZE, integer_features=(),
+                    prepare=None) -> pd.DataFrame:
+    """
+    Scores a perturbation grid for the selected features and returns the
+    per-feature response curves (one row per customer, feature and step).
+
+    predictor is called with a list of instance dicts and must return an object
+    with .predictions (e.g. functools.partial(predict_from_vertex, ...)).
+    integer_features are rounded after scaling, like integer columns. prepare,
+    if given, maps the perturbed payload frame to what is actually sent (e.g. re-validating it against the feature schema) and must keep
+    every row. Identical variants are scored once, in batches of batch_size.
+    """
+    missing = [f for f in features if f not in df.columns]
+    if missing:
+        raise ValueError(f"Features not found in data: {missing}")
+
+    steps = fit_steps_to_budget(steps or DEFAULT_STEPS, len(df), len(features), max_instances)
+    grid = build_perturbation_grid(df, features, steps, integer_features)
+
+    # Deduplicate on the payload columns; the baseline step is identical for every feature
+    payload = grid.drop(columns=GRID_COLUMNS)
+    if prepare is not None:
+        payload = prepare(payload)
+        if len(payload) != len(grid):
+            raise ValueError(f"prepare dropped {len(grid) - len(payload)} of {len(grid)} perturbed rows")
+    row_hash = pd.util.hash_pandas_object(payload, index=False).to_numpy()
+    unique_hash, first_idx, inverse = np.unique(row_hash, return_index=True, return_inverse=True)
+    unique_payload = payload.iloc[first_idx]
+    unique_payload = unique_payload.astype(object).where(unique_payload.notna(), None)
+    instances = unique_payload.to_dict(orient="records")
+
+    predictions = []
+    for start in range(0, len(instances), batch_size):
+        response = predictor(instances[start:start + batch_size])
+        predictions.extend(response.predictions)
+
+    scored = parse_predictions(predictions).drop(columns=["customer_id"])
+    curves = scored.iloc[inverse].reset_index(drop=True)
+
+    if customer_ids is None:
+        customer_ids = [f"Row_{i+1}" for i in range(len(df))]
+    customer_ids = np.asarray(list(customer_ids), dtype=object)
+
+    result = pd.DataFrame({
+        "customer_id": customer_ids[grid["_row"].to_numpy()],
+        "feature": grid["_feature"].to_numpy(),
+        "step": grid["_step"].to_numpy(),
+        "value": grid["_value"].to_numpy(),
+    })
+    result = pd.concat([result, curves], axis=1)
+    result.attrs["instances_scored"] = len(instances)
+    result.attrs["grid_size"] = len(grid)
+    return result
+
+
+def class_flips(curves: pd.DataFrame) -> pd.DataFrame:
+    """Per customer and feature: baseline class and whether any perturbation changes it."""
+    baseline = curves[curves["step"] == 0.0].set_index(["customer_id", "feature"])["predicted_class"]
+    n_classes = curves.groupby(["customer_id", "feature"])["predicted_class"].nunique()
+    return pd.DataFrame({
+        "baseline_class": baseline,
+        "class_changes": n_classes > 1,
+    }).reset_index()
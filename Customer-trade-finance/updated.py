@@ -1,9 +1,14 @@
 import streamlit as st
 import pandas as pd
-import os
 import numpy as np
+import os
+import functools
 from dotenv import load_dotenv
 from vertex_predict import predict_from_vertex
+from prediction_parser import parse_predictions
+from results_view import render_prediction_table, render_schema_report
+from feature_schema import get_schema, SchemaValidationError, MODE_REPAIR, MODE_REJECT
+from sensitivity import run_sensitivity, class_flips, DEFAULT_MAX_INSTANCES
 from utils.gcs_helper import download_blob_as_df
  
 # Load environment variables
@@ -18,51 +23,17 @@ st.subheader("Provide Input Data")
 gcs_path = st.text_input("Enter GCS path (e.g. gs://your-bucket/input.csv)", key="gcs_path_input")
 uploaded_file = st.file_uploader("...or upload a CSV file", type=["csv"], key="file_uploader")
  
-# Column mapping to match Vertex AI expected names
-# IMPORTANT: Use lowercase and underscores for internal representation.
-# The actual renaming will happen right before prediction.
-internal_column_map = {
-    'customer_id': 'customer_id',
-    'company_name': 'company_name',
-    'total_bg_value': 'total_bg_value',
-    'default_count': 'default_count',
-    'transaction_count': 'transaction_count',
-    'requested_guarantee': 'requested_guarantee',
-    'profit_margin': 'profit_margin',
-    'debt_to_equity': 'debt_to_equity',
-    'credit_score': 'credit_score',
-    'previous_bg': 'previous_bg',
-    'max_requested_guarantee': 'max_requested_guarantee',
-    'on_time_payment_rate': 'on_time_payment_rate',
-    'avg_days_late': 'avg_days_late',
-    'product_mix': 'product_mix',
-    'counter_party_count': 'counter_party_count',
-    'cash_flow_gap_days': 'cash_flow_gap_days'
-}
-
-# Mapping from internal representation to Vertex AI expected names
-vertex_ai_column_map = {
-    'customer_id': 'Customer_ID',
-    'company_name': 'Company_Name',
-    'total_bg_value': 'Total_BG_Value',
-    'default_count': 'Default_Count',
-    'transaction_count': 'Transaction_Count',
-    'requested_guarantee': 'Requested_Guarantee',
-    'profit_margin': 'Profit_Margin',
-    'debt_to_equity': 'Debt_to_Equity',
-    'credit_score': 'Credit_Score',
-    'previous_bg': 'Previous_BG',
-    'max_requested_guarantee': 'Max_Requested_Guarantee',
-    'on_time_payment_rate': 'On_Time_Payment_Rate',
-    'avg_days_late': 'Avg_Days_Late',
-    'product_mix': 'Product_Mix',
-    'counter_party_count': 'Counter_Party_Count',
-    'cash_flow_gap_days': 'Cash_Flow_Gap_Days'
-}
+# Feature schema for the configured endpoint (see feature_schema.py). Internal
+# columns are lowercase with underscores; the schema maps them to Vertex AI names.
+feature_schema = get_schema(endpoint_id=os.getenv("VERTEX_ENDPOINT_ID"), default="customer360_v2")
+vertex_ai_column_map = feature_schema.internal_names()
 
 # --- Load Data ---
 if st.button("Load Data"):
     df = None
+    # Results from the previous data no longer apply
+    st.session_state.prediction_results = None
+    st.session_state.sensitivity_curves = None
     if gcs_path:
         try:
             df = download_blob_as_df(gcs_path)
@@ -103,33 +74,30 @@ if 'df' in st.session_state and st.session_state.df is not None:
         st.warning("No 'Customer_Id' column found or it is empty")
         st.session_state.customer_ids = [] # Ensure it's an empty list if not found
  
-    # ✅ Convert numeric columns safely
-    numeric_cols_internal = ['total_bg_value', 'default_count', 'transaction_count', 'requested_guarantee',
-                             'profit_margin', 'debt_to_equity', 'credit_score', 'previous_bg',
-                             'max_requested_guarantee', 'on_time_payment_rate', 'avg_days_late',
-                             'product_mix', 'counter_party_count', 'cash_flow_gap_days']
-    
-    for col in numeric_cols_internal:
-        if col in df_display.columns:
-            df_display[col] = pd.to_numeric(df_display[col], errors='coerce')
- 
-    # Replace NaN with None
-    df_display = df_display.where(pd.notnull(df_display), None)
+    # Numeric features (internal names): the sensitivity analysis can perturb these
+    numeric_cols_internal = [internal for internal, name in vertex_ai_column_map.items()
+                             if feature_schema.spec(name).dtype != "string"]
+ 
+    # ✅ Validate and coerce with the feature schema before any Vertex call
+    validation_mode = st.radio("Invalid values", [MODE_REPAIR, MODE_REJECT], horizontal=True,
+                               help="repair: null out unparseable values and clip out-of-range ones; reject: drop rows holding them")
+    try:
+        df_valid, schema_report, rejected_rows = feature_schema.validate(st.session_state.df, mode=validation_mode)
+    except SchemaValidationError as e:
+        st.error(f"Input does not match feature schema '{feature_schema.version}': {e}")
+        st.dataframe(e.report, hide_index=True)
+        st.stop()
+    render_schema_report(feature_schema, schema_report, rejected_rows)
+    valid_customer_ids = df_valid['Customer_ID'].tolist() if 'Customer_ID' in df_valid.columns else []
  
     # --- Prediction Trigger ---
     if st.button("Run Prediction"):
         try:
-            # Create a DataFrame for prediction with Vertex AI-expected column names
-            df_to_predict = st.session_state.df.copy() # Use the original internal format of the dataframe
- 
-            # ✅ Rename columns to the original names expected by Vertex AI
-            df_to_predict.rename(columns=vertex_ai_column_map, inplace=True)
- 
             # ✅ Debug: show final column names being sent to Vertex AI
-            st.write("📤 Columns sent to Vertex AI:", df_to_predict.columns.tolist())
+            st.write("📤 Columns sent to Vertex AI:", df_valid.columns.tolist())
  
             # Prepare payload
-            instances = df_to_predict.to_dict(orient="records")
+            instances = df_valid.to_dict(orient="records")
  
             # Call Vertex AI
             response = predict_from_vertex(
@@ -139,44 +107,75 @@ if 'df' in st.session_state and st.session_state.df is not None:
                 instance_list=instances
             )
  
-            st.subheader("Prediction Results")
- 
             if not response or not hasattr(response, 'predictions') or not response.predictions:
+                st.session_state.prediction_results = None
                 st.warning("No predictions received from the model.")
             else:
-                # Retrieve customer IDs from session state
-                ids_to_display = st.session_state.get('customer_ids', [])
- 
-                for i, prediction in enumerate(response.predictions):
-                    predicted_class = "Unknown"
-                    confidence = 0.0
- 
-                    try:
-                        # Try Format 1: displayName + confidence
-                        if 'displayName' in prediction and 'confidence' in prediction:
-                            predicted_class = prediction['displayName']
-                            confidence_val = prediction['confidence']
-                            confidence = float(confidence_val) if isinstance(confidence_val, (int, float)) else 0.0
-                        # Try Format 2: classes + scores
-                        elif 'classes' in prediction and 'scores' in prediction:
-                            scores = np.array(prediction['scores'])
-                            classes = prediction['classes']
-                            if scores.size > 0 and len(classes) == scores.size:
-                                idx = np.argmax(scores)
-                                predicted_class = classes[idx]
-                                confidence = float(scores[idx]) if isinstance(scores[idx], (int, float)) else 0.0
-                            else:
-                                st.warning(f"Record {i+1}: Empty or mismatched scores/classes.")
-                        else:
-                            st.warning(f"Record {i+1}: Unrecognized prediction format.")
- 
-                        # Display results using the corresponding customer ID
-                        # Use a fallback if i is out of bounds for customer IDs (shouldn't happen with correct logic)
-                        cust_id_display = ids_to_display[i] if i < len(ids_to_display) else f"CustID_{i+1}_NotFound"
-                        st.write(f"**{cust_id_display}:** Predicted Class = {predicted_class}, Confidence = {round(confidence*100, 2)}%")
- 
-                    except Exception as parse_err:
-                        st.error(f"Prediction parsing failed for record {i+1}: {parse_err}")
- 
+                # Parse all predictions in one pass; keep them across reruns for paging/sorting
+                st.session_state.prediction_results = parse_predictions(response.predictions, valid_customer_ids)
+
+        except Exception as e:
+            st.error(f"Prediction failed: {e}")
+
+    if st.session_state.get("prediction_results") is not None:
+        st.subheader("Prediction Results")
+        render_prediction_table(st.session_state.prediction_results)
+
+    # --- What-if Sensitivity Analysis ---
+    st.subheader("What-if Sensitivity Analysis")
+    sensitivity_candidates = [c for c in numeric_cols_internal if vertex_ai_column_map[c] in df_valid.columns]
+    default_features = [c for c in ['credit_score', 'debt_to_equity', 'requested_guarantee'] if c in sensitivity_candidates]
+    selected_features = st.multiselect("Features to perturb", sensitivity_candidates, default=default_features)
+    col_range, col_steps, col_budget = st.columns(3)
+    max_change = col_range.slider("Max change (+/- %)", min_value=5, max_value=100, value=30, step=5)
+    n_steps = col_steps.number_input("Steps per side", min_value=1, max_value=10, value=3)
+    max_instances = col_budget.number_input("Instance budget", min_value=100, value=DEFAULT_MAX_INSTANCES, step=1000)
+
+    if st.button("Run Sensitivity Analysis") and selected_features:
+        try:
+            # Perturb the validated frame, which already uses Vertex AI-expected names
+            features_to_perturb = [vertex_ai_column_map.get(c, c) for c in selected_features]
+            df_sensitivity = df_valid.copy()
+            for col in features_to_perturb:
+                df_sensitivity[col] = pd.to_numeric(df_sensitivity[col], errors='coerce')
+
+            half = np.linspace(0, max_change / 100, int(n_steps) + 1)[1:]
+            steps = sorted(set((-half).tolist() + [0.0] + half.tolist()))
+
+            predictor = functools.partial(
+                predict_from_vertex,
+                os.getenv("VERTEX_ENDPOINT_ID"),
+                os.getenv("PROJECT_ID"),
+                os.getenv("REGION"),
+            )
+            with st.spinner("Scoring perturbation grid..."):
+                curves = run_sensitivity(
+                    df_sensitivity,
+                    features_to_perturb,
+                    predictor,
+                    steps=steps,
+                    customer_ids=valid_customer_ids or None,
+                    max_instances=int(max_instances),
+                    integer_features=[c for c in features_to_perturb if feature_schema.spec(c).dtype == "integer"],
+                    # Perturbed rows go through the schema again, so they are typed like df_valid
+                    prepare=lambda payload: feature_schema.validate(payload, mode=MODE_REPAIR)[0],
+                )
+            st.session_state.sensitivity_curves = curves
         except Exception as e:
-            st.error(f"Prediction failed: {e}")
\ No newline at end of file
+            st.error(f"Sensitivity analysis failed: {e}")
+
+    curves = st.session_state.get("sensitivity_curves")
+    if curves is not None:
+        st.caption(f"Scored {curves.attrs.get('instances_scored')} unique instances for {curves.attrs.get('grid_size')} grid points.")
+        flips = class_flips(curves)
+        st.write("Customers whose predicted class changes under perturbation:")
+        st.dataframe(flips[flips["class_changes"]], hide_index=True)
+
+        customer = st.selectbox("Customer", curves["customer_id"].unique().tolist(), key="sensitivity_customer")
+        customer_curves = curves[curves["customer_id"] == customer]
+        for feature, feature_curve in customer_curves.groupby("feature"):
+            st.write(f"**{feature}** response curve (confidence of predicted class)")
+            st.line_chart(feature_curve.set_index("value")[["confidence"]])
+            st.dataframe(feature_curve[["step", "value", "predicted_class", "confidence_pct"]], hide_index=True)
+
+        st.download_button("Download Sensitivity Curves (CSV)", curves.to_csv(index=False).encode("utf-8"), file_name="sensitivity_curves.csv", mime="text/csv")
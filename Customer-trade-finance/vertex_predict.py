@@ -1,11 +1,81 @@
-from google.cloud import aiplatform_v1
- 
-def predict_from_vertex(endpoint_id, project, location, instance_list):
+import os
+import logging
+import numpy as np
+from local_predict import predict_from_local, local_model_available
+from prediction_parser import parse_predictions, score_matrix
+
+# "vertex" (remote endpoint), "local" (exported artifact) or "auto" (remote, local fallback)
+PREDICTION_BACKEND = os.getenv("PREDICTION_BACKEND", "vertex")
+BACKENDS = ("vertex", "local", "auto")
+
+
+def _predict_remote(endpoint_id, project, location, instance_list):
+    # Imported on first remote call: the SDK is heavy and local scoring never needs it
+    from google.cloud import aiplatform_v1
+
     client_options = {"api_endpoint": f"{location}-aiplatform.googleapis.com"}
     client = aiplatform_v1.PredictionServiceClient(client_options=client_options)
- 
+
     endpoint = client.endpoint_path(project=project, location=location, endpoint=endpoint_id)
- 
+
     response = client.predict(endpoint=endpoint, instances=instance_list)
     return response
- 
\ No newline at end of file
+
+
+def predict_from_vertex(endpoint_id, project, location, instance_list, backend=None):
+    """
+    Scores instance_list with the selected backend. Every backend returns an
+    object exposing .predictions, so callers do not change.
+    """
+    backend = backend or PREDICTION_BACKEND
+    if backend not in BACKENDS:
+        raise ValueError(f"Unknown prediction backend '{backend}'. Expected one of {BACKENDS}.")
+
+    if backend == "local":
+        return predict_from_local(instance_list)
+
+    try:
+        return _predict_remote(endpoint_id, project, location, instance_list)
+    except Exception as e:
+        if backend == "auto" and local_model_available():
+            logging.warning(f"Vertex endpoint call failed ({e}); falling back to local model.")
+            return predict_from_local(instance_list)
+        raise
+
+
+def parity_check(endpoint_id, project, location, instance_list, sample_size=50, tolerance=0.05, seed=0) -> dict:
+    """
+    Scores a random sample through both the remote endpoint and the local
+    artifact and reports how closely they agree. The check is inconclusive,
+    and does not pass, when the two share no comparable class scores.
+    """
+    if not instance_list:
+        raise ValueError("No instances to sample for the parity check.")
+
+    rng = np.random.default_rng(seed)
+    idx = rng.choice(len(instance_list), size=min(sample_size, len(instance_list)), replace=False)
+    sample = [instance_list[i] for i in sorted(idx)]
+
+    remote = parse_predictions(_predict_remote(endpoint_id, project, location, sample).predictions)
+    local = parse_predictions(predict_from_local(sample).predictions)
+
+    class_agreement = float((remote["predicted_class"].astype(str) == local["predicted_class"].astype(str)).mean())
+
+    # Compare scores on the classes both backends report
+    common = [c for c in remote.columns if c.startswith("score_") and c in local.columns]
+    if common:
+        diffs = np.abs(score_matrix(remote[common]) - score_matrix(local[common]))
+        max_score_diff = float(np.nanmax(diffs)) if np.isfinite(diffs).any() else float("nan")
+        mean_score_diff = float(np.nanmean(diffs)) if np.isfinite(diffs).any() else float("nan")
+    else:
+        max_score_diff = mean_score_diff = float("nan")
+
+    inconclusive = bool(np.isnan(max_score_diff))
+    return {
+        "sample_size": len(sample),
+        "class_agreement": class_agreement,
+        "max_score_diff": max_score_diff,
+        "mean_score_diff": mean_score_diff,
+        "inconclusive": inconclusive,
+        "passed": not inconclusive and class_agreement == 1.0 and max_score_diff <= tolerance,
+    }
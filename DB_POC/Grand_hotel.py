@@ -1,6 +1,5 @@
-import os
-os.environ["GOOGLE_APPLICATION_CREDENTIALS"] 
-from google.cloud import documentai_v1 as documentai
+from invoice_pipeline import get_client, processor_name, process_document_ref
+from docai_cache import DocumentCache, CachingDocumentAIClient
 
 # Set these values
 project_id = "deutschebank-aipocs"
@@ -10,20 +9,12 @@ file_path = "gs://invoice_parser_db_bk/DB_POC_data/Grand_Hotel_Data.pdf"
 mime_type = "application/pdf"
  
 # Create the API client
-client = documentai.DocumentProcessorServiceClient()
-name = f"projects/{project_id}/locations/{location}/processors/{processor_id}"
+# Re-runs on the same file are served from the local response cache
+client = CachingDocumentAIClient(get_client(location), DocumentCache())
+name = processor_name(project_id, location, processor_id)
  
-# Read the PDF invoice
-with open(file_path, "rb") as document_file:
-    document_content = document_file.read()
- 
-# Prepare the request
-raw_document = documentai.RawDocument(content=document_content, mime_type=mime_type)
-request = documentai.ProcessRequest(name=name, raw_document=raw_document)
- 
-# Process the document
-result = client.process_document(request=request)
-document = result.document
+# Process the document (gs:// URIs are sent by reference; local paths are read and sent inline)
+document = process_document_ref(client, name, file_path, mime_type)
  
 # Display extracted fields
 print("Extracted Fields:")
@@ -1,39 +1,152 @@
 import streamlit as st
 import json
+import math
+from invoice_db import connect, invoice_from_json, upsert_invoices, search_invoices, aggregate_invoices, get_invoice, timed
+from invoice_bulk import content_hash, load_uploads, spend_by_vendor, totals_by_due_date, line_item_summary
  
 st.set_page_config(page_title="Invoice Viewer", layout="centered")
  
+
+def get_invoice_db():
+    # One SQLite connection per browser session; a session runs one script at a time
+    if "invoice_db" not in st.session_state:
+        st.session_state.invoice_db = connect()
+    return st.session_state.invoice_db
+
+
+@st.cache_data(show_spinner="Parsing invoices...", max_entries=8)
+def load_bulk_upload(upload_hash: str, _files: list) -> dict:
+    # Keyed on the content hash only; re-uploading the same files skips parsing
+    return load_uploads(_files)
+
+
+def render_paginated(frame, key: str, page_size: int = 500):
+    """One page of a large frame at a time; st.dataframe virtualizes rows within the page."""
+    n_pages = max(1, math.ceil(len(frame) / page_size))
+    page = st.number_input(f"Page (1-{n_pages})", min_value=1, max_value=n_pages, value=1, step=1, key=f"{key}_page")
+    start = (int(page) - 1) * page_size
+    st.dataframe(frame.iloc[start:start + page_size], use_container_width=True, hide_index=True, height=400)
+    st.caption(f"Rows {min(start + 1, len(frame))}-{min(start + page_size, len(frame))} of {len(frame)}")
+
+ 
 st.title("📄 Invoice Dashboard")
-st.write("Upload an invoice JSON file (output from Doc AI or simulation)")
+mode = st.sidebar.radio("Mode", ["Single Invoice", "Bulk Upload", "Search Invoice Store"])
+ 
+if mode == "Single Invoice":
+    st.write("Upload an invoice JSON file (output from Doc AI or simulation)")
+ 
+    uploaded_file = st.file_uploader("Upload JSON Invoice", type=["json"])
  
-uploaded_file = st.file_uploader("Upload JSON Invoice", type=["json"])
+    if uploaded_file:
+        invoice_data = json.load(uploaded_file)
  
-if uploaded_file:
-    invoice_data = json.load(uploaded_file)
+        st.subheader("🧾 Invoice Summary")
+        col1, col2 = st.columns(2)
+        col1.write(f"**Invoice #:** {invoice_data['invoiceNumber']}")
+        col1.write(f"**Invoice Date:** {invoice_data['invoiceDate']}")
+        col1.write(f"**Due Date:** {invoice_data['dueDate']}")
+        col2.write(f"**PO #:** {invoice_data['poNumber']}")
+        col2.write(f"**Total Amount:** ${invoice_data['totalAmountDue']:,.2f}")
  
-    st.subheader("🧾 Invoice Summary")
-    col1, col2 = st.columns(2)
-    col1.write(f"**Invoice #:** {invoice_data['invoiceNumber']}")
-    col1.write(f"**Invoice Date:** {invoice_data['invoiceDate']}")
-    col1.write(f"**Due Date:** {invoice_data['dueDate']}")
-    col2.write(f"**PO #:** {invoice_data['poNumber']}")
-    col2.write(f"**Total Amount:** ${invoice_data['totalAmountDue']:,.2f}")
+        st.subheader("🏨 Billing & Shipping")
+        st.write(f"**Bill To:** {invoice_data['billTo']['name']}, {invoice_data['billTo']['address']}")
+        st.write(f"**Ship To:** {invoice_data['shipTo']['name']}, {invoice_data['shipTo']['address']}")
  
-    st.subheader("🏨 Billing & Shipping")
-    st.write(f"**Bill To:** {invoice_data['billTo']['name']}, {invoice_data['billTo']['address']}")
-    st.write(f"**Ship To:** {invoice_data['shipTo']['name']}, {invoice_data['shipTo']['address']}")
+        st.subheader("📦 Line Items")
+        st.table(invoice_data['lineItems'])
  
-    st.subheader("📦 Line Items")
-    st.table(invoice_data['lineItems'])
+        st.subheader("💳 Payment Info")
+        st.write(f"**Bank:** {invoice_data['paymentMethods']['bankTransfer']['bankName']}")
+        st.write(f"**Account:** {invoice_data['paymentMethods']['bankTransfer']['accountName']}")
+        st.write(f"**SWIFT/BIC:** {invoice_data['paymentMethods']['bankTransfer']['swiftCode']}")
  
-    st.subheader("💳 Payment Info")
-    st.write(f"**Bank:** {invoice_data['paymentMethods']['bankTransfer']['bankName']}")
-    st.write(f"**Account:** {invoice_data['paymentMethods']['bankTransfer']['accountName']}")
-    st.write(f"**SWIFT/BIC:** {invoice_data['paymentMethods']['bankTransfer']['swiftCode']}")
+        st.subheader("📝 Notes")
+        st.info(invoice_data['notes'])
  
-    st.subheader("📝 Notes")
-    st.info(invoice_data['notes'])
+        if st.button("Save to invoice store"):
+            upsert_invoices(get_invoice_db(), [invoice_from_json(invoice_data, f"upload:{uploaded_file.name}")])
+            st.success(f"Saved invoice {invoice_data['invoiceNumber']} to the invoice store.")
  
+    else:
+        st.info("Upload a JSON file to begin.")
+
+elif mode == "Bulk Upload":
+    st.write("Upload many invoice JSON files, or zip archives of them, to review a whole period at once.")
+    uploaded_files = st.file_uploader("Upload JSON invoices or zip", type=["json", "zip"], accept_multiple_files=True)
+
+    if uploaded_files:
+        files = [(f.name, f.getvalue()) for f in uploaded_files]
+        bulk = load_bulk_upload(content_hash(files), files)
+        headers, line_items, errors = bulk["headers"], bulk["line_items"], bulk["errors"]
+
+        col1, col2, col3 = st.columns(3)
+        col1.metric("Invoices", f"{len(headers):,}")
+        col2.metric("Line items", f"{len(line_items):,}")
+        col3.metric("Total amount", f"${headers['total_amount'].sum():,.2f}")
+        if not errors.empty:
+            with st.expander(f"{len(errors)} file(s) could not be parsed"):
+                st.dataframe(errors, use_container_width=True, hide_index=True)
+
+        st.subheader("📊 Spend by Vendor")
+        by_vendor = spend_by_vendor(headers)
+        st.bar_chart(by_vendor.head(30).set_index("vendor")["total_amount"])
+        st.dataframe(by_vendor, use_container_width=True, hide_index=True)
+
+        st.subheader("📅 Totals by Due Date")
+        by_due_date = totals_by_due_date(headers)
+        st.line_chart(by_due_date.set_index("due_date")["total_amount"])
+
+        st.subheader("🧾 Invoices")
+        render_paginated(headers, "bulk_headers")
+
+        st.subheader("📦 Line Items")
+        view = st.radio("View", ["Summary by description", "All line items"], horizontal=True)
+        if view == "Summary by description":
+            render_paginated(line_item_summary(line_items), "bulk_summary")
+        else:
+            render_paginated(line_items, "bulk_lines")
+
+        if st.button(f"Save {len(bulk['invoices'])} invoice(s) to invoice store"):
+            saved = upsert_invoices(get_invoice_db(), bulk["invoices"])
+            st.success(f"Saved {saved} invoice(s) to the invoice store.")
+    else:
+        st.info("Upload JSON files or a zip to begin.")
+
 else:
-    st.info("Upload a JSON file to begin.")
- 
\ No newline at end of file
+    conn = get_invoice_db()
+    st.write("Search and aggregate across every invoice in the store (loaded with `invoice_db.py` or saved from uploads).")
+
+    col1, col2, col3 = st.columns(3)
+    invoice_number = col1.text_input("Invoice #")
+    po_number = col2.text_input("PO #")
+    swift_code = col3.text_input("SWIFT/BIC")
+    col4, col5, col6 = st.columns(3)
+    vendor = col4.text_input("Vendor (prefix)")
+    date_from = col5.date_input("Invoice date from", value=None)
+    date_to = col6.date_input("Invoice date to", value=None)
+    filters = dict(invoice_number=invoice_number.strip() or None, po_number=po_number.strip() or None,
+                   swift_code=swift_code.strip() or None, vendor=vendor.strip() or None,
+                   date_from=date_from, date_to=date_to)
+
+    st.subheader("🔎 Matching Invoices")
+    results, elapsed_ms = timed(search_invoices, conn, **filters)
+    st.caption(f"{len(results)} invoice(s) in {elapsed_ms:.1f} ms (max 500 shown)")
+    st.dataframe(results, use_container_width=True, hide_index=True)
+
+    st.subheader("📊 Spend")
+    group_by = st.selectbox("Group by", ["vendor", "month", "due_date", "currency"])
+    totals, elapsed_ms = timed(aggregate_invoices, conn, by=group_by, **filters)
+    st.caption(f"Aggregated in {elapsed_ms:.1f} ms")
+    st.bar_chart(totals.head(50).set_index(group_by)["total_amount"])
+    st.dataframe(totals, use_container_width=True, hide_index=True)
+
+    if not results.empty:
+        st.subheader("🧾 Invoice Detail")
+        selected = st.selectbox("Invoice", results["invoice_id"].tolist(),
+                                format_func=lambda i: results.loc[results["invoice_id"] == i, "invoice_number"].iloc[0] or str(i))
+        detail = get_invoice(conn, selected)
+        st.json(detail["header"])
+        st.write("**Line Items**")
+        st.dataframe(detail["line_items"], use_container_width=True, hide_index=True)
+        st.write("**Payment Info**")
+        st.dataframe(detail["payments"], use_container_width=True, hide_index=True)
@@ -0,0 +1,244 @@
+"""
+Content-addressed cache for Document AI responses.
+
+Responses are keyed on (processor name, processor version, content hash)
+and stored gzip-compressed on disk, with an SQLite index
+used for LRU eviction once the cache exceeds its size budget. The index also
+remembers which URI a document was first seen under, so byte-identical
+resubmissions are flagged as duplicates and served without a processing call.
+
+The content hash is the sha256 of inline bytes. gs:// documents are not
+downloaded: their hash comes from the object metadata (GCS md5, or the
+object generation for composite objects, which have no md5).
+"""
+import os
+import gzip
+import base64
+import time
+import pickle
+import hashlib
+import sqlite3
+import logging
+import threading
+from types import SimpleNamespace
+
+DOCAI_CACHE_DIR = os.getenv("DOCAI_CACHE_DIR", ".docai_cache")
+DOCAI_CACHE_MAX_BYTES = int(os.getenv("DOCAI_CACHE_MAX_BYTES", str(2 * 1024 ** 3)))
+# Invoice parser list price per page, used for the savings estimate
+DOCAI_COST_PER_PAGE = float(os.getenv("DOCAI_COST_PER_PAGE", "0.01"))
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS entries (
+    cache_key TEXT PRIMARY KEY,
+    content_sha TEXT NOT NULL,
+    format TEXT NOT NULL,
+    size_bytes INTEGER NOT NULL,
+    pages INTEGER NOT NULL,
+    created_at REAL NOT NULL,
+    last_access REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_entries_last_access ON entries (last_access);
+CREATE TABLE IF NOT EXISTS documents (
+    content_sha TEXT PRIMARY KEY,
+    first_uri TEXT,
+    seen_count INTEGER NOT NULL
+);
+CREATE TABLE IF NOT EXISTS stats (
+    name TEXT PRIMARY KEY,
+    value REAL NOT NULL
+);
+"""
+
+
+def sha256_bytes(content: bytes) -> str:
+    return hashlib.sha256(content).hexdigest()
+
+
+def _serialize(document) -> tuple:
+    """Protobuf Documents are stored as JSON; anything else (e.g. the fake client's) is pickled."""
+    to_json = getattr(type(document), "to_json", None)
+    if to_json is not None:
+        return "json", to_json(document).encode("utf-8")
+    return "pickle", pickle.dumps(document)
+
+
+def _deserialize(fmt: str, payload: bytes):
+    if fmt == "json":
+        from google.cloud import documentai_v1 as documentai
+        return documentai.Document.from_json(payload.decode("utf-8"), ignore_unknown_fields=True)
+    return pickle.loads(payload)
+
+
+class DocumentCache:
+    """Size-bounded, content-addressed store of serialized Document responses."""
+
+    def __init__(self, cache_dir: str = DOCAI_CACHE_DIR, max_bytes: int = DOCAI_CACHE_MAX_BYTES):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        os.makedirs(cache_dir, exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(os.path.join(cache_dir, "index.db"), check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.executescript(SCHEMA)
+
+    @staticmethod
+    def make_key(processor_name: str, processor_version: str, content_sha: str) -> str:
+        return sha256_bytes(f"{processor_name}|{processor_version}|{content_sha}".encode("utf-8"))
+
+    def _path(self, cache_key: str) -> str:
+        return os.path.join(self.cache_dir, cache_key[:2], f"{cache_key}.gz")
+
+    def _bump(self, name: str, amount: float = 1):
+        self._conn.execute(
+            "INSERT INTO stats (name, value) VALUES (?, ?) ON CONFLICT(name) DO UPDATE SET value = value + excluded.value",
+            (name, amount),
+        )
+
+    def register_document(self, content_sha: str, uri: str | None) -> str | None:
+        """Records a sighting of the content; returns the first URI if it was already seen under another one."""
+        with self._lock:
+            row = self._conn.execute("SELECT first_uri FROM documents WHERE content_sha = ?", (content_sha,)).fetchone()
+            if row is None:
+                self._conn.execute("INSERT INTO documents (content_sha, first_uri, seen_count) VALUES (?, ?, 1)",
+                                   (content_sha, uri))
+                return None
+            self._conn.execute("UPDATE documents SET seen_count = seen_count + 1 WHERE content_sha = ?", (content_sha,))
+            if row[0] != uri:
+                self._bump("duplicates")
+                return row[0]
+            return None
+
+    def get(self, cache_key: str):
+        with self._lock:
+            row = self._conn.execute("SELECT format, pages FROM entries WHERE cache_key = ?", (cache_key,)).fetchone()
+            if row is None or not os.path.exists(self._path(cache_key)):
+                self._bump("misses")
+                return None
+            self._conn.execute("UPDATE entries SET last_access = ? WHERE cache_key = ?", (time.time(), cache_key))
+            self._bump("hits")
+            self._bump("pages_saved", row[1])
+        with gzip.open(self._path(cache_key), "rb") as f:
+            return _deserialize(row[0], f.read())
+
+    def put(self, cache_key: str, content_sha: str, document):
+        fmt, payload = _serialize(document)
+        path = self._path(cache_key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f"{path}.{threading.get_ident()}.tmp"
+        with gzip.open(tmp_path, "wb") as f:
+            f.write(payload)
+        os.replace(tmp_path, path)
+        pages = len(getattr(document, "pages", None) or []) or 1
+        now = time.time()
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO entries (cache_key, content_sha, format, size_bytes, pages, created_at, last_access) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (cache_key, content_sha, fmt, os.path.getsize(path), pages, now, now),
+            )
+            self._evict_locked()
+
+    def _evict_locked(self):
+        total = self._conn.execute("SELECT COALESCE(SUM(size_bytes), 0) FROM entries").fetchone()[0]
+        if total <= self.max_bytes:
+            return
+        for cache_key, size in self._conn.execute("SELECT cache_key, size_bytes FROM entries ORDER BY last_access").fetchall():
+            if total <= self.max_bytes:
+                break
+            try:
+                os.remove(self._path(cache_key))
+            except FileNotFoundError:
+                pass
+            self._conn.execute("DELETE FROM entries WHERE cache_key = ?", (cache_key,))
+            self._bump("evictions")
+            total -= size
+
+    def stats(self) -> dict:
+        with self._lock:
+            counters = dict(self._conn.execute("SELECT name, value FROM stats").fetchall())
+            entries, size = self._conn.execute("SELECT COUNT(*), COALESCE(SUM(size_bytes), 0) FROM entries").fetchone()
+        hits, misses = int(counters.get("hits", 0)), int(counters.get("misses", 0))
+        pages_saved = int(counters.get("pages_saved", 0))
+        return {
+            "entries": entries,
+            "size_bytes": size,
+            "hits": hits,
+            "misses": misses,
+            "hit_rate": hits / (hits + misses) if hits + misses else 0.0,
+            "duplicates": int(counters.get("duplicates", 0)),
+            "evictions": int(counters.get("evictions", 0)),
+            "pages_saved": pages_saved,
+            "estimated_savings_usd": round(pages_saved * DOCAI_COST_PER_PAGE, 2),
+        }
+
+
+class CachingDocumentAIClient:
+    """
+    Wraps a Document AI client (real or fake) so process_document is served
+    from the DocumentCache when the same bytes were already processed by the
+    same processor version. Results carry cache_hit and duplicate_of.
+    """
+
+    def __init__(self, client, cache: DocumentCache, processor_version: str | None = None):
+        self.client = client
+        self.cache = cache
+        self.processor_version = processor_version
+        self._versions = {}
+        self._key_locks = {}
+        self._lock = threading.Lock()
+
+    def _key_lock(self, cache_key: str) -> threading.Lock:
+        with self._lock:
+            return self._key_locks.setdefault(cache_key, threading.Lock())
+
+    def _resolve_version(self, name: str) -> str:
+        if self.processor_version:
+            return self.processor_version
+        if "/processorVersions/" in name:
+            return name.rsplit("/", 1)[1]
+        if name not in self._versions:
+            try:
+                self._versions[name] = self.client.get_processor(name=name).default_processor_version or "default"
+            except Exception as e:
+                logging.warning(f"Could not resolve processor version for {name}: {e}")
+                self._versions[name] = "default"
+        return self._versions[name]
+
+    @staticmethod
+    def _content_id(request: dict) -> tuple:
+        """(content hash, gcs_uri) of the request's document; a GCS object costs one metadata call, not a download."""
+        raw = request.get("raw_document")
+        if raw is not None:
+            return sha256_bytes(raw["content"]), None
+        gcs_uri = request["gcs_document"]["gcs_uri"]
+        from google.cloud import storage
+        bucket, _, blob_name = gcs_uri[len("gs://"):].partition("/")
+        blob = storage.Client().bucket(bucket).get_blob(blob_name)
+        if blob is None:
+            raise FileNotFoundError(f"GCS object not found: {gcs_uri}")
+        if blob.md5_hash:
+            return f"md5:{base64.b64decode(blob.md5_hash).hex()}", gcs_uri
+        # Composite objects only carry crc32c; the generation pins the exact bytes instead
+        return f"gen:{gcs_uri}#{blob.generation}:{blob.crc32c}", gcs_uri
+
+    def process_document(self, request: dict, source_uri: str | None = None):
+        content_sha, gcs_uri = self._content_id(request)
+        duplicate_of = self.cache.register_document(content_sha, source_uri or gcs_uri)
+
+        cache_key = self.cache.make_key(request["name"], self._resolve_version(request["name"]), content_sha)
+        try:
+            # Held per key so concurrent copies of one document wait for a single processing call
+            with self._key_lock(cache_key):
+                document = self.cache.get(cache_key)
+                if document is not None:
+                    return SimpleNamespace(document=document, cache_hit=True, duplicate_of=duplicate_of)
+                document = self.client.process_document(request=request).document
+                self.cache.put(cache_key, content_sha, document)
+        finally:
+            with self._lock:
+                self._key_locks.pop(cache_key, None)
+        return SimpleNamespace(document=document, cache_hit=False, duplicate_of=duplicate_of)
+
+    def __getattr__(self, attr):
+        # batch_process_documents etc. go straight to the wrapped client
+        return getattr(self.client, attr)
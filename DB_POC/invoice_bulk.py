@@ -0,0 +1,120 @@
+"""
+Bulk loading of dashboard invoice JSON files.
+
+Expands uploaded JSON files and zip archives, parses them in parallel into
+the normalized shape used by invoice_db, and builds one columnar header
+frame and one line-item frame so aggregates are plain vectorized groupbys.
+"""
+import os
+import io
+import json
+import zipfile
+import hashlib
+from concurrent.futures import ProcessPoolExecutor
+import pandas as pd
+from invoice_db import HEADER_COLUMNS, LINE_ITEM_COLUMNS, invoice_from_json
+
+# Below this many files the process pool costs more than it saves
+PARALLEL_MIN_FILES = int(os.getenv("INVOICE_PARALLEL_MIN_FILES", "64"))
+PARSE_WORKERS = int(os.getenv("INVOICE_PARSE_WORKERS", str(min(8, os.cpu_count() or 1))))
+
+LINE_ITEM_CONTEXT_COLUMNS = ["invoice_number", "vendor", "invoice_date", "due_date"]
+
+
+def content_hash(files: list) -> str:
+    """Stable hash of an upload set of (name, bytes) pairs, independent of upload order."""
+    digest = hashlib.sha256()
+    for name, content in sorted((name, hashlib.sha256(content).hexdigest()) for name, content in files):
+        digest.update(f"{name}\0{content}\n".encode("utf-8"))
+    return digest.hexdigest()
+
+
+def expand_uploads(files: list) -> list:
+    """Replaces zip archives with the JSON files they contain; returns (name, bytes) pairs."""
+    expanded = []
+    for name, content in files:
+        if name.lower().endswith(".zip"):
+            with zipfile.ZipFile(io.BytesIO(content)) as archive:
+                for member in archive.infolist():
+                    if not member.is_dir() and member.filename.lower().endswith(".json"):
+                        expanded.append((f"{name}/{member.filename}", archive.read(member)))
+        else:
+            expanded.append((name, content))
+    return expanded
+
+
+def _parse_one(item: tuple) -> tuple:
+    name, content = item
+    try:
+        return invoice_from_json(json.loads(content), f"upload:{name}"), None
+    except Exception as e:
+        return None, {"file": name, "error": f"{type(e).__name__}: {e}"}
+
+
+def parse_invoice_files(files: list, workers: int = PARSE_WORKERS) -> tuple:
+    """Parses (name, bytes) JSON invoices; returns (invoices, errors)."""
+    if workers > 1 and len(files) >= PARALLEL_MIN_FILES:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            results = list(pool.map(_parse_one, files, chunksize=max(1, len(files) // (workers * 4))))
+    else:
+        results = [_parse_one(item) for item in files]
+    invoices = [invoice for invoice, _ in results if invoice is not None]
+    errors = [error for _, error in results if error is not None]
+    return invoices, errors
+
+
+def build_frames(invoices: list) -> tuple:
+    """
+    Builds (headers, line_items) frames column by column. Line items carry
+    the invoice number, vendor and dates so they can be filtered on their own.
+    """
+    header_data = {"source_uri": [inv["source_uri"] for inv in invoices]}
+    for col in HEADER_COLUMNS:
+        header_data[col] = [inv["header"].get(col) for inv in invoices]
+    headers = pd.DataFrame(header_data)
+
+    counts = [len(inv["line_items"]) for inv in invoices]
+    line_data = {"source_uri": [inv["source_uri"] for inv, n in zip(invoices, counts) for _ in range(n)]}
+    for col in LINE_ITEM_CONTEXT_COLUMNS:
+        line_data[col] = [inv["header"].get(col) for inv, n in zip(invoices, counts) for _ in range(n)]
+    for col in LINE_ITEM_COLUMNS:
+        line_data[col] = [item.get(col) for inv in invoices for item in inv["line_items"]]
+    line_items = pd.DataFrame(line_data)
+
+    for frame in (headers, line_items):
+        for col in ("invoice_date", "due_date"):
+            frame[col] = pd.to_datetime(frame[col], errors="coerce")
+        for col in ("total_amount", "quantity", "unit_price", "amount"):
+            if col in frame:
+                frame[col] = pd.to_numeric(frame[col], errors="coerce")
+        for col in ("vendor", "invoice_number", "currency"):
+            if col in frame:
+                frame[col] = frame[col].astype("category")
+    return headers, line_items
+
+
+def load_uploads(files: list, workers: int = PARSE_WORKERS) -> dict:
+    """Zip expansion, parallel parse and frame build for one upload set."""
+    expanded = expand_uploads(files)
+    invoices, errors = parse_invoice_files(expanded, workers=workers)
+    headers, line_items = build_frames(invoices)
+    return {"invoices": invoices, "headers": headers, "line_items": line_items, "errors": pd.DataFrame(errors)}
+
+
+# --- Aggregates ---
+def spend_by_vendor(headers: pd.DataFrame) -> pd.DataFrame:
+    grouped = headers.groupby("vendor", observed=True, dropna=False)["total_amount"]
+    return (grouped.agg(invoices="size", total_amount="sum", average_amount="mean")
+            .sort_values("total_amount", ascending=False).reset_index())
+
+
+def totals_by_due_date(headers: pd.DataFrame) -> pd.DataFrame:
+    grouped = headers.groupby(headers["due_date"].dt.date, dropna=True)["total_amount"]
+    return grouped.agg(invoices="size", total_amount="sum").sort_index().reset_index()
+
+
+def line_item_summary(line_items: pd.DataFrame) -> pd.DataFrame:
+    """Quantity and spend per line-item description across every uploaded invoice."""
+    grouped = line_items.groupby("description", dropna=False)
+    return (grouped.agg(occurrences=("amount", "size"), quantity=("quantity", "sum"), amount=("amount", "sum"))
+            .sort_values("amount", ascending=False).reset_index())
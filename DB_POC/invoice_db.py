@@ -0,0 +1,370 @@
+"""
+Normalized SQLite store for extracted invoices.
+
+Invoice headers, line items and payment details live in separate tables,
+indexed on the fields the dashboard searches by (invoice number, PO number,
+vendor, invoice/due dates, SWIFT code). Invoices come from the dashboard's
+JSON format or from the Parquet output of invoice_pipeline.py.
+
+    python invoice_db.py load-store invoice_store
+    python invoice_db.py load-json invoices/*.json
+"""
+import os
+import re
+import sys
+import time
+import sqlite3
+import argparse
+import datetime
+import json
+import logging
+from contextlib import closing
+import pandas as pd
+
+INVOICE_DB_PATH = os.getenv("INVOICE_DB_PATH", "invoices.db")
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS invoices (
+    invoice_id INTEGER PRIMARY KEY,
+    source_uri TEXT NOT NULL UNIQUE,
+    invoice_number TEXT,
+    invoice_date TEXT,
+    invoice_month TEXT,
+    due_date TEXT,
+    po_number TEXT,
+    vendor TEXT COLLATE NOCASE,
+    bill_to_name TEXT,
+    bill_to_address TEXT,
+    ship_to_name TEXT,
+    ship_to_address TEXT,
+    total_amount REAL,
+    currency TEXT,
+    notes TEXT,
+    ingested_at REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS line_items (
+    line_item_id INTEGER PRIMARY KEY,
+    invoice_id INTEGER NOT NULL REFERENCES invoices(invoice_id) ON DELETE CASCADE,
+    line_no INTEGER NOT NULL,
+    description TEXT,
+    quantity REAL,
+    unit_price REAL,
+    amount REAL
+);
+CREATE TABLE IF NOT EXISTS payment_details (
+    payment_id INTEGER PRIMARY KEY,
+    invoice_id INTEGER NOT NULL REFERENCES invoices(invoice_id) ON DELETE CASCADE,
+    bank_name TEXT,
+    account_name TEXT,
+    account_number TEXT,
+    iban TEXT,
+    swift_code TEXT
+);
+CREATE INDEX IF NOT EXISTS idx_invoices_number ON invoices (invoice_number);
+CREATE INDEX IF NOT EXISTS idx_invoices_po ON invoices (po_number);
+-- Composite indexes double as covering indexes for the dashboard aggregates
+CREATE INDEX IF NOT EXISTS idx_invoices_vendor ON invoices (vendor, invoice_date, invoice_month, total_amount);
+CREATE INDEX IF NOT EXISTS idx_invoices_invoice_date ON invoices (invoice_date, vendor, total_amount);
+CREATE INDEX IF NOT EXISTS idx_invoices_month ON invoices (invoice_month, total_amount);
+CREATE INDEX IF NOT EXISTS idx_invoices_due_date ON invoices (due_date, total_amount);
+CREATE INDEX IF NOT EXISTS idx_line_items_invoice ON line_items (invoice_id);
+CREATE INDEX IF NOT EXISTS idx_payment_invoice ON payment_details (invoice_id);
+CREATE INDEX IF NOT EXISTS idx_payment_swift ON payment_details (swift_code);
+"""
+
+HEADER_COLUMNS = [
+    "invoice_number", "invoice_date", "due_date", "po_number", "vendor", "bill_to_name", "bill_to_address",
+    "ship_to_name", "ship_to_address", "total_amount", "currency", "notes",
+]
+LINE_ITEM_COLUMNS = ["line_no", "description", "quantity", "unit_price", "amount"]
+PAYMENT_COLUMNS = ["bank_name", "account_name", "account_number", "iban", "swift_code"]
+
+# Document AI invoice parser entity types -> header columns
+DOCAI_HEADER_FIELDS = {
+    "invoice_id": "invoice_number",
+    "invoice_date": "invoice_date",
+    "due_date": "due_date",
+    "purchase_order": "po_number",
+    "supplier_name": "vendor",
+    "receiver_name": "bill_to_name",
+    "receiver_address": "bill_to_address",
+    "ship_to_name": "ship_to_name",
+    "ship_to_address": "ship_to_address",
+    "total_amount": "total_amount",
+    "currency": "currency",
+}
+DOCAI_PAYMENT_FIELDS = {
+    "supplier_bank_name": "bank_name",
+    "supplier_account_name": "account_name",
+    "supplier_account_number": "account_number",
+    "supplier_iban": "iban",
+    "supplier_swift": "swift_code",
+    "supplier_swift_code": "swift_code",
+}
+DOCAI_LINE_ITEM_FIELDS = {
+    "line_item/description": "description",
+    "line_item/quantity": "quantity",
+    "line_item/unit_price": "unit_price",
+    "line_item/amount": "amount",
+}
+
+_AMOUNT_RE = re.compile(r"[^\d.\-]")
+
+
+def connect(db_path: str = INVOICE_DB_PATH) -> sqlite3.Connection:
+    conn = sqlite3.connect(db_path, check_same_thread=False)
+    conn.row_factory = sqlite3.Row
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA foreign_keys=ON")
+    conn.executescript(SCHEMA)
+    return conn
+
+
+def parse_amount(value) -> float | None:
+    if value is None or value == "":
+        return None
+    if isinstance(value, (int, float)):
+        return float(value)
+    cleaned = _AMOUNT_RE.sub("", str(value))
+    try:
+        return float(cleaned)
+    except ValueError:
+        return None
+
+
+def _iso_date(value) -> str | None:
+    if value in (None, ""):
+        return None
+    try:
+        # Fast path for the common ISO form; pandas handles everything else
+        return datetime.date.fromisoformat(str(value)[:10]).isoformat()
+    except ValueError:
+        pass
+    parsed = pd.to_datetime(value, errors="coerce")
+    return None if pd.isna(parsed) else parsed.date().isoformat()
+
+
+# --- Normalizers ---
+def invoice_from_json(data: dict, source_uri: str) -> dict:
+    """Normalizes the dashboard JSON invoice format into header/line_items/payments."""
+    bill_to = data.get("billTo") or {}
+    ship_to = data.get("shipTo") or {}
+    bank = (data.get("paymentMethods") or {}).get("bankTransfer")
+    vendor = data.get("vendor") or data.get("vendorName") or data.get("from") or {}
+    if isinstance(vendor, dict):
+        vendor = vendor.get("name")
+    if not vendor and bank:
+        # The dashboard format has no vendor field; the payee account holder is the vendor.
+        vendor = bank.get("accountName")
+    if not vendor:
+        logging.warning(f"No vendor found for invoice {data.get('invoiceNumber')} ({source_uri})")
+    header = {
+        "invoice_number": data.get("invoiceNumber"),
+        "invoice_date": _iso_date(data.get("invoiceDate")),
+        "due_date": _iso_date(data.get("dueDate")),
+        "po_number": data.get("poNumber"),
+        "vendor": vendor,
+        "bill_to_name": bill_to.get("name"),
+        "bill_to_address": bill_to.get("address"),
+        "ship_to_name": ship_to.get("name"),
+        "ship_to_address": ship_to.get("address"),
+        "total_amount": parse_amount(data.get("totalAmountDue")),
+        "currency": data.get("currency"),
+        "notes": data.get("notes"),
+    }
+    line_items = []
+    for i, item in enumerate(data.get("lineItems") or []):
+        line_items.append({
+            "line_no": i + 1,
+            "description": item.get("description"),
+            "quantity": parse_amount(item.get("quantity")),
+            "unit_price": parse_amount(item.get("unitPrice", item.get("rate"))),
+            "amount": parse_amount(item.get("amount", item.get("total"))),
+        })
+    payments = []
+    if bank:
+        payments.append({
+            "bank_name": bank.get("bankName"),
+            "account_name": bank.get("accountName"),
+            "account_number": bank.get("accountNumber"),
+            "iban": bank.get("iban"),
+            "swift_code": bank.get("swiftCode"),
+        })
+    return {"source_uri": source_uri, "header": header, "line_items": line_items, "payments": payments}
+
+
+def invoices_from_entities(entities: pd.DataFrame) -> list:
+    """Builds normalized invoices from invoice_pipeline entity rows (one group per document)."""
+    invoices = []
+    for source_uri, doc in entities.groupby("document_uri", sort=False):
+        value = doc["normalized_value"].where(doc["normalized_value"].astype(bool), doc["mention_text"])
+        top = doc["parent_index"].isna()
+
+        header = dict.fromkeys(HEADER_COLUMNS)
+        payment = dict.fromkeys(PAYMENT_COLUMNS)
+        for entity_type, text in zip(doc.loc[top, "type"], value[top]):
+            if entity_type in DOCAI_HEADER_FIELDS and header[DOCAI_HEADER_FIELDS[entity_type]] is None:
+                header[DOCAI_HEADER_FIELDS[entity_type]] = text
+            elif entity_type in DOCAI_PAYMENT_FIELDS and payment[DOCAI_PAYMENT_FIELDS[entity_type]] is None:
+                payment[DOCAI_PAYMENT_FIELDS[entity_type]] = text
+        header["total_amount"] = parse_amount(header["total_amount"])
+        header["invoice_date"] = _iso_date(header["invoice_date"])
+        header["due_date"] = _iso_date(header["due_date"])
+
+        line_items = []
+        nested = doc[~top & (doc["parent_type"] == "line_item")]
+        for line_no, (_, item) in enumerate(nested.groupby("parent_index", sort=True), start=1):
+            row = {"line_no": line_no, "description": None, "quantity": None, "unit_price": None, "amount": None}
+            for entity_type, text in zip(item["type"], value[item.index]):
+                column = DOCAI_LINE_ITEM_FIELDS.get(entity_type)
+                if column:
+                    row[column] = text if column == "description" else parse_amount(text)
+            line_items.append(row)
+
+        payments = [payment] if any(payment.values()) else []
+        invoices.append({"source_uri": source_uri, "header": header, "line_items": line_items, "payments": payments})
+    return invoices
+
+
+# --- Writes ---
+def upsert_invoices(conn: sqlite3.Connection, invoices: list) -> int:
+    """Inserts invoices in one transaction; re-loading a source_uri replaces its rows."""
+    now = time.time()
+    with conn:
+        conn.executemany("DELETE FROM invoices WHERE source_uri = ?", [(inv["source_uri"],) for inv in invoices])
+        for inv in invoices:
+            header = inv["header"]
+            cursor = conn.execute(
+                f"INSERT INTO invoices (source_uri, {', '.join(HEADER_COLUMNS)}, invoice_month, ingested_at) "
+                f"VALUES (?, {', '.join('?' for _ in HEADER_COLUMNS)}, ?, ?)",
+                (inv["source_uri"], *[header.get(c) for c in HEADER_COLUMNS],
+                 (header.get("invoice_date") or "")[:7] or None, now),
+            )
+            invoice_id = cursor.lastrowid
+            conn.executemany(
+                f"INSERT INTO line_items (invoice_id, {', '.join(LINE_ITEM_COLUMNS)}) "
+                f"VALUES (?, {', '.join('?' for _ in LINE_ITEM_COLUMNS)})",
+                [(invoice_id, *[item.get(c) for c in LINE_ITEM_COLUMNS]) for item in inv["line_items"]],
+            )
+            conn.executemany(
+                f"INSERT INTO payment_details (invoice_id, {', '.join(PAYMENT_COLUMNS)}) "
+                f"VALUES (?, {', '.join('?' for _ in PAYMENT_COLUMNS)})",
+                [(invoice_id, *[p.get(c) for c in PAYMENT_COLUMNS]) for p in inv["payments"]],
+            )
+        # Refresh planner statistics after bulk loads
+        conn.execute("PRAGMA optimize")
+    return len(invoices)
+
+
+def load_pipeline_store(conn: sqlite3.Connection, store_dir: str) -> int:
+    """Loads the Parquet entities written by invoice_pipeline.py."""
+    from invoice_pipeline import InvoiceStore
+    return upsert_invoices(conn, invoices_from_entities(InvoiceStore(store_dir).entities()))
+
+
+# --- Reads ---
+def _where(invoice_number=None, po_number=None, vendor=None, swift_code=None, date_from=None, date_to=None,
+           due_from=None, due_to=None) -> tuple:
+    clauses, params = [], []
+    if invoice_number:
+        clauses.append("i.invoice_number = ?")
+        params.append(invoice_number)
+    if po_number:
+        clauses.append("i.po_number = ?")
+        params.append(po_number)
+    if vendor:
+        # Prefix match; uses idx_invoices_vendor because the column is NOCASE
+        clauses.append("i.vendor LIKE ? ESCAPE '\\'")
+        # % and _ in a vendor name are literal, not wildcards
+        escaped = vendor.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+        params.append(f"{escaped}%")
+    if swift_code:
+        clauses.append("i.invoice_id IN (SELECT invoice_id FROM payment_details WHERE swift_code = ?)")
+        params.append(swift_code)
+    if date_from:
+        clauses.append("i.invoice_date >= ?")
+        params.append(str(date_from))
+    if date_to:
+        clauses.append("i.invoice_date <= ?")
+        params.append(str(date_to))
+    if due_from:
+        clauses.append("i.due_date >= ?")
+        params.append(str(due_from))
+    if due_to:
+        clauses.append("i.due_date <= ?")
+        params.append(str(due_to))
+    return ("WHERE " + " AND ".join(clauses)) if clauses else "", params
+
+
+def search_invoices(conn: sqlite3.Connection, limit: int = 500, **filters) -> pd.DataFrame:
+    """Invoice headers matching the filters (see _where), newest first."""
+    where, params = _where(**filters)
+    sql = (
+        "SELECT i.invoice_id, i.invoice_number, i.invoice_date, i.due_date, i.po_number, i.vendor, "
+        "i.total_amount, i.currency, i.source_uri FROM invoices i "
+        f"{where} ORDER BY i.invoice_date DESC LIMIT ?"
+    )
+    return pd.read_sql_query(sql, conn, params=[*params, limit])
+
+
+AGGREGATE_KEYS = {
+    "vendor": "i.vendor",
+    "month": "i.invoice_month",
+    "due_date": "i.due_date",
+    "currency": "i.currency",
+}
+
+
+def aggregate_invoices(conn: sqlite3.Connection, by: str = "vendor", **filters) -> pd.DataFrame:
+    """Invoice count and total spend grouped by vendor, invoice month, due date or currency."""
+    key = AGGREGATE_KEYS[by]
+    where, params = _where(**filters)
+    sql = (
+        f"SELECT {key} AS {by}, COUNT(*) AS invoices, SUM(i.total_amount) AS total_amount "
+        f"FROM invoices i {where} GROUP BY {key} ORDER BY total_amount DESC"
+    )
+    return pd.read_sql_query(sql, conn, params=params)
+
+
+def get_invoice(conn: sqlite3.Connection, invoice_id: int) -> dict:
+    header = conn.execute("SELECT * FROM invoices WHERE invoice_id = ?", (invoice_id,)).fetchone()
+    return {
+        "header": dict(header) if header else None,
+        "line_items": pd.read_sql_query(
+            "SELECT line_no, description, quantity, unit_price, amount FROM line_items WHERE invoice_id = ? ORDER BY line_no",
+            conn, params=[invoice_id]),
+        "payments": pd.read_sql_query(
+            "SELECT bank_name, account_name, account_number, iban, swift_code FROM payment_details WHERE invoice_id = ?",
+            conn, params=[invoice_id]),
+    }
+
+
+def timed(fn, *args, **kwargs) -> tuple:
+    """Runs a query and returns (result, elapsed milliseconds)."""
+    started = time.perf_counter()
+    result = fn(*args, **kwargs)
+    return result, (time.perf_counter() - started) * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Load invoices into the normalized SQLite store.")
+    parser.add_argument("command", choices=["load-store", "load-json"])
+    parser.add_argument("paths", nargs="+", help="invoice_pipeline output directory, or JSON invoice files")
+    parser.add_argument("--db", default=INVOICE_DB_PATH)
+    args = parser.parse_args()
+
+    with closing(connect(args.db)) as conn:
+        if args.command == "load-store":
+            total = sum(load_pipeline_store(conn, path) for path in args.paths)
+        else:
+            invoices = []
+            for path in args.paths:
+                with open(path, "r", encoding="utf-8") as f:
+                    invoices.append(invoice_from_json(json.load(f), os.path.abspath(path)))
+            total = upsert_invoices(conn, invoices)
+    print(f"Loaded {total} invoice(s) into {args.db}.")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,461 @@
+"""
+Batch invoice ingestion with Document AI.
+
+Takes a GCS prefix (gs://bucket/prefix) or a local directory, runs the
+invoice processor over every document with a bounded worker pool (or
+batch_process_documents for large GCS sets) and writes the extracted
+entities to a Parquet store. Progress is recorded in a manifest so an
+interrupted run resumes where it stopped.
+
+    python invoice_pipeline.py gs://invoice_parser_db_bk/DB_POC_data/ --out invoice_store --workers 8
+    python invoice_pipeline.py ./invoices --out invoice_store --fake
+    python invoice_pipeline.py ./invoices --out invoice_store --cache-dir .docai_cache
+"""
+import os
+import json
+import time
+import uuid
+import argparse
+import threading
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from types import SimpleNamespace
+import pandas as pd
+from docai_cache import DOCAI_CACHE_DIR, DocumentCache, CachingDocumentAIClient
+from pdf_sharding import SHARD_PAGES, SHARD_WORKERS, local_copy, page_count, process_pdf_sharded
+
+# Processor settings (defaults match the single-document scripts)
+PROJECT_ID = os.getenv("DOCAI_PROJECT_ID", "deutschebank-aipocs")
+LOCATION = os.getenv("DOCAI_LOCATION", "us")
+PROCESSOR_ID = os.getenv("DOCAI_PROCESSOR_ID", "153123c888659c2c")
+
+DEFAULT_WORKERS = 8
+# Above this many GCS documents, use batch_process_documents instead of online calls
+BATCH_THRESHOLD = 500
+BATCH_MAX_DOCUMENTS = 1000  # documents per batch_process_documents request
+FLUSH_EVERY = 200  # documents per Parquet part / manifest flush
+
+MIME_TYPES = {
+    ".pdf": "application/pdf",
+    ".png": "image/png",
+    ".jpg": "image/jpeg",
+    ".jpeg": "image/jpeg",
+    ".tif": "image/tiff",
+    ".tiff": "image/tiff",
+    ".gif": "image/gif",
+    ".bmp": "image/bmp",
+    ".webp": "image/webp",
+}
+
+MANIFEST_FILE = "manifest.jsonl"
+ENTITIES_DIR = "entities"
+
+
+def processor_name(project_id: str = PROJECT_ID, location: str = LOCATION, processor_id: str = PROCESSOR_ID) -> str:
+    return f"projects/{project_id}/locations/{location}/processors/{processor_id}"
+
+
+def get_client(location: str = LOCATION):
+    """Real Document AI client for the processor's region."""
+    from google.cloud import documentai_v1 as documentai
+
+    client_options = {"api_endpoint": f"{location}-documentai.googleapis.com"}
+    return documentai.DocumentProcessorServiceClient(client_options=client_options)
+
+
+# --- Sources ---
+def _split_gcs_uri(uri: str) -> tuple:
+    bucket, _, path = uri[len("gs://"):].partition("/")
+    return bucket, path
+
+
+def list_documents(source: str) -> list:
+    """Returns [(uri, mime_type)] for every supported document under a GCS prefix, local directory or file."""
+    refs = []
+    if source.startswith("gs://"):
+        from google.cloud import storage
+
+        bucket, prefix = _split_gcs_uri(source)
+        for blob in storage.Client().list_blobs(bucket, prefix=prefix):
+            mime_type = MIME_TYPES.get(os.path.splitext(blob.name)[1].lower())
+            if mime_type:
+                refs.append((f"gs://{bucket}/{blob.name}", mime_type))
+    elif os.path.isdir(source):
+        for root, _, files in os.walk(source):
+            for file_name in sorted(files):
+                mime_type = MIME_TYPES.get(os.path.splitext(file_name)[1].lower())
+                if mime_type:
+                    refs.append((os.path.join(root, file_name), mime_type))
+    elif os.path.isfile(source):
+        refs.append((source, MIME_TYPES.get(os.path.splitext(source)[1].lower(), "application/pdf")))
+    else:
+        raise FileNotFoundError(f"Source not found: {source}")
+    return sorted(refs)
+
+
+def build_process_request(name: str, uri: str, mime_type: str, content: bytes | None = None) -> dict:
+    """
+    Online processing request as a plain dict (accepted by the real client and the fake).
+    GCS documents are referenced by URI, so they are never downloaded locally.
+    """
+    if content is not None:
+        return {"name": name, "raw_document": {"content": content, "mime_type": mime_type}}
+    if uri.startswith("gs://"):
+        return {"name": name, "gcs_document": {"gcs_uri": uri, "mime_type": mime_type}}
+    with open(uri, "rb") as document_file:
+        return {"name": name, "raw_document": {"content": document_file.read(), "mime_type": mime_type}}
+
+
+def _process(client, name: str, uri: str, mime_type: str, content: bytes | None = None):
+    request = build_process_request(name, uri, mime_type, content)
+    if isinstance(client, CachingDocumentAIClient):
+        # The cache needs the original URI to report duplicates of local files
+        return client.process_document(request=request, source_uri=uri)
+    return client.process_document(request=request)
+
+
+def process_document_ref(client, name: str, uri: str, mime_type: str = "application/pdf"):
+    """Processes a single document (local path or gs:// URI) and returns the Document."""
+    return _process(client, name, uri, mime_type).document
+
+
+def _exceeds_limits(error: Exception) -> bool:
+    # InvalidArgument from the online endpoint, e.g. "Document pages exceed the limit"
+    message = str(error).lower()
+    return "exceed" in message and ("page" in message or "size" in message)
+
+
+def _process_sharded(client, name: str, uri: str, mime_type: str, shard_pages: int, workers: int):
+    if mime_type != "application/pdf" or not shard_pages:
+        return _process(client, name, uri, mime_type)
+    if uri.startswith("gs://"):
+        # Counting pages would mean downloading every object; send by reference and shard only on rejection
+        try:
+            return _process(client, name, uri, mime_type)
+        except Exception as e:
+            if not _exceeds_limits(e):
+                raise
+    else:
+        from pypdf.errors import PdfReadError
+        try:
+            pages = page_count(uri)
+        except PdfReadError:
+            # Not a PDF pypdf can read (e.g. the --fake text fixtures); the processor gets it whole
+            return _process(client, name, uri, mime_type)
+        if pages <= shard_pages:
+            return _process(client, name, uri, mime_type)
+
+    path, is_temporary = local_copy(uri)
+    try:
+        def process_shard(shard_uri, content):
+            return _process(client, name, shard_uri, mime_type, content).document
+
+        return SimpleNamespace(document=process_pdf_sharded(process_shard, path, uri, shard_pages, workers))
+    finally:
+        if is_temporary:
+            os.remove(path)
+
+
+def process_document_sharded(client, name: str, uri: str, mime_type: str = "application/pdf",
+                             shard_pages: int = SHARD_PAGES, workers: int = SHARD_WORKERS):
+    """
+    Like process_document_ref, but PDFs longer than shard_pages are split into
+    page ranges, processed concurrently and stitched back into one document.
+    """
+    return _process_sharded(client, name, uri, mime_type, shard_pages, workers).document
+
+
+# --- Entity flattening ---
+def _entity_pages(entity) -> str:
+    page_anchor = getattr(entity, "page_anchor", None)
+    page_refs = getattr(page_anchor, "page_refs", None) or []
+    return ",".join(str(int(getattr(ref, "page", 0) or 0)) for ref in page_refs)
+
+
+def flatten_entities(document, document_uri: str) -> list:
+    """
+    Flattens Document entities (and nested properties such as line-item fields)
+    into row dicts. Nested rows carry parent_type and parent_index.
+    """
+    rows = []
+
+    def add(entity, index, parent_type=None, parent_index=None):
+        normalized = getattr(entity, "normalized_value", None)
+        rows.append({
+            "document_uri": document_uri,
+            "entity_index": index,
+            "parent_type": parent_type,
+            "parent_index": parent_index,
+            "type": getattr(entity, "type_", ""),
+            "mention_text": getattr(entity, "mention_text", ""),
+            "normalized_value": getattr(normalized, "text", "") if normalized is not None else "",
+            "confidence": float(getattr(entity, "confidence", 0.0) or 0.0),
+            "pages": _entity_pages(entity),
+        })
+
+    for i, entity in enumerate(getattr(document, "entities", None) or []):
+        add(entity, i)
+        for j, prop in enumerate(getattr(entity, "properties", None) or []):
+            add(prop, j, getattr(entity, "type_", ""), i)
+    return rows
+
+
+# --- Store ---
+class InvoiceStore:
+    """
+    Parquet entity store plus a JSONL manifest of processed documents.
+    Manifest lines are written only after the matching Parquet part, so a
+    document marked done always has its entities on disk.
+    """
+
+    def __init__(self, out_dir: str):
+        self.out_dir = out_dir
+        self.entities_dir = os.path.join(out_dir, ENTITIES_DIR)
+        self.manifest_path = os.path.join(out_dir, MANIFEST_FILE)
+        os.makedirs(self.entities_dir, exist_ok=True)
+        self._lock = threading.Lock()
+        self._rows, self._records = [], []
+        self._run_id = uuid.uuid4().hex[:8]
+        self._part = 0
+
+    def completed(self) -> set:
+        if not os.path.exists(self.manifest_path):
+            return set()
+        with open(self.manifest_path, "r", encoding="utf-8") as f:
+            return {r["document_uri"] for r in map(json.loads, f) if r["status"] == "ok"}
+
+    def add(self, record: dict, rows: list):
+        with self._lock:
+            self._records.append(record)
+            self._rows.extend(rows)
+            if len(self._records) >= FLUSH_EVERY:
+                self._flush_locked()
+
+    def flush(self):
+        with self._lock:
+            self._flush_locked()
+
+    def _flush_locked(self):
+        if not self._records:
+            return
+        if self._rows:
+            part_path = os.path.join(self.entities_dir, f"part-{self._run_id}-{self._part:05d}.parquet")
+            pd.DataFrame(self._rows).to_parquet(part_path, index=False)
+            self._part += 1
+        with open(self.manifest_path, "a", encoding="utf-8") as f:
+            for record in self._records:
+                f.write(json.dumps(record) + "\n")
+        self._rows, self._records = [], []
+
+    def manifest(self) -> pd.DataFrame:
+        if not os.path.exists(self.manifest_path):
+            return pd.DataFrame()
+        return pd.read_json(self.manifest_path, lines=True)
+
+    def entities(self) -> pd.DataFrame:
+        frame = pd.read_parquet(self.entities_dir)
+        # A crash between part write and manifest flush can leave a document twice
+        return frame.drop_duplicates(subset=["document_uri", "parent_index", "entity_index", "type", "mention_text"])
+
+
+# --- Pipeline ---
+def run_online(client, name: str, refs: list, store: InvoiceStore, workers: int = DEFAULT_WORKERS,
+               shard_pages: int = SHARD_PAGES) -> None:
+    """
+    Processes refs with at most `workers` documents in flight at a time. PDFs
+    longer than shard_pages are split and their shards processed concurrently
+    (shard_pages=0 sends every document whole).
+    """
+
+    def process(uri, mime_type):
+        started = time.perf_counter()
+        try:
+            result = _process_sharded(client, name, uri, mime_type, shard_pages, SHARD_WORKERS)
+            rows = flatten_entities(result.document, uri)
+            status, error = "ok", None
+            cache_hit = getattr(result, "cache_hit", False)
+            duplicate_of = getattr(result, "duplicate_of", None)
+        except Exception as e:
+            rows, status, error = [], "error", str(e)
+            cache_hit, duplicate_of = False, None
+        latency_ms = (time.perf_counter() - started) * 1000
+        store.add({"document_uri": uri, "status": status, "latency_ms": round(latency_ms, 1),
+                   "n_entities": len(rows), "mode": "online", "error": error,
+                   "cache_hit": cache_hit, "duplicate_of": duplicate_of}, rows)
+        note = " (cached)" if cache_hit else ""
+        note += f" duplicate of {duplicate_of}" if duplicate_of else ""
+        print(f"[{status}] {uri} ({latency_ms:.0f} ms, {len(rows)} entities){note}{' - ' + error if error else ''}")
+
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        in_flight = set()
+        for uri, mime_type in refs:
+            if len(in_flight) >= workers * 2:
+                _, in_flight = wait(in_flight, return_when=FIRST_COMPLETED)
+            in_flight.add(pool.submit(process, uri, mime_type))
+        wait(in_flight)
+    store.flush()
+
+
+def run_batch(client, name: str, refs: list, output_uri: str, store: InvoiceStore, timeout: int = 3600) -> None:
+    """
+    Uses batch_process_documents for a list of GCS refs and loads the JSON
+    outputs into the store. Only the given refs are submitted (already done
+    and unsupported files stay out), BATCH_MAX_DOCUMENTS per request.
+    A batch has no per-document timing, so each document records the batch
+    wall time divided by its size as batch_avg_latency_ms instead of latency_ms.
+    """
+    from google.cloud import storage
+    from google.cloud import documentai_v1 as documentai
+
+    storage_client = storage.Client()
+    for start in range(0, len(refs), BATCH_MAX_DOCUMENTS):
+        chunk = refs[start:start + BATCH_MAX_DOCUMENTS]
+        request = {
+            "name": name,
+            "input_documents": {"gcs_documents": {"documents": [
+                {"gcs_uri": uri, "mime_type": mime_type} for uri, mime_type in chunk
+            ]}},
+            "document_output_config": {"gcs_output_config": {"gcs_uri": output_uri}},
+        }
+        started = time.perf_counter()
+        operation = client.batch_process_documents(request=request)
+        operation.result(timeout=timeout)
+        elapsed_ms = (time.perf_counter() - started) * 1000
+
+        metadata = documentai.BatchProcessMetadata(operation.metadata)
+        statuses = list(metadata.individual_process_statuses)
+        avg_ms = elapsed_ms / max(1, len(statuses))
+        for process_status in statuses:
+            uri = process_status.input_gcs_source
+            rows, error = [], None
+            if process_status.status.code != 0:
+                # Document AI failed this document; recording it as an error keeps it eligible for resume
+                error = process_status.status.message or f"batch processing failed (code {process_status.status.code})"
+            else:
+                bucket, prefix = _split_gcs_uri(process_status.output_gcs_destination)
+                try:
+                    for blob in storage_client.list_blobs(bucket, prefix=prefix):
+                        if blob.name.endswith(".json"):
+                            document = documentai.Document.from_json(blob.download_as_bytes(),
+                                                                     ignore_unknown_fields=True)
+                            rows.extend(flatten_entities(document, uri))
+                except Exception as e:
+                    error = str(e)
+            store.add({"document_uri": uri, "status": "error" if error else "ok", "latency_ms": None,
+                       "batch_avg_latency_ms": round(avg_ms, 1), "n_entities": len(rows), "mode": "batch",
+                       "error": error}, rows)
+        store.flush()
+
+
+def latency_report(store: InvoiceStore) -> dict:
+    manifest = store.manifest()
+    if manifest.empty:
+        return {"documents": 0}
+    ok = manifest[manifest["status"] == "ok"]
+    # Percentiles cover online documents only; batch documents carry just a batch average
+    latency = ok["latency_ms"].dropna()
+    report = {
+        "documents": int(len(manifest)),
+        "ok": int(len(ok)),
+        "errors": int((manifest["status"] != "ok").sum()),
+        "entities": int(ok["n_entities"].sum()),
+        "latency_ms_p50": float(latency.quantile(0.5)) if len(latency) else None,
+        "latency_ms_p95": float(latency.quantile(0.95)) if len(latency) else None,
+        "latency_ms_p99": float(latency.quantile(0.99)) if len(latency) else None,
+    }
+    if "batch_avg_latency_ms" in ok and ok["batch_avg_latency_ms"].notna().any():
+        report["batch_avg_latency_ms"] = float(ok["batch_avg_latency_ms"].mean())
+    return report
+
+
+def ingest(source: str, out_dir: str, client=None, name: str | None = None, workers: int = DEFAULT_WORKERS,
+           use_batch: bool | None = None, batch_output_uri: str | None = None,
+           cache_dir: str | None = None, shard_pages: int = SHARD_PAGES) -> dict:
+    """
+    Runs the pipeline end to end and returns the latency report. With
+    cache_dir, online calls go through the content-hash response cache
+    (batch mode always calls the processor).
+    """
+    client = client or get_client()
+    cache = None
+    if cache_dir:
+        cache = DocumentCache(cache_dir)
+        client = CachingDocumentAIClient(client, cache)
+    name = name or processor_name()
+    store = InvoiceStore(out_dir)
+
+    done = store.completed()
+    refs = [ref for ref in list_documents(source) if ref[0] not in done]
+    print(f"{len(refs)} document(s) to process ({len(done)} already done).")
+
+    if use_batch is None:
+        use_batch = source.startswith("gs://") and len(refs) > BATCH_THRESHOLD and batch_output_uri is not None
+    if use_batch:
+        if not (source.startswith("gs://") and batch_output_uri):
+            raise ValueError("Batch mode needs a gs:// source and a gs:// batch output URI.")
+        if refs:
+            run_batch(client, name, refs, batch_output_uri, store)
+    elif refs:
+        run_online(client, name, refs, store, workers=workers, shard_pages=shard_pages)
+
+    report = latency_report(store)
+    if cache is not None:
+        report["cache"] = cache.stats()
+    print(json.dumps(report, indent=2))
+    return report
+
+
+# --- Local fake client ---
+class FakeDocumentAIClient:
+    """
+    Offline stand-in for DocumentProcessorServiceClient.process_document.
+    Reads the raw (or local) document and turns every "key: value" text line
+    into an entity, so pipelines can be exercised without GCP access.
+    """
+
+    def __init__(self, latency_seconds: float = 0.0):
+        self.latency_seconds = latency_seconds
+        self.calls = 0
+        self._lock = threading.Lock()
+
+    def process_document(self, request: dict):
+        with self._lock:
+            self.calls += 1
+        if self.latency_seconds:
+            time.sleep(self.latency_seconds)
+        raw = request.get("raw_document")
+        if raw is None:
+            raise ValueError("FakeDocumentAIClient only supports raw_document requests.")
+        text = raw["content"].decode("utf-8", errors="ignore")
+        entities = []
+        for line in text.splitlines():
+            key, sep, value = line.partition(":")
+            if sep and key.strip():
+                entities.append(SimpleNamespace(
+                    type_=key.strip().lower().replace(" ", "_"), mention_text=value.strip(),
+                    normalized_value=SimpleNamespace(text=value.strip()), confidence=1.0,
+                    properties=[], page_anchor=SimpleNamespace(page_refs=[SimpleNamespace(page=0)]),
+                ))
+        return SimpleNamespace(document=SimpleNamespace(entities=entities, text=text))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Batch Document AI invoice ingestion.")
+    parser.add_argument("source", help="gs://bucket/prefix, local directory or single file")
+    parser.add_argument("--out", default="invoice_store", help="Output directory for Parquet entities and manifest")
+    parser.add_argument("--workers", type=int, default=DEFAULT_WORKERS, help="Concurrent online requests")
+    parser.add_argument("--batch", action="store_true", default=None, help="Force batch_process_documents (GCS only)")
+    parser.add_argument("--batch-output", default=os.getenv("DOCAI_BATCH_OUTPUT_URI"), help="gs:// URI for batch outputs")
+    parser.add_argument("--fake", action="store_true", help="Use the local fake Document AI client")
+    parser.add_argument("--cache-dir", default=None, help=f"Response cache directory (e.g. {DOCAI_CACHE_DIR})")
+    parser.add_argument("--shard-pages", type=int, default=SHARD_PAGES,
+                        help="Split PDFs longer than this many pages (0 disables sharding)")
+    args = parser.parse_args()
+
+    client = FakeDocumentAIClient() if args.fake else None
+    ingest(args.source, args.out, client=client, workers=args.workers, use_batch=args.batch,
+           batch_output_uri=args.batch_output, cache_dir=args.cache_dir,
+           shard_pages=args.shard_pages)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,152 @@
+"""
+Page-range sharding for PDFs that exceed online processing limits.
+
+A large PDF is split into shards of at most SHARD_PAGES pages, which are
+processed concurrently and stitched back into one logical document: page
+anchors, page numbers and text offsets are shifted to their position in the
+original file, and single-valued header fields (invoice id, totals, ...)
+keep their highest-confidence occurrence. Shards are cut lazily from the
+file on disk, so at most `workers` shards are held in memory at once.
+"""
+import os
+import io
+import tempfile
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from types import SimpleNamespace
+
+# Online invoice parser limit is 15 pages per request
+SHARD_PAGES = int(os.getenv("DOCAI_SHARD_PAGES", "15"))
+SHARD_WORKERS = int(os.getenv("DOCAI_SHARD_WORKERS", "4"))
+
+# Entity types that legitimately repeat across pages; everything else is a header field
+REPEATED_ENTITY_TYPES = {"line_item", "vat", "receiver_tax_id", "supplier_tax_id"}
+
+
+def _split_gcs_uri(uri: str) -> tuple:
+    bucket, _, blob_name = uri[len("gs://"):].partition("/")
+    return bucket, blob_name
+
+
+def local_copy(uri: str) -> tuple:
+    """Returns (local path, is_temporary); gs:// objects are streamed to a temp file, not memory."""
+    if not uri.startswith("gs://"):
+        return uri, False
+    from google.cloud import storage
+
+    bucket, blob_name = _split_gcs_uri(uri)
+    handle, path = tempfile.mkstemp(suffix=".pdf")
+    os.close(handle)
+    storage.Client().bucket(bucket).blob(blob_name).download_to_filename(path)
+    return path, True
+
+
+def page_count(path: str) -> int:
+    from pypdf import PdfReader
+
+    return len(PdfReader(path).pages)
+
+
+def iter_shards(path: str, shard_pages: int = SHARD_PAGES):
+    """Yields (start_page, end_page, pdf bytes) for consecutive page ranges (0-based, end exclusive)."""
+    from pypdf import PdfReader, PdfWriter
+
+    reader = PdfReader(path)
+    total = len(reader.pages)
+    for start in range(0, total, shard_pages):
+        end = min(start + shard_pages, total)
+        writer = PdfWriter()
+        for page_index in range(start, end):
+            writer.add_page(reader.pages[page_index])
+        buffer = io.BytesIO()
+        writer.write(buffer)
+        yield start, end, buffer.getvalue()
+
+
+# Page elements whose layout.text_anchor points into document.text
+PAGE_ELEMENTS = ("blocks", "paragraphs", "lines", "tokens", "visual_elements", "symbols")
+
+
+def _shift_anchors(document, page_offset: int, text_offset: int):
+    """Moves page refs, page numbers and text segments of one shard to their place in the full file."""
+
+    def shift_text(text_anchor):
+        for segment in getattr(text_anchor, "text_segments", None) or []:
+            segment.start_index = int(getattr(segment, "start_index", 0) or 0) + text_offset
+            segment.end_index = int(getattr(segment, "end_index", 0) or 0) + text_offset
+
+    def shift_layout(element):
+        shift_text(getattr(getattr(element, "layout", None), "text_anchor", None))
+
+    def shift_entity(entity):
+        for ref in getattr(getattr(entity, "page_anchor", None), "page_refs", None) or []:
+            ref.page = int(getattr(ref, "page", 0) or 0) + page_offset
+        shift_text(getattr(entity, "text_anchor", None))
+        for prop in getattr(entity, "properties", None) or []:
+            shift_entity(prop)
+
+    for entity in getattr(document, "entities", None) or []:
+        shift_entity(entity)
+    for page in getattr(document, "pages", None) or []:
+        if hasattr(page, "page_number"):
+            page.page_number = int(page.page_number or 0) + page_offset
+        shift_layout(page)
+        for kind in PAGE_ELEMENTS:
+            for element in getattr(page, kind, None) or []:
+                shift_layout(element)
+        for table in getattr(page, "tables", None) or []:
+            shift_layout(table)
+            for row in list(getattr(table, "header_rows", None) or []) + list(getattr(table, "body_rows", None) or []):
+                for cell in getattr(row, "cells", None) or []:
+                    shift_layout(cell)
+        for field in getattr(page, "form_fields", None) or []:
+            # field_name / field_value are Layouts themselves
+            shift_text(getattr(getattr(field, "field_name", None), "text_anchor", None))
+            shift_text(getattr(getattr(field, "field_value", None), "text_anchor", None))
+
+
+def stitch_documents(shards: list):
+    """
+    Combines [(start_page, Document)] into one document-like object with
+    entities, text and pages. Repeated entity types are concatenated; header
+    fields keep the highest-confidence value across shards.
+    """
+    entities, pages, texts = [], [], []
+    best_header = {}
+    text_offset = 0
+    for start, document in sorted(shards, key=lambda item: item[0]):
+        _shift_anchors(document, start, text_offset)
+        text = getattr(document, "text", "") or ""
+        texts.append(text)
+        text_offset += len(text)
+        pages.extend(getattr(document, "pages", None) or [])
+        for entity in getattr(document, "entities", None) or []:
+            entity_type = getattr(entity, "type_", "")
+            if entity_type in REPEATED_ENTITY_TYPES:
+                entities.append(entity)
+                continue
+            current = best_header.get(entity_type)
+            if current is None or (getattr(entity, "confidence", 0) or 0) > (getattr(current, "confidence", 0) or 0):
+                best_header[entity_type] = entity
+    return SimpleNamespace(entities=list(best_header.values()) + entities, text="".join(texts), pages=pages,
+                           shard_count=len(shards))
+
+
+def process_pdf_sharded(process_shard, path: str, uri: str, shard_pages: int = SHARD_PAGES,
+                        workers: int = SHARD_WORKERS):
+    """
+    Splits the local PDF at path into page ranges and runs process_shard(shard_uri, content)
+    for each, with at most `workers` shards in flight. Returns the stitched document.
+    """
+    results = []
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        in_flight = {}
+        for start, end, content in iter_shards(path, shard_pages):
+            if len(in_flight) >= workers:
+                done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+                for future in done:
+                    results.append((in_flight.pop(future), future.result()))
+            shard_uri = f"{uri}#pages={start + 1}-{end}"
+            in_flight[pool.submit(process_shard, shard_uri, content)] = start
+        for future in wait(in_flight).done:
+            results.append((in_flight[future], future.result()))
+    return stitch_documents(results)
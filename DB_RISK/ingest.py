@@ -2,15 +2,14 @@
 import os
 import tempfile
 from dotenv import load_dotenv
-from PyPDF2 import PdfReader
-from google.cloud import storage
-from langchain_text_splitters import RecursiveCharacterTextSplitter
-from langchain_google_genai import GoogleGenerativeAIEmbeddings
-from langchain_community.vectorstores.pgvector import PGVector
-from typing import List, Dict, Any
-from langchain_core.documents import Document # Ensure Document is imported
+from typing import List, Dict, Any, TYPE_CHECKING
 import re
 import logging
+
+# PDF, GCS and LangChain SDKs are imported inside the functions that use them,
+# so importing this module (main.py does at startup) stays cheap
+if TYPE_CHECKING:
+    from langchain_core.documents import Document
  
 # --- Configuration ---
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
@@ -49,6 +48,8 @@ COLLECTION_NAME = "risk_dossier_corpus"
  
 def extract_text_from_pdf_local(file_path: str) -> str:
     """Extracts text from a local PDF file."""
+    from PyPDF2 import PdfReader
+
     text = ""
     try:
         with open(file_path, 'rb') as file:
@@ -73,6 +74,7 @@ def extract_text_from_pdf_gcs(bucket_name: str, blob_name: str) -> str:
         return ""
  
     try:
+        from google.cloud import storage
         storage_client = storage.Client()
         bucket = storage_client.bucket(bucket_name)
         blob = bucket.blob(blob_name)
@@ -109,6 +111,7 @@ def get_pdf_paths_from_gcs(bucket_name: str) -> List[str]:
         return []
  
     try:
+        from google.cloud import storage
         storage_client = storage.Client()
         blobs = storage_client.list_blobs(bucket_name)
         pdf_blobs = [blob.name for blob in blobs if blob.name.lower().endswith('.pdf')]
@@ -122,6 +125,7 @@ def get_pdf_paths_from_gcs(bucket_name: str) -> List[str]:
 def get_embeddings_model():
     """Initializes and returns the Gemini embeddings model using Vertex AI."""
     try:
+        from langchain_google_genai import GoogleGenerativeAIEmbeddings
         embeddings = GoogleGenerativeAIEmbeddings(
             model=GEMINI_EMBEDDING_MODEL_NAME
         )
@@ -131,10 +135,12 @@ def get_embeddings_model():
         logging.error(f"Error initializing Gemini embeddings model: {e}")
         return None
  
-def split_text_into_chunks(text: str) -> List[Document]: # Return List[Document] for PGVector
+def split_text_into_chunks(text: str) -> List["Document"]: # Return List[Document] for PGVector
     """Splits text into manageable chunks and returns them as Langchain Documents."""
     if not text:
         return []
+    from langchain_core.documents import Document
+    from langchain_text_splitters import RecursiveCharacterTextSplitter
     text_splitter = RecursiveCharacterTextSplitter(
         chunk_size=CHUNK_SIZE,
         chunk_overlap=CHUNK_OVERLAP,
@@ -146,12 +152,16 @@ def split_text_into_chunks(text: str) -> List[Document]: # Return List[Document]
     return [Document(page_content=chunk) for chunk in chunks]
  
 # --- PGVector Insertion ---
-def ingest_to_pgvector(documents: List[Document]):
+def ingest_to_pgvector(documents: List["Document"]):
     """Ingests documents into PGVector."""
     if not documents:
         logging.warning("No documents to ingest.")
         return
  
+    if os.getenv("KYC_VECTOR_BACKEND", "pgvector") == "local":
+        ingest_to_local_index(documents)
+        return
+ 
     if not all([DB_HOST, DB_NAME, DB_USER, DB_PASSWORD, DB_PORT]):
         logging.error("Database credentials are not fully set in .env. Cannot initialize PGVector.")
         return
@@ -162,6 +172,7 @@ def ingest_to_pgvector(documents: List[Document]):
             logging.error("Failed to initialize embeddings model for PGVector. Aborting ingestion.")
             return
  
+        from langchain_community.vectorstores.pgvector import PGVector
         logging.info(f"Initializing PGVector store for ingestion using connection string: {PGVECTOR_CONNECTION_STRING.split('@')[0]}@...(hidden credentials)")
         vector_store_ingest = PGVector(
             collection_name=COLLECTION_NAME,
@@ -172,10 +183,28 @@ def ingest_to_pgvector(documents: List[Document]):
         logging.info(f"Adding {len(documents)} documents to PGVector collection '{COLLECTION_NAME}'...")
         vector_store_ingest.add_documents(documents)
         logging.info(f"Successfully added {len(documents)} documents to PGVector.")
+        # Cached retrievals for this collection are stale now
+        import retrieval_cache
+        retrieval_cache.bump_corpus_version(COLLECTION_NAME, PGVECTOR_CONNECTION_STRING)
  
     except Exception as e:
         logging.error(f"Error during PGVector ingestion: {e}")
  
+def ingest_to_local_index(documents: List["Document"]):
+    """Appends documents to the local vector index used with KYC_VECTOR_BACKEND=local."""
+    embeddings_model = get_embeddings_model()
+    if not embeddings_model:
+        logging.error("Failed to initialize embeddings model. Aborting ingestion.")
+        return
+    from local_vector_store import LocalVectorStore, KYC_LOCAL_INDEX_DIR
+    import retrieval_cache
+    try:
+        LocalVectorStore(KYC_LOCAL_INDEX_DIR, embeddings_model, collection_name=COLLECTION_NAME).add_documents(documents)
+        logging.info(f"Successfully added {len(documents)} documents to the local index in {KYC_LOCAL_INDEX_DIR}.")
+        retrieval_cache.bump_corpus_version(COLLECTION_NAME)
+    except Exception as e:
+        logging.error(f"Error during local index ingestion: {e}")
+ 
 # --- Main Ingestion Logic ---
 def extract_year_from_filename(filename: str) -> int | None:
     """
@@ -0,0 +1,588 @@
+# kyc_engine.py
+"""
+The KYC risk dossier RAG pipeline, importable without Streamlit.
+
+main.py (the UI), kyc_service.py (batch CLI and HTTP API) and benchmark.py
+all go through get_engine(), so one process builds the models and the
+PGVector connection pool once and shares them between callers.
+"""
+import os
+import re
+import sys
+import json
+import time
+import logging
+import threading
+from dataclasses import dataclass, replace
+from concurrent.futures import ThreadPoolExecutor
+from dotenv import load_dotenv
+import tracing
+import retrieval_cache
+import rerank
+import vector_compression
+# llm_gateway.py is shared by all apps and lives at the repository root
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+# LangChain, Gemini and PGVector are imported on first use (see KYCEngine)
+
+load_dotenv()
+
+# Vertex AI Gemini Model Names
+GEMINI_LLM_MODEL_NAME = "gemini-2.5-flash"
+EMBEDDING_MODEL_NAME = "models/embedding-001"
+
+# --- Client Information ---
+CLIENT_NAME = "Apex Global Services FZE"
+
+# --- PGVector Connection String Logic ---
+DB_HOST = os.getenv("DB_HOST")
+DB_NAME = os.getenv("DB_NAME")
+DB_USER = os.getenv("DB_USER")
+DB_PASSWORD = os.getenv("DB_PASSWORD")
+DB_PORT = os.getenv("DB_PORT", "5432")
+
+# Corrected connection string to include port
+PGVECTOR_CONNECTION_STRING = f"postgresql://{DB_USER}:{DB_PASSWORD}@{DB_HOST}:{DB_PORT}/{DB_NAME}"
+COLLECTION_NAME = "risk_dossier_corpus"
+# Pooled connections per process (the pool may grow by as many again under bursts)
+KYC_DB_POOL_SIZE = int(os.getenv("KYC_DB_POOL_SIZE", "8"))
+# "pgvector", or "local" for the in-process index in KYC_LOCAL_INDEX_DIR (see local_vector_store.py)
+KYC_VECTOR_BACKEND = os.getenv("KYC_VECTOR_BACKEND", "pgvector")
+
+NO_INFORMATION = "No information found for this query."
+
+
+class KYCEngineError(Exception):
+    pass
+
+
+def db_configured() -> bool:
+    return all([DB_HOST, DB_NAME, DB_USER, DB_PASSWORD, DB_PORT])
+
+
+def corpus_version_url(vector_store) -> str | None:
+    """Where the collection's corpus version lives: its Postgres database, or None (local version file)."""
+    return PGVECTOR_CONNECTION_STRING if hasattr(vector_store, "session_maker") else None
+
+
+def store_configured() -> bool:
+    """The local backend needs no database; it starts empty if its directory does not exist yet."""
+    return KYC_VECTOR_BACKEND == "local" or db_configured()
+
+
+# --- RAG configuration ---
+# Prompt versions selectable with KYC_PROMPT_VERSION; add a new key rather than editing a live one
+PROMPT_TEMPLATES = {
+    "v1": """
+    You are an AI assistant specializing in summarizing Know Your Customer (KYC) risk assessment dossiers.
+    Your task is to provide a concise summary of the client's risk profile for a specific year,
+    and then state the identified risk level.
+ 
+    Use the following pieces of context (relevant chunks from the risk dossier) to answer the question.
+    Focus on information pertaining to the specified year if a year is mentioned in the question.
+ 
+    **Instructions:**
+    1.  Provide a "Summary:" section with 3-4 sentences covering key findings and risk drivers for the specified year.
+        **If no specific year was provided in the query, state 'Summary for unspecified year:'**
+    2.  Provide a "Risk Level:" section with the identified risk level (e.g., High, Medium, Low, Critical).
+    3.  If no relevant information is found for the specified year or the query, state "No information found for this query." in both sections.
+    4.  Do NOT include any conversational filler or introductory phrases.
+ 
+    Context:
+    {context}
+ 
+    Question:
+    {question}
+ 
+    Helpful Answer:
+    """,
+}
+
+
+@dataclass(frozen=True)
+class RAGConfig:
+    """Settings the chain is built from; a change triggers a rebuild (see KYCEngine.chain)."""
+    llm_model: str = GEMINI_LLM_MODEL_NAME
+    temperature: float = 0.3
+    retrieval_k: int = 30
+    prompt_version: str = "v1"
+    # Two-stage retrieval (see rerank.py): fetch rerank_candidates, send the best rerank_top_n
+    rerank: str = "off"
+    rerank_candidates: int = 60
+    rerank_top_n: int = 8
+    # Search a halfvec / binary HNSW index and rescore k * rescore_factor at full precision (see vector_compression.py)
+    vector_compression: str = "off"
+    rescore_factor: int = 4
+
+
+# Optional JSON file overriding RAGConfig fields at runtime, e.g. {"retrieval_k": 20, "prompt_version": "v2"}
+KYC_RAG_CONFIG_FILE = os.getenv("KYC_RAG_CONFIG_FILE", "rag_config.json")
+_config_cache = {"key": None, "config": None}
+_config_lock = threading.Lock()
+
+
+def load_rag_config() -> RAGConfig:
+    """
+    RAGConfig from the environment, overridden by KYC_RAG_CONFIG_FILE when it
+    exists. The file is re-read only when its mtime changes, so this is cheap
+    to call on every query or rerun.
+    """
+    try:
+        mtime = os.stat(KYC_RAG_CONFIG_FILE).st_mtime_ns
+    except OSError:
+        mtime = None
+    with _config_lock:
+        if _config_cache["config"] is not None and _config_cache["key"] == mtime:
+            return _config_cache["config"]
+        values = {
+            "llm_model": os.getenv("KYC_LLM_MODEL", GEMINI_LLM_MODEL_NAME),
+            "temperature": float(os.getenv("KYC_LLM_TEMPERATURE", "0.3")),
+            "retrieval_k": int(os.getenv("KYC_RETRIEVAL_K", "30")),
+            "prompt_version": os.getenv("KYC_PROMPT_VERSION", "v1"),
+            "rerank": os.getenv("KYC_RERANK", "off"),
+            "rerank_candidates": int(os.getenv("KYC_RERANK_CANDIDATES", "60")),
+            "rerank_top_n": int(os.getenv("KYC_RERANK_TOP_N", "8")),
+            "vector_compression": os.getenv("KYC_VECTOR_COMPRESSION", "off"),
+            "rescore_factor": int(os.getenv("KYC_RESCORE_FACTOR", "4")),
+        }
+        if mtime is not None:
+            try:
+                with open(KYC_RAG_CONFIG_FILE, "r", encoding="utf-8") as f:
+                    overrides = json.load(f)
+                values.update({k: v for k, v in overrides.items() if k in RAGConfig.__dataclass_fields__})
+            except (OSError, ValueError) as e:
+                logging.error(f"Ignoring unreadable {KYC_RAG_CONFIG_FILE}: {e}")
+        config = RAGConfig(**values)
+        if config.prompt_version not in PROMPT_TEMPLATES:
+            logging.error(f"Unknown prompt version '{config.prompt_version}'; using v1.")
+            config = replace(config, prompt_version="v1")
+        if config.rerank not in rerank.RERANK_METHODS:
+            logging.error(f"Unknown rerank method '{config.rerank}'; reranking is off.")
+            config = replace(config, rerank="off")
+        if config.vector_compression not in vector_compression.COMPRESSION_MODES:
+            logging.error(f"Unknown vector compression '{config.vector_compression}'; searching at full precision.")
+            config = replace(config, vector_compression="off")
+        _config_cache.update(key=mtime, config=config)
+        return config
+
+
+# --- Initialize Models ---
+# The builders run on the engine's warm-up threads
+def _build_gemini_llm(config: RAGConfig):
+    """
+    A chat-model runnable that sends the rendered prompt through the shared
+    llm_gateway (concurrency limit, quotas, retries, hedging, metrics).
+    """
+    from langchain_core.messages import AIMessage
+    from langchain_core.runnables import RunnableLambda
+    import llm_gateway
+
+    gateway = llm_gateway.get_gateway()
+
+    def generate(prompt_value):
+        prompt_text = "\n\n".join(str(message.content) for message in prompt_value.to_messages())
+        response = gateway.generate(prompt_text, config.llm_model, {"temperature": config.temperature})
+        return AIMessage(
+            content=response.text,
+            usage_metadata={"input_tokens": response.prompt_tokens, "output_tokens": response.output_tokens,
+                            "total_tokens": response.prompt_tokens + response.output_tokens},
+            response_metadata={"attempts": response.attempts, "hedged": response.hedged,
+                               "backend": response.backend},
+        )
+
+    logging.info(f"Gemini chat model {config.llm_model} routed through llm_gateway (backend: {gateway.default_backend}).")
+    return RunnableLambda(generate, name=config.llm_model)
+
+def _build_gemini_embeddings():
+    from langchain_google_genai import GoogleGenerativeAIEmbeddings
+    embeddings = GoogleGenerativeAIEmbeddings(
+        model=EMBEDDING_MODEL_NAME
+    )
+    logging.info("Gemini embeddings model initialized successfully using Vertex AI/ADC.")
+    return embeddings
+
+def _build_vector_store(embeddings_future):
+    embeddings = embeddings_future.result()
+    if KYC_VECTOR_BACKEND == "local":
+        from local_vector_store import LocalVectorStore, KYC_LOCAL_INDEX_DIR
+        vector_store = LocalVectorStore(KYC_LOCAL_INDEX_DIR, embeddings, collection_name=COLLECTION_NAME)
+        logging.info(f"Local vector index opened from {KYC_LOCAL_INDEX_DIR} ({len(vector_store)} chunks).")
+        return vector_store
+    from langchain_community.vectorstores.pgvector import PGVector
+    logging.info(f"Initializing PGVector store with connection string: {PGVECTOR_CONNECTION_STRING.split('@')[0]}@...(hidden credentials)")
+    vector_store = PGVector(
+        collection_name=COLLECTION_NAME,
+        connection_string=PGVECTOR_CONNECTION_STRING,
+        embedding_function=embeddings,
+        # One pooled SQLAlchemy engine shared by every concurrent query
+        engine_args={"pool_size": KYC_DB_POOL_SIZE, "max_overflow": KYC_DB_POOL_SIZE, "pool_pre_ping": True},
+    )
+    logging.info("PGVector store initialized successfully.")
+    return vector_store
+
+
+# --- Helper to extract year from query (More Robust) ---
+def extract_year_from_query(query: str) -> int | None:
+    """
+    Extracts a 4-digit year from the query, prioritizing phrases like '2023 review'
+    or 'in 2022'.
+    """
+    year_patterns = [
+        # More specific patterns first
+        r'\b(20\d{2})\b',  # Matches exactly 2000-2099 (e.g., 2021, 2023)
+        r'review of (\d{4})', # e.g., "review of 2021"
+        r'(\d{4}) review',  # e.g., "2023 review"
+        r'in (\d{4})',      # e.g., "in 2022"
+        r'(\d{2})review',   # e.g., "21review" (less common but covers some cases)
+        r'(\d{2})-(\d{2})', # e.g., "2021-2022" - try to capture the first year
+        r'KYC Risk Dossier:.*?(\d{4})' # e.g., KYC Risk Dossier: 2020-2024 Periodic Review
+    ]
+ 
+    found_year = None
+ 
+    for pattern in year_patterns:
+        matches = re.findall(pattern, query, re.IGNORECASE)
+        for match in matches:
+            if isinstance(match, tuple): # Handle patterns that capture multiple groups (like (\d{2})-(\d{2}))
+                year_str = match[0] # Take the first captured group
+            else: # Handle single group or direct match
+                year_str = match
+ 
+            try:
+                year = int(year_str)
+                # Basic validation for plausible years (adjust range as needed)
+                if 2000 <= year <= 2030:
+                    if found_year is None or year < found_year: # Prioritize earlier years if multiple found
+                         found_year = year
+                         logging.info(f"Found potential year {year} from query '{query}' using pattern '{pattern}'.")
+            except ValueError:
+                logging.warning(f"Could not parse year from query '{query}' (matched '{match}').")
+                continue
+ 
+        if found_year is not None:
+            # If you want to be strict and stop at the first valid year found, uncomment break.
+            # break
+            pass # Continue to check other patterns to potentially find a better year
+ 
+    if found_year:
+        logging.info(f"Final extracted year for query '{query}' is {found_year}.")
+        return found_year
+    else:
+        logging.warning(f"No valid 4-digit year (2000-2030) found in the query: '{query}'.")
+        return None
+ 
+# --- RAG Chain Setup ---
+def setup_rag_chain(vector_store, llm, config: "RAGConfig" = None, cache: "retrieval_cache.RetrievalCache" = None):
+    if not vector_store or not llm:
+        logging.error("Vector store or LLM is not initialized. Cannot set up RAG chain.")
+        return None
+    from langchain_core.prompts import ChatPromptTemplate
+    from langchain_core.runnables import RunnablePassthrough
+    from langchain_core.output_parsers import StrOutputParser
+ 
+    config = config or load_rag_config()
+    retrieval_k = config.retrieval_k # Fetch top k similar documents
+    # With reranking, fetch a wider candidate set and keep only the best few for the prompt
+    search_k = config.rerank_candidates if config.rerank != "off" else retrieval_k
+    embeddings = vector_store.embeddings
+ 
+    prompt = ChatPromptTemplate.from_template(PROMPT_TEMPLATES[config.prompt_version])
+ 
+    # The parser is applied separately so the LLM message's usage metadata can be traced
+    rag_chain_core = (
+        {"context": RunnablePassthrough(), "question": RunnablePassthrough()}
+        | prompt
+        | llm
+    )
+    output_parser = StrOutputParser()
+ 
+    def invoke_rag_with_filtered_retrieval(query_input):
+        logging.info(f"--- Processing Query: '{query_input}' ---")
+        with tracing.span("extract_year", query_chars=len(query_input)) as year_span:
+            query_year = extract_year_from_query(query_input) # Use the improved function
+            year_span.set(year=query_year if query_year is not None else "none")
+        logging.info(f"Extracted year from query: {query_year}")
+ 
+        retrieved_docs = []
+        all_relevant_docs = []
+ 
+        try:
+            # Construct the filter for the retriever based on the query_year
+            retriever_filter = None
+            if query_year is not None:
+                # The filter for PGVector in Langchain expects a dictionary
+                # where keys are metadata keys and values are the filter criteria.
+                retriever_filter = {"review_year": query_year}
+                logging.info(f"Applying retriever filter: {retriever_filter}")
+           
+            # Embed and search as separate steps so each is timed on its own;
+            # the filter is applied inside the PGVector query
+            with tracing.span("embed_query", model=EMBEDDING_MODEL_NAME) as embed_span:
+                query_embedding = embeddings.embed_query(query_input)
+                embed_span.set(dimensions=len(query_embedding))
+            cached_docs = None
+            # Compressed search and its rescoring depth change which chunks come back
+            search_mode = (f"{config.vector_compression}:{config.rescore_factor}"
+                           if config.vector_compression != "off" else "off")
+            if cache is not None:
+                with tracing.span("retrieval_cache", k=search_k, filter=str(retriever_filter)) as cache_span:
+                    cached_docs = cache.get(query_embedding, retriever_filter, search_k, search_mode)
+                    cache_span.set(hit=cached_docs is not None)
+            if cached_docs is not None:
+                all_relevant_docs = cached_docs
+            else:
+                with tracing.span("pgvector_search", k=search_k, filter=str(retriever_filter),
+                                  compression=config.vector_compression) as search_span:
+                    all_relevant_docs = vector_compression.similarity_search(
+                        vector_store, query_embedding, search_k, retriever_filter,
+                        config.vector_compression, config.rescore_factor
+                    )
+                    doc_sizes = [len(doc.page_content) for doc in all_relevant_docs]
+                    search_span.set(docs_retrieved=len(all_relevant_docs), context_chars=sum(doc_sizes),
+                                    max_doc_chars=max(doc_sizes, default=0))
+                if cache is not None:
+                    cache.put(query_embedding, retriever_filter, search_k, all_relevant_docs, search_mode)
+           
+            if config.rerank != "off" and all_relevant_docs:
+                with tracing.span("rerank", method=config.rerank, candidates=len(all_relevant_docs)) as rerank_span:
+                    # What the prompt would have carried without reranking: the first retrieval_k by similarity
+                    baseline_tokens = tracing.estimate_tokens("".join(d.page_content for d in all_relevant_docs[:retrieval_k]))
+                    all_relevant_docs, method = rerank.rerank(query_input, all_relevant_docs, config.rerank_top_n,
+                                                              config.rerank)
+                    kept_tokens = tracing.estimate_tokens("".join(d.page_content for d in all_relevant_docs))
+                    rerank_span.set(method=method, kept=len(all_relevant_docs), baseline_tokens_est=baseline_tokens,
+                                    context_tokens_est=kept_tokens,
+                                    prompt_tokens_saved_est=baseline_tokens - kept_tokens)
+ 
+            logging.info(f"Retrieved {len(all_relevant_docs)} documents after applying filter.")
+           
+            context_for_llm = "No relevant context found for your query." # Default message
+ 
+            if all_relevant_docs:
+                # If docs were found after filtering, format them.
+                # The filter should have already ensured they are for the correct year.
+                with tracing.span("format_context", docs_in=len(all_relevant_docs)) as format_span:
+                    context_for_llm = format_docs_with_year_filter(all_relevant_docs, query_year)
+                    format_span.set(context_chars=len(context_for_llm),
+                                    context_tokens_est=tracing.estimate_tokens(context_for_llm))
+            else:
+                # If no docs found after filtering, provide a specific message.
+                if query_year is not None:
+                    logging.warning(f"No documents found matching the query year {query_year} after retrieval and filtering.")
+                    context_for_llm = f"No relevant context found for the year {query_year}."
+                else:
+                    # This case should ideally not happen if all_relevant_docs is empty and query_year is None,
+                    # but for safety:
+                    context_for_llm = "No relevant context found for your query."
+ 
+            logging.debug(f"Context prepared for LLM (first 500 chars):\n{context_for_llm[:500]}...")
+ 
+        except Exception as e:
+            logging.error(f"Error during retrieval or filtering for query '{query_input}': {e}")
+            # Answering from an error message would look like a normal (ok) answer; fail the query instead
+            tracing.record_error(f"retrieval failed: {e}")
+            return f"An error occurred during document retrieval: {e}"
+       
+        final_prompt_input = {
+            "context": context_for_llm,
+            "question": query_input
+        }
+ 
+        try:
+            with tracing.span("llm_generate", model=config.llm_model, prompt_version=config.prompt_version) as llm_span:
+                message = rag_chain_core.invoke(final_prompt_input)
+                response = output_parser.invoke(message)
+                usage = getattr(message, "usage_metadata", None) or {}
+                llm_span.set(
+                    prompt_tokens=usage.get("input_tokens", tracing.estimate_tokens(context_for_llm + query_input)),
+                    output_tokens=usage.get("output_tokens", tracing.estimate_tokens(response)),
+                    token_counts="reported" if usage else "estimated",
+                    **{k: v for k, v in getattr(message, "response_metadata", {}).items() if k in ("attempts", "hedged")},
+                )
+            logging.info(f"LLM response generated successfully.")
+            return response
+        except Exception as e:
+            logging.error(f"Error during RAG chain invocation for query '{query_input}': {e}")
+            tracing.record_error(f"generation failed: {e}")
+            return f"An error occurred while processing your request: {e}"
+ 
+    # This function remains the same, as the filtering is now done by the retriever.
+    # It's still useful for ensuring the output context is clean if any relevant docs are passed.
+    def format_docs_with_year_filter(docs, year):
+        """Formats documents, only including those that match the specified year."""
+        if not docs:
+            logging.warning("No documents provided to format.")
+            return "No relevant context found for the query."
+ 
+        if year is not None:
+            # This filter is now redundant if the retriever already filtered,
+            # but it's good for safety and ensures the output is clean.
+            relevant_docs = [doc for doc in docs if doc.metadata.get('review_year') == year]
+            logging.debug(f"Formatting: Found {len(relevant_docs)} docs for year {year}.")
+            if not relevant_docs:
+                logging.warning(f"Formatting: No documents found matching year {year} in the provided list.")
+                return "No relevant context found for the specified year."
+            else:
+                docs_to_format = relevant_docs
+        else:
+            docs_to_format = docs
+            logging.debug(f"Formatting: Using all {len(docs_to_format)} documents (no year specified).")
+ 
+        # Sort by source file for consistent output
+        docs_to_format.sort(key=lambda d: d.metadata.get('source_file', ''))
+       
+        formatted_text = ""
+        current_source = None
+        for doc in docs_to_format:
+            source = doc.metadata.get('source_file', 'Unknown Source')
+            if source != current_source:
+                if current_source is not None:
+                    formatted_text += "\n\n"
+                formatted_text += f"--- Source: {source} ---\n"
+                current_source = source
+            formatted_text += doc.page_content + "\n"
+       
+        logging.debug(f"Formatted context length: {len(formatted_text)}")
+        return formatted_text.strip()
+ 
+    base_rag_chain = invoke_rag_with_filtered_retrieval
+   
+    logging.info("RAG chain setup complete.")
+    return base_rag_chain
+
+
+# --- Answer parsing ---
+def parse_answer(ai_response: str) -> tuple:
+    """Splits the model's answer into its "Summary:" and "Risk Level:" sections."""
+    # Make sure the summary section ends before "Risk Level:" or the end of the string.
+    summary_match = re.search(r"Summary:(.*?)(?:Risk Level:|$)", ai_response, re.DOTALL | re.IGNORECASE)
+    # Make sure the risk level section is captured correctly.
+    risk_match = re.search(r"Risk Level:(.*?)(?:Summary:|$)", ai_response, re.DOTALL | re.IGNORECASE)
+
+    if summary_match and NO_INFORMATION not in summary_match.group(1):
+        summary_section = summary_match.group(1).strip()
+    elif NO_INFORMATION in ai_response:
+        summary_section = NO_INFORMATION
+    else:
+        summary_section = "No summary found in the response."
+
+    if risk_match and NO_INFORMATION not in risk_match.group(1):
+        risk_level_section = risk_match.group(1).strip()
+    elif NO_INFORMATION in ai_response:
+        risk_level_section = NO_INFORMATION
+    else:
+        risk_level_section = "No risk level found in the response."
+    return summary_section, risk_level_section
+
+
+# --- Engine ---
+class KYCEngine:
+    """
+    Builds the embeddings model, chat model and vector store on background
+    threads as soon as it is created; callers block only on what they need.
+    The RAG chain is built once per RAGConfig and is safe to call from many
+    threads; a config change (k, prompt version, model) rebuilds it on the
+    next call without restarting the process.
+    """
+
+    def __init__(self, llm_builder=None, embeddings_builder=None, vector_store_builder=None,
+                 use_retrieval_cache: bool = retrieval_cache.KYC_RETRIEVAL_CACHE):
+        """The builders default to Gemini via llm_gateway and the configured PGVector collection."""
+        if vector_store_builder is None and not store_configured():
+            raise KYCEngineError("Database credentials are not fully set in .env. Please check your .env file, "
+                                 "or set KYC_VECTOR_BACKEND=local to use a local vector index.")
+        self._executor = ThreadPoolExecutor(max_workers=3, thread_name_prefix="kyc-warmup")
+        self._embeddings = self._executor.submit(embeddings_builder or _build_gemini_embeddings)
+        self._llm_builder = llm_builder or _build_gemini_llm
+        self._llm_config = load_rag_config()
+        self._llm = self._executor.submit(self._llm_builder, self._llm_config)
+        self._vector_store = self._executor.submit(vector_store_builder or _build_vector_store, self._embeddings)
+        self._chain = None
+        self._chain_config = None
+        self._use_retrieval_cache = use_retrieval_cache
+        self.retrieval_cache = None
+        self.chain_builds = 0
+        self._lock = threading.Lock()
+
+    @property
+    def embeddings(self):
+        return self._embeddings.result()
+
+    @property
+    def llm(self):
+        return self._llm.result()
+
+    @property
+    def vector_store(self):
+        return self._vector_store.result()
+
+    def ready(self) -> bool:
+        """True once the chat model and vector store are built (without blocking)."""
+        return all(f.done() and f.exception() is None for f in (self._llm, self._vector_store))
+
+    @property
+    def config(self) -> RAGConfig:
+        return load_rag_config()
+
+    @property
+    def chain(self):
+        config = load_rag_config()
+        with self._lock:
+            if self._chain is None or config != self._chain_config:
+                llm_key = (config.llm_model, config.temperature)
+                if llm_key != (self._llm_config.llm_model, self._llm_config.temperature):
+                    # Model or temperature changed: rebuild the gateway runnable too
+                    self._llm = self._executor.submit(self._llm_builder, config)
+                    self._llm_config = config
+                if self._use_retrieval_cache and self.retrieval_cache is None:
+                    collection = getattr(self.vector_store, "collection_name", COLLECTION_NAME)
+                    self.retrieval_cache = retrieval_cache.RetrievalCache(
+                        collection, corpus_version_url(self.vector_store))
+                chain = setup_rag_chain(self.vector_store, self.llm, config, self.retrieval_cache)
+                if chain is None:
+                    raise KYCEngineError("Failed to set up the RAG chain. Please check logs.")
+                if self._chain is not None:
+                    logging.info(f"RAG config changed ({self._chain_config} -> {config}); chain rebuilt.")
+                self._chain, self._chain_config = chain, config
+                self.chain_builds += 1
+            return self._chain
+
+    def ask_with_trace(self, query: str) -> tuple:
+        """Answers one query; returns (result dict, tracing.Trace)."""
+        chain = self.chain
+        started = time.perf_counter()
+        with tracing.trace("rag_query", query_chars=len(query)) as query_trace:
+            answer = chain(query)
+        summary, risk_level = parse_answer(answer)
+        # The chain reports failures as text rather than raising, and records them on the trace
+        root = query_trace.root
+        error = root.attributes.get("error") if root is not None and root.status == "error" else None
+        if error is None and answer.startswith("An error occurred"):
+            error = answer
+        result = {
+            "query": query,
+            "year": extract_year_from_query(query),
+            "summary": summary,
+            "risk_level": risk_level,
+            "answer": answer,
+            "status": "error" if error else "ok",
+            "error": error,
+            "latency_ms": round((time.perf_counter() - started) * 1000, 1),
+            "trace_id": query_trace.trace_id,
+        }
+        return result, query_trace
+
+    def ask(self, query: str) -> dict:
+        return self.ask_with_trace(query)[0]
+
+
+_engine = None
+_engine_lock = threading.Lock()
+
+
+def get_engine() -> KYCEngine:
+    """The process-wide engine; the first call starts warming the models up."""
+    global _engine
+    with _engine_lock:
+        if _engine is None:
+            _engine = KYCEngine()
+        return _engine
@@ -0,0 +1,253 @@
+# kyc_service.py
+"""
+Headless access to the KYC risk dossier analyzer.
+
+Batch mode answers a JSONL file of questions concurrently and writes one
+JSONL result per question, in input order (--resume skips ids already in the
+output, so an interrupted overnight run can be restarted; failed ids are
+retried and their new row supersedes the earlier one):
+
+    python kyc_service.py batch questions.jsonl --out answers.jsonl --concurrency 8
+
+Each input line is {"id": ..., "query": "..."} or a bare JSON string.
+
+Serve mode exposes the same engine over a small asyncio HTTP API:
+
+    python kyc_service.py serve --port 8080
+
+    POST /v1/query   {"query": "Summarize the 2021 review"}       -> result object
+    POST /v1/batch   {"queries": ["...", {"id": "a", "query": "..."}]} -> {"results": [...]}
+    GET  /healthz    200 once the models and vector store are loaded, 503 before
+    GET  /metrics    Prometheus text (RAG stage histograms, LLM gateway and retrieval cache counters)
+
+Both modes share one kyc_engine.KYCEngine per process: models are built once
+and every query uses the same PGVector connection pool.
+"""
+import os
+import sys
+import json
+import time
+import signal
+import asyncio
+import logging
+import argparse
+from concurrent.futures import ThreadPoolExecutor
+
+import kyc_engine
+import tracing
+
+KYC_MAX_CONCURRENCY = int(os.getenv("KYC_MAX_CONCURRENCY", "8"))
+KYC_MAX_BODY_BYTES = int(os.getenv("KYC_MAX_BODY_BYTES", str(1 << 20)))
+KYC_MAX_BATCH = int(os.getenv("KYC_MAX_BATCH", "100"))
+
+HTTP_REASONS = {200: "OK", 400: "Bad Request", 404: "Not Found", 405: "Method Not Allowed",
+                413: "Payload Too Large", 500: "Internal Server Error", 503: "Service Unavailable"}
+
+
+def answer(engine: kyc_engine.KYCEngine, item: dict) -> dict:
+    """Answers one {"id", "query"} item; errors become a row instead of an exception."""
+    try:
+        result = engine.ask(item["query"])
+    except Exception as e:
+        logging.error(f"Query {item.get('id')} failed: {e}")
+        result = {"query": item["query"], "status": "error", "answer": None, "error": f"{type(e).__name__}: {e}"}
+    return {"id": item.get("id"), **result}
+
+
+def _normalize(item, default_id) -> dict:
+    if isinstance(item, str):
+        item = {"query": item}
+    if not isinstance(item, dict) or not isinstance(item.get("query"), str) or not item["query"].strip():
+        raise ValueError(f"Expected a question string or an object with a 'query' string, got {item!r}")
+    item.setdefault("id", default_id)
+    return item
+
+
+# --- Batch CLI ---
+def read_queries(path: str) -> list:
+    items = []
+    with open(path, "r", encoding="utf-8") as f:
+        for line_no, line in enumerate(f, 1):
+            if line.strip():
+                items.append(_normalize(json.loads(line), str(line_no)))
+    return items
+
+
+def _done_ids(path: str) -> set:
+    if not os.path.exists(path):
+        return set()
+    done = set()
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            try:
+                row = json.loads(line)
+            except json.JSONDecodeError:
+                continue  # a line cut short by the interrupted run
+            if row.get("status") == "ok":
+                done.add(str(row.get("id")))
+    return done
+
+
+def run_batch(items: list, out_path: str, concurrency: int = KYC_MAX_CONCURRENCY, resume: bool = False) -> dict:
+    engine = kyc_engine.get_engine()
+    if resume:
+        done = _done_ids(out_path)
+        items = [item for item in items if str(item["id"]) not in done]
+        logging.info(f"Resuming: {len(done)} already answered, {len(items)} to go.")
+    counts = {"answered": 0, "errors": 0}
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool, \
+            open(out_path, "a" if resume else "w", encoding="utf-8") as out:
+        # map() yields in input order as results become available, so output streams to disk
+        for i, row in enumerate(pool.map(lambda item: answer(engine, item), items), 1):
+            out.write(json.dumps(row, ensure_ascii=False) + "\n")
+            counts["answered" if row["status"] == "ok" else "errors"] += 1
+            if i % 100 == 0:
+                out.flush()
+                logging.info(f"{i}/{len(items)} queries done ({i / (time.perf_counter() - started):.1f}/s)")
+    counts["seconds"] = round(time.perf_counter() - started, 1)
+    return counts
+
+
+# --- HTTP API ---
+class KYCServer:
+    """Minimal HTTP/1.1 server on asyncio streams; queries run on a bounded thread pool."""
+
+    def __init__(self, engine: kyc_engine.KYCEngine, concurrency: int = KYC_MAX_CONCURRENCY):
+        self.engine = engine
+        self.pool = ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix="kyc-query")
+
+    async def _read_request(self, reader):
+        request_line = await reader.readline()
+        if not request_line:
+            return None
+        method, path, _ = request_line.decode("latin-1").split(" ", 2)
+        headers = {}
+        while True:
+            line = await reader.readline()
+            if line in (b"\r\n", b"\n", b""):
+                break
+            name, _, value = line.decode("latin-1").partition(":")
+            headers[name.strip().lower()] = value.strip()
+        length = int(headers.get("content-length", "0") or 0)
+        if length > KYC_MAX_BODY_BYTES:
+            return method, path, headers, None
+        body = await reader.readexactly(length) if length else b""
+        return method, path, headers, body
+
+    def _write(self, writer, status: int, payload, content_type: str = "application/json", keep_alive: bool = True):
+        body = payload if isinstance(payload, bytes) else json.dumps(payload, ensure_ascii=False).encode("utf-8")
+        head = (f"HTTP/1.1 {status} {HTTP_REASONS.get(status, '')}\r\n"
+                f"Content-Type: {content_type}\r\n"
+                f"Content-Length: {len(body)}\r\n"
+                f"Connection: {'keep-alive' if keep_alive else 'close'}\r\n\r\n")
+        writer.write(head.encode("latin-1") + body)
+
+    async def _ask(self, items: list) -> list:
+        loop = asyncio.get_running_loop()
+        return await asyncio.gather(*(loop.run_in_executor(self.pool, answer, self.engine, item) for item in items))
+
+    async def route(self, method: str, path: str, body: bytes):
+        path = path.split("?", 1)[0]
+        if path == "/healthz":
+            ready = self.engine.ready()
+            return (200 if ready else 503), {"status": "ready" if ready else "loading"}
+        if path == "/metrics":
+            import llm_gateway
+            text = tracing.METRICS.render() + llm_gateway.get_gateway().metrics.render_prometheus()
+            if getattr(self.engine, "retrieval_cache", None) is not None:
+                text += self.engine.retrieval_cache.render_prometheus()
+            return 200, text.encode("utf-8")
+        if path not in ("/v1/query", "/v1/batch"):
+            return 404, {"error": f"No route for {path}"}
+        if method != "POST":
+            return 405, {"error": "Use POST"}
+        try:
+            payload = json.loads(body or b"{}")
+            if path == "/v1/query":
+                return 200, (await self._ask([_normalize(payload, None)]))[0]
+            queries = payload.get("queries") if isinstance(payload, dict) else None
+            if not isinstance(queries, list) or not queries:
+                raise ValueError("Expected {\"queries\": [...]}")
+            if len(queries) > KYC_MAX_BATCH:
+                raise ValueError(f"At most {KYC_MAX_BATCH} queries per batch request")
+            items = [_normalize(q, str(i)) for i, q in enumerate(queries)]
+            return 200, {"results": await self._ask(items)}
+        except (ValueError, AttributeError) as e:
+            return 400, {"error": str(e)}
+
+    async def handle(self, reader, writer):
+        try:
+            while True:
+                try:
+                    request = await self._read_request(reader)
+                except (ValueError, asyncio.IncompleteReadError):
+                    self._write(writer, 400, {"error": "Malformed request"}, keep_alive=False)
+                    break
+                if request is None:
+                    break
+                method, path, headers, body = request
+                keep_alive = headers.get("connection", "keep-alive").lower() != "close"
+                if body is None:
+                    self._write(writer, 413, {"error": f"Body over {KYC_MAX_BODY_BYTES} bytes"}, keep_alive=False)
+                    break
+                try:
+                    status, payload = await self.route(method, path, body)
+                except Exception as e:
+                    logging.error(f"{method} {path} failed: {e}")
+                    status, payload = 500, {"error": f"{type(e).__name__}: {e}"}
+                content_type = "text/plain; version=0.0.4" if isinstance(payload, bytes) else "application/json"
+                self._write(writer, status, payload, content_type, keep_alive)
+                await writer.drain()
+                if not keep_alive:
+                    break
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+
+    async def serve(self, host: str, port: int):
+        server = await asyncio.start_server(self.handle, host, port)
+        logging.info(f"KYC API listening on http://{host}:{port}")
+        stop = asyncio.Event()
+        for sig in (signal.SIGINT, signal.SIGTERM):
+            try:
+                asyncio.get_running_loop().add_signal_handler(sig, stop.set)
+            except NotImplementedError:
+                pass  # Windows
+        async with server:
+            await stop.wait()
+        self.pool.shutdown(wait=True, cancel_futures=True)
+
+
+def main():
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    parser = argparse.ArgumentParser(description="Batch CLI and HTTP API for the KYC risk dossier analyzer.")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    batch = sub.add_parser("batch", help="Answer a JSONL file of questions")
+    batch.add_argument("queries", help="JSONL file: {\"id\", \"query\"} objects or bare strings")
+    batch.add_argument("--out", default="kyc_answers.jsonl", help="JSONL output path")
+    batch.add_argument("--concurrency", type=int, default=KYC_MAX_CONCURRENCY)
+    batch.add_argument("--resume", action="store_true", help="Append to --out, skipping ids already answered")
+
+    serve = sub.add_parser("serve", help="Run the HTTP API")
+    serve.add_argument("--host", default=os.getenv("HOST", "0.0.0.0"))
+    serve.add_argument("--port", type=int, default=int(os.getenv("PORT", "8080")))
+    serve.add_argument("--concurrency", type=int, default=KYC_MAX_CONCURRENCY)
+    args = parser.parse_args()
+
+    try:
+        engine = kyc_engine.get_engine()  # starts loading models right away
+    except kyc_engine.KYCEngineError as e:
+        sys.exit(str(e))
+
+    if args.command == "batch":
+        counts = run_batch(read_queries(args.queries), args.out, args.concurrency, args.resume)
+        print(json.dumps(counts))
+        sys.exit(1 if counts["errors"] else 0)
+    asyncio.run(KYCServer(engine, args.concurrency).serve(args.host, args.port))
+
+
+if __name__ == "__main__":
+    main()
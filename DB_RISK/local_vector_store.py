@@ -0,0 +1,424 @@
+# local_vector_store.py
+"""
+In-process vector store for development, tests and air-gapped review rooms.
+
+Set KYC_VECTOR_BACKEND=local and the app, batch CLI and HTTP API search a
+directory (KYC_LOCAL_INDEX_DIR) instead of Postgres:
+
+    manifest.json     dimensions, row counts, IVF parameters
+    vectors.f32       unit-normalized float32 matrix, memory-mapped
+    centroids.npy     IVF coarse centroids; rows of vectors.f32 are stored
+    list_offsets.npy  grouped by list, so probing a list is one sequential read
+    metadata.sqlite   id, text and metadata per row, with review_year and
+                      client_name columns indexed for filters
+    write.lock        held by whichever process is appending or building
+
+Opening the store reads only the manifest and the (small) centroid arrays,
+so start-up time does not depend on corpus size; pages of the matrix are
+faulted in as they are searched. Filtered searches (year, client) look the
+matching rows up in SQLite and score them exactly when there are at most
+KYC_LOCAL_EXACT_MAX of them; otherwise the IVF lists closest to the query
+are probed. Rows added after the last build (add_documents) are kept in an
+unindexed tail that every search scans.
+
+    python local_vector_store.py export --pg-url postgresql://... --out local_index
+    python local_vector_store.py build --index-dir local_index      # re-cluster after many adds
+"""
+import os
+import json
+import time
+import uuid
+import sqlite3
+import logging
+import argparse
+import threading
+from contextlib import contextmanager
+from typing import NamedTuple
+
+import numpy as np
+
+try:
+    import fcntl
+
+    def _lock_file(f):
+        fcntl.flock(f.fileno(), fcntl.LOCK_EX)
+
+    def _unlock_file(f):
+        fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+except ImportError:  # Windows
+    import msvcrt
+
+    def _lock_file(f):
+        f.seek(0)
+        while True:
+            try:
+                msvcrt.locking(f.fileno(), msvcrt.LK_LOCK, 1)
+                return
+            except OSError:
+                pass  # LK_LOCK gives up after ~10 s; keep waiting
+
+    def _unlock_file(f):
+        f.seek(0)
+        msvcrt.locking(f.fileno(), msvcrt.LK_UNLCK, 1)
+
+KYC_LOCAL_INDEX_DIR = os.getenv("KYC_LOCAL_INDEX_DIR", "local_index")
+KYC_LOCAL_NPROBE = int(os.getenv("KYC_LOCAL_NPROBE", "32"))
+# Filtered searches matching at most this many rows are scored exactly
+KYC_LOCAL_EXACT_MAX = int(os.getenv("KYC_LOCAL_EXACT_MAX", "50000"))
+# Below this many rows the build skips IVF and every search is exact
+IVF_MIN_ROWS = 20000
+SCAN_BLOCK_ROWS = 65536
+# Metadata keys stored as indexed columns; other filter keys go through json_extract
+INDEXED_METADATA = ("review_year", "client_name")
+
+
+def _normalize(matrix: np.ndarray) -> np.ndarray:
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    norms[norms == 0] = 1
+    return matrix / norms
+
+
+def _top_k(scores: np.ndarray, rows: np.ndarray, k: int) -> tuple:
+    if len(scores) > k:
+        keep = np.argpartition(-scores, k)[:k]
+        scores, rows = scores[keep], rows[keep]
+    order = np.argsort(-scores, kind="stable")
+    return scores[order], rows[order]
+
+
+class _Snapshot(NamedTuple):
+    """Everything one search reads, swapped as a unit so a concurrent add or build never mixes versions."""
+    manifest: dict
+    vectors: np.ndarray | None
+    centroids: np.ndarray | None
+    offsets: np.ndarray | None
+
+
+class LocalVectorStore:
+    """Exposes the parts of the LangChain vector store API the RAG chain and ingestion use."""
+
+    def __init__(self, index_dir: str = KYC_LOCAL_INDEX_DIR, embeddings=None, collection_name: str = "local"):
+        self.index_dir = index_dir
+        self.embeddings = embeddings
+        self.collection_name = collection_name
+        self.nprobe = KYC_LOCAL_NPROBE
+        self.exact_max = KYC_LOCAL_EXACT_MAX
+        os.makedirs(index_dir, exist_ok=True)
+        self._local = threading.local()
+        self._write_lock = threading.Lock()
+        self._manifest_mtime = None
+        self._init_metadata()
+        self._load()
+
+    # --- Files ---
+    def _path(self, name: str) -> str:
+        return os.path.join(self.index_dir, name)
+
+    def _connection(self) -> sqlite3.Connection:
+        """One SQLite connection per thread."""
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self._path("metadata.sqlite"))
+            conn.execute("PRAGMA journal_mode=WAL")
+            self._local.conn = conn
+        return conn
+
+    @contextmanager
+    def _index_lock(self):
+        """Serializes writers across threads and processes (e.g. ingest.py next to the app)."""
+        with self._write_lock, open(self._path("write.lock"), "a+b") as lock_file:
+            _lock_file(lock_file)
+            try:
+                # Another process may have written since our last look
+                self._load()
+                yield
+            finally:
+                _unlock_file(lock_file)
+
+    def _init_metadata(self):
+        with self._connection() as conn:
+            conn.execute("CREATE TABLE IF NOT EXISTS chunks (row INTEGER PRIMARY KEY, id TEXT, document TEXT, "
+                         "metadata TEXT, review_year INTEGER, client_name TEXT)")
+            conn.execute("CREATE INDEX IF NOT EXISTS chunks_review_year ON chunks (review_year)")
+            conn.execute("CREATE INDEX IF NOT EXISTS chunks_client_name ON chunks (client_name)")
+
+    def _write_manifest(self, manifest: dict):
+        tmp_path = self._path("manifest.json.tmp")
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(manifest, f, indent=2)
+        os.replace(tmp_path, self._path("manifest.json"))
+
+    def _load(self):
+        """(Re)opens the memory map and IVF arrays; cheap whatever the corpus size."""
+        mtime = None
+        try:
+            with open(self._path("manifest.json"), "r", encoding="utf-8") as f:
+                manifest = json.load(f)
+            mtime = os.stat(self._path("manifest.json")).st_mtime_ns
+        except FileNotFoundError:
+            manifest = {"format": 1, "collection": self.collection_name, "dimensions": None,
+                        "rows": 0, "indexed_rows": 0, "nlist": 0}
+        rows, dimensions = manifest["rows"], manifest["dimensions"]
+        vectors = (np.memmap(self._path("vectors.f32"), dtype=np.float32, mode="r", shape=(rows, dimensions))
+                   if rows else None)
+        if manifest["nlist"]:
+            centroids = np.load(self._path("centroids.npy"), mmap_mode="r")
+            offsets = np.load(self._path("list_offsets.npy"))
+        else:
+            centroids, offsets = None, None
+        self._snapshot = _Snapshot(manifest, vectors, centroids, offsets)
+        self._manifest_mtime = mtime
+
+    @property
+    def manifest(self) -> dict:
+        return self._snapshot.manifest
+
+    def _refresh(self):
+        """Picks up rows written by another process (or another store instance) since the last load."""
+        try:
+            mtime = os.stat(self._path("manifest.json")).st_mtime_ns
+        except OSError:
+            return
+        if mtime != self._manifest_mtime:
+            self._load()
+
+    def __len__(self) -> int:
+        return self.manifest["rows"]
+
+    # --- Writes ---
+    def add_embeddings(self, texts: list, embeddings: list, metadatas: list | None = None,
+                       ids: list | None = None, **kwargs) -> list:
+        """Appends rows to the unindexed tail; run `build` to fold them into the IVF lists."""
+        if not texts:
+            return []
+        matrix = _normalize(np.asarray(embeddings, dtype=np.float32))
+        metadatas = metadatas or [{} for _ in texts]
+        ids = ids or [uuid.uuid4().hex for _ in texts]
+        with self._index_lock():
+            # Searches may hold the current snapshot; edit a copy
+            manifest = dict(self.manifest)
+            if manifest["dimensions"] is None:
+                manifest["dimensions"] = matrix.shape[1]
+            elif matrix.shape[1] != manifest["dimensions"]:
+                raise ValueError(f"Expected {manifest['dimensions']}-dimensional embeddings, got {matrix.shape[1]}.")
+            start = manifest["rows"]
+            # Anything past the manifest's row count was left by a failed or interrupted append
+            offset = start * manifest["dimensions"] * np.dtype(np.float32).itemsize
+            with open(self._path("vectors.f32"), "ab") as f:
+                f.truncate(offset)
+                f.write(matrix.tobytes())
+            try:
+                with self._connection() as conn:
+                    conn.execute("DELETE FROM chunks WHERE row >= ?", (start,))
+                    conn.executemany("INSERT INTO chunks VALUES (?, ?, ?, ?, ?, ?)", [
+                        (start + i, str(doc_id), text, json.dumps(metadata, default=str),
+                         metadata.get("review_year"), metadata.get("client_name"))
+                        for i, (doc_id, text, metadata) in enumerate(zip(ids, texts, metadatas))
+                    ])
+            except Exception:
+                with open(self._path("vectors.f32"), "ab") as f:
+                    f.truncate(offset)
+                raise
+            manifest["rows"] = start + len(texts)
+            self._write_manifest(manifest)
+            self._load()
+        return [str(doc_id) for doc_id in ids]
+
+    def add_texts(self, texts: list, metadatas: list | None = None, ids: list | None = None, **kwargs) -> list:
+        return self.add_embeddings(texts, self.embeddings.embed_documents(list(texts)), metadatas, ids)
+
+    def add_documents(self, documents: list, **kwargs) -> list:
+        return self.add_texts([doc.page_content for doc in documents], [dict(doc.metadata) for doc in documents],
+                              [doc.id for doc in documents] if all(getattr(doc, "id", None) for doc in documents) else None)
+
+    # --- Search ---
+    def _filtered_rows(self, search_filter: dict) -> np.ndarray:
+        clauses, params = [], []
+        for key, value in search_filter.items():
+            if isinstance(value, (dict, list)) or not key.replace("_", "").isalnum():
+                raise ValueError(f"Local vector store supports equality filters only, got {key}={value!r}")
+            clauses.append(f"{key} = ?" if key in INDEXED_METADATA else f"json_extract(metadata, '$.{key}') = ?")
+            params.append(value)
+        rows = self._connection().execute(f"SELECT row FROM chunks WHERE {' AND '.join(clauses)} ORDER BY row",
+                                          params).fetchall()
+        return np.fromiter((r[0] for r in rows), dtype=np.int64, count=len(rows))
+
+    @staticmethod
+    def _scan(vectors: np.ndarray, query: np.ndarray, start: int, end: int, k: int,
+              allowed: np.ndarray | None = None) -> tuple:
+        """Exact top-k over rows [start, end), in blocks, optionally restricted to `allowed` (sorted)."""
+        best_scores, best_rows = np.empty(0, dtype=np.float32), np.empty(0, dtype=np.int64)
+        for block_start in range(start, end, SCAN_BLOCK_ROWS):
+            block_end = min(end, block_start + SCAN_BLOCK_ROWS)
+            rows = np.arange(block_start, block_end)
+            scores = vectors[block_start:block_end] @ query
+            if allowed is not None:
+                mask = np.isin(rows, allowed, assume_unique=True)
+                rows, scores = rows[mask], scores[mask]
+            best_scores, best_rows = _top_k(np.concatenate([best_scores, scores]),
+                                            np.concatenate([best_rows, rows]), k)
+        return best_scores, best_rows
+
+    def _search_rows(self, snapshot: _Snapshot, query: np.ndarray, k: int, search_filter: dict | None) -> np.ndarray:
+        manifest, vectors, centroids, offsets = snapshot
+        rows_total, indexed = manifest["rows"], manifest["indexed_rows"]
+        allowed = None
+        if search_filter:
+            allowed = self._filtered_rows(search_filter)
+            # Rows appended after this snapshot was taken are not in its memory map
+            allowed = allowed[allowed < rows_total]
+            if len(allowed) <= self.exact_max:
+                # Sorted row numbers keep the memory-mapped reads in file order
+                return _top_k(vectors[allowed] @ query, allowed, k)[1] if len(allowed) else allowed
+        if centroids is None:
+            return self._scan(vectors, query, 0, rows_total, k, allowed)[1]
+
+        nprobe = min(self.nprobe, len(centroids))
+        list_order = np.argsort(-(centroids @ query))
+        # The unindexed tail is always scanned
+        scores, rows = self._scan(vectors, query, indexed, rows_total, k, allowed)
+        probed = 0
+        while probed < len(list_order):
+            for list_id in list_order[probed:nprobe]:
+                start, end = int(offsets[list_id]), int(offsets[list_id + 1])
+                if end > start:
+                    list_scores, list_rows = self._scan(vectors, query, start, end, k, allowed)
+                    scores, rows = _top_k(np.concatenate([scores, list_scores]), np.concatenate([rows, list_rows]), k)
+            probed = nprobe
+            if len(rows) >= k:
+                break
+            nprobe *= 2  # a selective filter left too few matches in the probed lists
+        return rows
+
+    def similarity_search_by_vector(self, embedding, k: int = 4, filter: dict | None = None, **kwargs) -> list:
+        from langchain_core.documents import Document
+        self._refresh()
+        snapshot = self._snapshot
+        if not snapshot.manifest["rows"]:
+            return []
+        query = _normalize(np.asarray(embedding, dtype=np.float32)[None, :])[0]
+        rows = [int(row) for row in self._search_rows(snapshot, query, k, filter)]
+        if not rows:
+            return []
+        placeholders = ",".join("?" * len(rows))
+        by_row = {row: (doc_id, document, metadata) for row, doc_id, document, metadata in self._connection().execute(
+            f"SELECT row, id, document, metadata FROM chunks WHERE row IN ({placeholders})", rows)}
+        return [Document(id=by_row[row][0], page_content=by_row[row][1], metadata=json.loads(by_row[row][2]))
+                for row in rows if row in by_row]
+
+    def similarity_search(self, query: str, k: int = 4, filter: dict | None = None, **kwargs) -> list:
+        return self.similarity_search_by_vector(self.embeddings.embed_query(query), k=k, filter=filter)
+
+    # --- IVF build ---
+    def build(self, nlist: int | None = None, iterations: int = 10, sample_rows: int = 50000, seed: int = 0) -> dict:
+        """
+        Clusters all rows (k-means on a sample), then rewrites vectors.f32 and
+        the row numbers in metadata.sqlite grouped by list. Run it while no
+        other process is searching the directory.
+        """
+        with self._index_lock():
+            manifest, vectors = dict(self.manifest), self._snapshot.vectors
+            rows = manifest["rows"]
+            started = time.perf_counter()
+            if not rows or (rows < IVF_MIN_ROWS and not nlist):
+                manifest.update(indexed_rows=rows, nlist=0)
+                self._write_manifest(manifest)
+                self._load()
+                return {"rows": rows, "nlist": 0, "seconds": round(time.perf_counter() - started, 2)}
+            nlist = nlist or int(4 * np.sqrt(rows))
+            rng = np.random.default_rng(seed)
+            sample = np.sort(rng.choice(rows, size=min(rows, sample_rows), replace=False))
+            training = np.asarray(vectors[sample])
+            if nlist > len(training):
+                logging.warning(f"nlist={nlist} exceeds the {len(training)} training rows; using {len(training)}.")
+                nlist = len(training)
+            centroids = training[rng.choice(len(training), size=nlist, replace=False)].copy()
+            for _ in range(iterations):
+                assignment = np.argmax(training @ centroids.T, axis=1)
+                for list_id in range(nlist):
+                    members = training[assignment == list_id]
+                    if len(members):
+                        centroids[list_id] = members.mean(axis=0)
+                centroids = _normalize(centroids)
+
+            assignment = np.concatenate([np.argmax(vectors[s:s + SCAN_BLOCK_ROWS] @ centroids.T, axis=1)
+                                         for s in range(0, rows, SCAN_BLOCK_ROWS)])
+            permutation = np.argsort(assignment, kind="stable")  # new row -> old row
+            offsets = np.concatenate([[0], np.cumsum(np.bincount(assignment, minlength=nlist))])
+
+            tmp_vectors = self._path("vectors.f32.tmp")
+            with open(tmp_vectors, "wb") as f:
+                for s in range(0, rows, SCAN_BLOCK_ROWS):
+                    f.write(np.asarray(vectors[permutation[s:s + SCAN_BLOCK_ROWS]]).tobytes())
+            with self._connection() as conn:
+                conn.execute("CREATE TEMP TABLE renumber (old INTEGER PRIMARY KEY, new INTEGER)")
+                conn.executemany("INSERT INTO renumber VALUES (?, ?)",
+                                 ((int(old), new) for new, old in enumerate(permutation)))
+                # Shift out of the way first so the primary key never collides mid-update
+                conn.execute("UPDATE chunks SET row = -1 - row")
+                conn.execute("UPDATE chunks SET row = (SELECT new FROM renumber WHERE old = -1 - chunks.row)")
+                conn.execute("DROP TABLE renumber")
+            np.save(self._path("centroids.npy"), centroids.astype(np.float32))
+            np.save(self._path("list_offsets.npy"), offsets.astype(np.int64))
+            os.replace(tmp_vectors, self._path("vectors.f32"))
+            manifest.update(indexed_rows=rows, nlist=nlist)
+            self._write_manifest(manifest)
+            self._load()
+        seconds = time.perf_counter() - started
+        logging.info(f"Built IVF index over {rows} rows in {nlist} lists ({seconds:.1f} s).")
+        return {"rows": rows, "nlist": nlist, "seconds": round(seconds, 2)}
+
+
+# --- Snapshot from pgvector ---
+def export_from_pgvector(pg_url: str, collection: str, index_dir: str, batch_rows: int = 5000,
+                         nlist: int | None = None) -> dict:
+    """Streams one PGVector collection into a new local index directory, then builds the IVF lists."""
+    from sqlalchemy import create_engine, text
+    if os.path.exists(os.path.join(index_dir, "manifest.json")):
+        raise RuntimeError(f"{index_dir} already holds an index; export into an empty directory.")
+    store = LocalVectorStore(index_dir, collection_name=collection)
+    started = time.perf_counter()
+    engine = create_engine(pg_url)
+    with engine.connect().execution_options(stream_results=True, yield_per=batch_rows) as conn:
+        result = conn.execute(text(
+            "SELECT e.id, e.document, e.cmetadata, e.embedding::text FROM langchain_pg_embedding e "
+            "JOIN langchain_pg_collection c ON c.uuid = e.collection_id WHERE c.name = :name"), {"name": collection})
+        for batch in result.partitions(batch_rows):
+            store.add_embeddings(texts=[row[1] for row in batch], embeddings=[json.loads(row[3]) for row in batch],
+                                 metadatas=[row[2] or {} for row in batch], ids=[str(row[0]) for row in batch])
+            logging.info(f"Exported {len(store)} rows...")
+    if not len(store):
+        raise RuntimeError(f"Collection '{collection}' is empty or does not exist.")
+    export_seconds = time.perf_counter() - started
+    build = store.build(nlist)
+    return {"collection": collection, "rows": len(store), "dimensions": store.manifest["dimensions"],
+            "export_seconds": round(export_seconds, 1), "build": build}
+
+
+def main():
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    parser = argparse.ArgumentParser(description="Local memory-mapped vector index for the KYC analyzer.")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    export = sub.add_parser("export", help="Snapshot a PGVector collection into a local index")
+    export.add_argument("--pg-url", default=os.getenv("BENCH_PG_URL"))
+    export.add_argument("--collection", default="risk_dossier_corpus")
+    export.add_argument("--out", default=KYC_LOCAL_INDEX_DIR)
+    export.add_argument("--nlist", type=int, help="IVF lists (default 4 * sqrt(rows); none under 20k rows)")
+
+    build = sub.add_parser("build", help="Re-cluster an index, folding in rows added since the last build")
+    build.add_argument("--index-dir", default=KYC_LOCAL_INDEX_DIR)
+    build.add_argument("--nlist", type=int)
+    args = parser.parse_args()
+
+    if args.command == "export":
+        if not args.pg_url:
+            from kyc_engine import PGVECTOR_CONNECTION_STRING
+            args.pg_url = PGVECTOR_CONNECTION_STRING
+        print(json.dumps(export_from_pgvector(args.pg_url, args.collection, args.out, nlist=args.nlist)))
+    else:
+        print(json.dumps(LocalVectorStore(args.index_dir).build(args.nlist)))
+
+
+if __name__ == "__main__":
+    main()
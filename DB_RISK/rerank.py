@@ -0,0 +1,116 @@
+# rerank.py
+"""
+Second-stage reranking for the RAG query path.
+
+With reranking on, the chain fetches a wider candidate set by vector
+similarity (RAGConfig.rerank_candidates) and only the best
+RAGConfig.rerank_top_n chunks go into the prompt:
+
+- "fusion": BM25 over the candidates, fused with the vector ranking by
+  reciprocal rank fusion. Pure numpy, no model; it needs only the candidate
+  order, so it works the same on retrieval cache hits.
+- "cross-encoder": a small local sentence-transformers cross-encoder
+  (KYC_RERANK_MODEL) scoring (query, chunk) pairs in batches on CPU. Falls
+  back to "fusion" when the model cannot be loaded (sentence-transformers
+  not installed, model download failed); the load is not retried.
+"""
+import os
+import re
+import logging
+import threading
+
+import numpy as np
+
+KYC_RERANK_MODEL = os.getenv("KYC_RERANK_MODEL", "cross-encoder/ms-marco-MiniLM-L-6-v2")
+KYC_RERANK_BATCH_SIZE = int(os.getenv("KYC_RERANK_BATCH_SIZE", "32"))
+# Weight of the BM25 ranking against the vector ranking in fusion mode
+KYC_RERANK_BM25_WEIGHT = float(os.getenv("KYC_RERANK_BM25_WEIGHT", "0.5"))
+
+RERANK_METHODS = ("off", "fusion", "cross-encoder")
+RRF_K = 60  # the usual reciprocal rank fusion constant
+BM25_K1 = 1.5
+BM25_B = 0.75
+
+_TOKEN = re.compile(r"\w+")
+_cross_encoder = None
+_cross_encoder_failed = False
+_cross_encoder_lock = threading.Lock()
+
+
+def tokenize(text: str) -> list:
+    return _TOKEN.findall(text.lower())
+
+
+def bm25_scores(query: str, texts: list) -> np.ndarray:
+    """BM25 of `query` against each text, with IDF taken over `texts` themselves."""
+    terms = sorted(set(tokenize(query)))
+    if not terms or not texts:
+        return np.zeros(len(texts), dtype=np.float32)
+    index = {term: i for i, term in enumerate(terms)}
+    tf = np.zeros((len(texts), len(terms)), dtype=np.float32)
+    lengths = np.empty(len(texts), dtype=np.float32)
+    for row, text in enumerate(texts):
+        tokens = tokenize(text)
+        lengths[row] = len(tokens)
+        for token in tokens:
+            column = index.get(token)
+            if column is not None:
+                tf[row, column] += 1
+    df = (tf > 0).sum(axis=0)
+    idf = np.log((len(texts) - df + 0.5) / (df + 0.5) + 1.0)
+    norm = BM25_K1 * (1 - BM25_B + BM25_B * lengths / max(lengths.mean(), 1.0))
+    return ((tf * (BM25_K1 + 1)) / (tf + norm[:, None]) * idf).sum(axis=1)
+
+
+def _ranks(scores: np.ndarray) -> np.ndarray:
+    """0-based rank of each score, highest first."""
+    ranks = np.empty(len(scores), dtype=np.int64)
+    ranks[np.argsort(-scores, kind="stable")] = np.arange(len(scores))
+    return ranks
+
+
+def fusion_order(query: str, docs: list, bm25_weight: float = KYC_RERANK_BM25_WEIGHT) -> np.ndarray:
+    """Candidate indices, best first; `docs` is assumed to be in vector-similarity order."""
+    vector_ranks = np.arange(len(docs))
+    bm25_ranks = _ranks(bm25_scores(query, [doc.page_content for doc in docs]))
+    fused = (1 - bm25_weight) / (RRF_K + vector_ranks + 1) + bm25_weight / (RRF_K + bm25_ranks + 1)
+    return np.argsort(-fused, kind="stable")
+
+
+def _get_cross_encoder():
+    """The shared cross-encoder, or None once loading it has failed."""
+    global _cross_encoder, _cross_encoder_failed
+    with _cross_encoder_lock:
+        if _cross_encoder is None and not _cross_encoder_failed:
+            try:
+                from sentence_transformers import CrossEncoder
+                _cross_encoder = CrossEncoder(KYC_RERANK_MODEL, device="cpu")
+                logging.info(f"Cross-encoder {KYC_RERANK_MODEL} loaded for reranking.")
+            except Exception as e:
+                _cross_encoder_failed = True
+                logging.error(f"Could not load cross-encoder {KYC_RERANK_MODEL} ({type(e).__name__}: {e}); "
+                              f"reranking with BM25 fusion instead.")
+        return _cross_encoder
+
+
+def cross_encoder_order(query: str, docs: list):
+    """Candidate indices, best first, or None if the cross-encoder is unavailable."""
+    model = _get_cross_encoder()
+    if model is None:
+        return None
+    scores = model.predict([(query, doc.page_content) for doc in docs], batch_size=KYC_RERANK_BATCH_SIZE,
+                           show_progress_bar=False)
+    return np.argsort(-np.asarray(scores), kind="stable")
+
+
+def rerank(query: str, docs: list, top_n: int, method: str = "fusion") -> tuple:
+    """Returns (best `top_n` docs, method actually used)."""
+    if len(docs) <= 1:
+        return list(docs), method
+    if method == "cross-encoder":
+        order = cross_encoder_order(query, docs)
+        if order is None:
+            method, order = "fusion", fusion_order(query, docs)
+    else:
+        order = fusion_order(query, docs)
+    return [docs[i] for i in order[:top_n]], method
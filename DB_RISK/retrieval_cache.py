@@ -0,0 +1,251 @@
+# retrieval_cache.py
+"""
+Retrieval cache for the RAG query path.
+
+Near-identical questions with the same year filter retrieve the same chunks,
+so the PGVector search is skipped when a cached result exists:
+
+- the query embedding is hashed into an LSH bucket (random hyperplanes), and
+  a cached entry in that bucket is reused only if its embedding is within
+  KYC_RETRIEVAL_CACHE_MIN_SIMILARITY (cosine) of the new one;
+- an entry stores the top-k chunk ids for (bucket, filter, k), and the
+  documents are hydrated from a local chunk cache;
+- everything is keyed by the collection's corpus version, a counter that
+  ingestion bumps (bump_corpus_version), so new or replaced chunks are never
+  served from a stale entry.
+
+For a PGVector collection the corpus version is a row in the collection's
+own database (kyc_corpus_version), so ingestion from any host, container or
+working directory invalidates every cache; caches re-read it at most every
+KYC_CORPUS_VERSION_CHECK_SECONDS. The local backend keeps it in a JSON file
+(next to this module unless KYC_CORPUS_VERSION_FILE says otherwise), which
+costs one stat() per query.
+"""
+import os
+import json
+import hashlib
+import time
+import logging
+import threading
+from collections import OrderedDict
+
+import numpy as np
+
+KYC_RETRIEVAL_CACHE = os.getenv("KYC_RETRIEVAL_CACHE", "1") not in ("0", "false", "False", "")
+KYC_RETRIEVAL_CACHE_BITS = int(os.getenv("KYC_RETRIEVAL_CACHE_BITS", "12"))
+KYC_RETRIEVAL_CACHE_MIN_SIMILARITY = float(os.getenv("KYC_RETRIEVAL_CACHE_MIN_SIMILARITY", "0.98"))
+KYC_RETRIEVAL_CACHE_SIZE = int(os.getenv("KYC_RETRIEVAL_CACHE_SIZE", "2048"))  # cached searches
+KYC_CHUNK_CACHE_SIZE = int(os.getenv("KYC_CHUNK_CACHE_SIZE", "20000"))  # hydrated documents
+KYC_CORPUS_VERSION_FILE = os.getenv("KYC_CORPUS_VERSION_FILE",
+                                    os.path.join(os.path.dirname(os.path.abspath(__file__)), "corpus_version.json"))
+# How long a cache trusts the database version before reading it again
+KYC_CORPUS_VERSION_CHECK_SECONDS = float(os.getenv("KYC_CORPUS_VERSION_CHECK_SECONDS", "5"))
+VERSION_TABLE = "kyc_corpus_version"
+
+_version_lock = threading.Lock()
+_db_engines = {}  # pg_url -> SQLAlchemy engine
+_db_engines_lock = threading.Lock()
+
+
+# --- Corpus version ---
+def _read_versions() -> dict:
+    try:
+        with open(KYC_CORPUS_VERSION_FILE, "r", encoding="utf-8") as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return {}
+    except (OSError, ValueError) as e:
+        logging.warning(f"Could not read {KYC_CORPUS_VERSION_FILE}: {e}")
+        return {}
+
+
+def _db_engine(pg_url: str):
+    from sqlalchemy import create_engine, text
+    with _db_engines_lock:
+        if pg_url not in _db_engines:
+            engine = create_engine(pg_url, pool_size=1, max_overflow=1, pool_pre_ping=True)
+            with engine.begin() as conn:
+                conn.execute(text(f"CREATE TABLE IF NOT EXISTS {VERSION_TABLE} "
+                                  "(collection TEXT PRIMARY KEY, version BIGINT NOT NULL)"))
+            _db_engines[pg_url] = engine
+        return _db_engines[pg_url]
+
+
+def corpus_version(collection: str, pg_url: str | None = None) -> int:
+    """The collection's version: from its database when pg_url is given, else from the local file."""
+    if pg_url:
+        from sqlalchemy import text
+        with _db_engine(pg_url).connect() as conn:
+            version = conn.execute(text(f"SELECT version FROM {VERSION_TABLE} WHERE collection = :c"),
+                                   {"c": collection}).scalar()
+        return int(version or 0)
+    return int(_read_versions().get(collection, 0))
+
+
+def bump_corpus_version(collection: str, pg_url: str | None = None) -> int:
+    """Called after every write to `collection`; invalidates cached retrievals in all processes."""
+    if pg_url:
+        from sqlalchemy import text
+        with _db_engine(pg_url).begin() as conn:
+            version = conn.execute(text(
+                f"INSERT INTO {VERSION_TABLE} (collection, version) VALUES (:c, 1) "
+                f"ON CONFLICT (collection) DO UPDATE SET version = {VERSION_TABLE}.version + 1 RETURNING version"
+            ), {"c": collection}).scalar()
+        logging.info(f"Corpus version of '{collection}' is now {version}.")
+        return int(version)
+    with _version_lock:
+        versions = _read_versions()
+        versions[collection] = int(versions.get(collection, 0)) + 1
+        tmp_path = f"{KYC_CORPUS_VERSION_FILE}.{os.getpid()}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(versions, f)
+        os.replace(tmp_path, KYC_CORPUS_VERSION_FILE)
+    logging.info(f"Corpus version of '{collection}' is now {versions[collection]}.")
+    return versions[collection]
+
+
+def chunk_id(doc) -> str:
+    """The store's id when it returns one, otherwise a content hash."""
+    doc_id = getattr(doc, "id", None)
+    if doc_id:
+        return str(doc_id)
+    payload = doc.page_content + json.dumps(doc.metadata, sort_keys=True, default=str)
+    return hashlib.sha1(payload.encode("utf-8")).hexdigest()
+
+
+# --- Cache ---
+class RetrievalCache:
+    """
+    Thread-safe LSH-bucketed cache of similarity search results for one
+    collection. pg_url is the collection's database, where its corpus version
+    lives; without it the local version file is used.
+    """
+
+    def __init__(self, collection: str, pg_url: str | None = None, bits: int = KYC_RETRIEVAL_CACHE_BITS,
+                 min_similarity: float = KYC_RETRIEVAL_CACHE_MIN_SIMILARITY,
+                 max_entries: int = KYC_RETRIEVAL_CACHE_SIZE, max_chunks: int = KYC_CHUNK_CACHE_SIZE, seed: int = 0):
+        self.collection = collection
+        self.pg_url = pg_url
+        self.bits = bits
+        self.min_similarity = min_similarity
+        self.max_entries = max_entries
+        self.max_chunks = max_chunks
+        self.seed = seed
+        self._planes = None  # (bits, dimensions), created on the first embedding
+        self._entries = OrderedDict()  # (bucket, filter, k) -> [(unit embedding, [chunk ids])]
+        self._chunks = OrderedDict()   # chunk id -> Document
+        self._entry_count = 0
+        self._version_key = None  # (file mtime or None, version)
+        self._version_checked = 0.0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def _unit(self, embedding) -> np.ndarray:
+        vector = np.asarray(embedding, dtype=np.float32)
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm else vector
+
+    def _bucket(self, unit: np.ndarray) -> int:
+        if self._planes is None or self._planes.shape[1] != unit.shape[0]:
+            self._planes = np.random.default_rng(self.seed).standard_normal((self.bits, unit.shape[0])).astype(np.float32)
+        signs = (self._planes @ unit) > 0
+        return int(signs.dot(1 << np.arange(self.bits, dtype=np.int64)))
+
+    def _check_version(self):
+        """Drops everything when the corpus version changed. Caller holds the lock."""
+        mtime = None
+        if self.pg_url:
+            if self._version_key is not None and time.monotonic() - self._version_checked < KYC_CORPUS_VERSION_CHECK_SECONDS:
+                return
+        else:
+            try:
+                mtime = os.stat(KYC_CORPUS_VERSION_FILE).st_mtime_ns
+            except OSError:
+                pass
+            if self._version_key is not None and self._version_key[0] == mtime:
+                return
+        self._version_checked = time.monotonic()
+        try:
+            version = corpus_version(self.collection, self.pg_url)
+        except Exception as e:
+            # Without a version nothing cached can be trusted
+            logging.warning(f"Could not read the corpus version of '{self.collection}': {e}; retrieval cache cleared.")
+            self._clear()
+            self._version_key = None
+            return
+        if self._version_key is not None and version != self._version_key[1]:
+            logging.info(f"Corpus version of '{self.collection}' changed to {version}; retrieval cache cleared.")
+            self._clear()
+        self._version_key = (mtime, version)
+
+    def _clear(self):
+        self._entries.clear()
+        self._chunks.clear()
+        self._entry_count = 0
+
+    @staticmethod
+    def _filter_key(search_filter) -> str:
+        return json.dumps(search_filter, sort_keys=True, default=str)
+
+    def get(self, embedding, search_filter, k: int, search_mode: str = ""):
+        """
+        Cached documents for a search close enough to this one, or None.
+        search_mode names the search settings (e.g. vector compression) that
+        can change the results; entries are only shared between equal modes.
+        """
+        unit = self._unit(embedding)
+        with self._lock:
+            self._check_version()
+            key = (self._bucket(unit), self._filter_key(search_filter), k, search_mode)
+            for cached_unit, ids in self._entries.get(key, ()):
+                if float(cached_unit @ unit) < self.min_similarity:
+                    continue
+                if not all(chunk in self._chunks for chunk in ids):
+                    break  # some chunks were evicted; search again
+                self._entries.move_to_end(key)
+                for chunk in ids:
+                    self._chunks.move_to_end(chunk)
+                self.hits += 1
+                return [self._chunks[chunk] for chunk in ids]
+            self.misses += 1
+            return None
+
+    def put(self, embedding, search_filter, k: int, docs: list, search_mode: str = ""):
+        unit = self._unit(embedding)
+        with self._lock:
+            self._check_version()
+            ids = []
+            for doc in docs:
+                doc_id = chunk_id(doc)
+                self._chunks[doc_id] = doc
+                self._chunks.move_to_end(doc_id)
+                ids.append(doc_id)
+            while len(self._chunks) > self.max_chunks:
+                self._chunks.popitem(last=False)
+            key = (self._bucket(unit), self._filter_key(search_filter), k, search_mode)
+            # A close-enough entry (e.g. from a concurrent miss) is replaced rather than duplicated
+            bucket = [(u, i) for u, i in self._entries.get(key, ()) if float(u @ unit) < self.min_similarity]
+            self._entry_count += len(bucket) + 1 - len(self._entries.get(key, ()))
+            self._entries[key] = bucket + [(unit, ids)]
+            self._entries.move_to_end(key)
+            while self._entry_count > self.max_entries and self._entries:
+                self._entry_count -= len(self._entries.popitem(last=False)[1])
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {"hits": self.hits, "misses": self.misses,
+                    "hit_ratio": round(self.hits / lookups, 3) if lookups else None,
+                    "entries": self._entry_count, "chunks": len(self._chunks),
+                    "corpus_version": self._version_key[1] if self._version_key else None}
+
+    def render_prometheus(self) -> str:
+        stats = self.stats()
+        label = f'collection="{self.collection}"'
+        return (f"# TYPE kyc_retrieval_cache_hits_total counter\n"
+                f"kyc_retrieval_cache_hits_total{{{label}}} {stats['hits']}\n"
+                f"# TYPE kyc_retrieval_cache_misses_total counter\n"
+                f"kyc_retrieval_cache_misses_total{{{label}}} {stats['misses']}\n"
+                f"# TYPE kyc_retrieval_cache_entries gauge\n"
+                f"kyc_retrieval_cache_entries{{{label}}} {stats['entries']}\n")
@@ -0,0 +1,238 @@
+# tracing.py
+"""
+Lightweight tracing for the RAG query path.
+
+Spans are collected per query trace (via a context variable, so concurrent
+Streamlit sessions do not mix) and can be exported as OTLP/JSON lines to a
+file (readable by the OpenTelemetry collector's otlpjsonfile receiver),
+POSTed to an OTLP/HTTP collector, and aggregated into Prometheus text-format
+histograms per stage.
+"""
+import os
+import json
+import time
+import uuid
+import logging
+import threading
+import contextvars
+import urllib.request
+from contextlib import contextmanager
+from dataclasses import dataclass, field
+from typing import Any, Dict, List, Optional
+
+# Comma-separated: "otlp-file", "otlp-http", "prometheus" (empty disables export). The OTLP file is
+# appended to on every query and never rotated, so it is opt-in; the Prometheus file is rewritten in place.
+TRACE_EXPORTERS = [e.strip() for e in os.getenv("TRACE_EXPORTERS", "prometheus").split(",") if e.strip()]
+TRACE_OTLP_FILE = os.getenv("TRACE_OTLP_FILE", "traces.otlp.jsonl")
+TRACE_OTLP_ENDPOINT = os.getenv("OTEL_EXPORTER_OTLP_ENDPOINT", "http://localhost:4318")
+TRACE_PROM_FILE = os.getenv("TRACE_PROM_FILE", "rag_metrics.prom")
+SERVICE_NAME = os.getenv("OTEL_SERVICE_NAME", "kyc-risk-dossier-analyzer")
+
+# Histogram buckets in seconds, from embedding calls to slow generations
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+
+@dataclass
+class Span:
+    name: str
+    trace_id: str
+    span_id: str
+    parent_id: Optional[str]
+    start_ns: int
+    end_ns: int = 0
+    attributes: Dict[str, Any] = field(default_factory=dict)
+    status: str = "ok"
+
+    @property
+    def duration_ms(self) -> float:
+        return (self.end_ns - self.start_ns) / 1e6
+
+    def set(self, **attributes):
+        self.attributes.update(attributes)
+
+
+@dataclass
+class Trace:
+    name: str
+    trace_id: str = field(default_factory=lambda: uuid.uuid4().hex)
+    spans: List[Span] = field(default_factory=list)
+
+    @property
+    def root(self) -> Optional[Span]:
+        return self.spans[0] if self.spans else None
+
+    def waterfall(self) -> List[dict]:
+        """Spans as rows with start/end offsets (ms) from the root span, in start order."""
+        if not self.spans:
+            return []
+        origin = min(span.start_ns for span in self.spans)
+        depth = {}
+        rows = []
+        for span in sorted(self.spans, key=lambda s: s.start_ns):
+            depth[span.span_id] = depth.get(span.parent_id, -1) + 1
+            rows.append({
+                "span": "  " * depth[span.span_id] + span.name,
+                "start_ms": round((span.start_ns - origin) / 1e6, 2),
+                "end_ms": round((span.end_ns - origin) / 1e6, 2),
+                "duration_ms": round(span.duration_ms, 2),
+                "status": span.status,
+                "attributes": json.dumps(span.attributes, default=str),
+            })
+        return rows
+
+
+_current_trace = contextvars.ContextVar("current_trace", default=None)
+_current_span = contextvars.ContextVar("current_span", default=None)
+
+
+@contextmanager
+def trace(name: str, **attributes):
+    """Starts a new trace with a root span; exports it when the block exits."""
+    new_trace = Trace(name)
+    trace_token = _current_trace.set(new_trace)
+    try:
+        with span(name, **attributes):
+            yield new_trace
+    finally:
+        _current_trace.reset(trace_token)
+        export(new_trace)
+
+
+@contextmanager
+def span(name: str, **attributes):
+    """Times a stage as a child of the current span. A no-op (but still yields a Span) outside a trace."""
+    current_trace = _current_trace.get()
+    parent = _current_span.get()
+    new_span = Span(name, current_trace.trace_id if current_trace else "", uuid.uuid4().hex[:16],
+                    parent.span_id if parent else None, time.time_ns(), attributes=dict(attributes))
+    span_token = _current_span.set(new_span)
+    try:
+        yield new_span
+    except Exception as e:
+        new_span.status = "error"
+        new_span.attributes["error"] = str(e)
+        raise
+    finally:
+        new_span.end_ns = time.time_ns()
+        _current_span.reset(span_token)
+        if current_trace is not None:
+            current_trace.spans.append(new_span)
+            # Root span is appended last; keep it first for readers
+            if new_span.parent_id is None:
+                current_trace.spans.insert(0, current_trace.spans.pop())
+
+
+def record_error(error: str):
+    """Marks the current span as failed for errors that are handled rather than raised."""
+    current = _current_span.get()
+    if current is not None:
+        current.status = "error"
+        current.attributes["error"] = error
+
+
+def estimate_tokens(text: str) -> int:
+    # ~4 characters per token for English prose
+    return max(0, len(text or "") // 4)
+
+
+# --- OTLP/JSON ---
+def _otlp_value(value) -> dict:
+    if isinstance(value, bool):
+        return {"boolValue": value}
+    if isinstance(value, int):
+        return {"intValue": str(value)}
+    if isinstance(value, float):
+        return {"doubleValue": value}
+    return {"stringValue": str(value)}
+
+
+def to_otlp(trace_obj: Trace) -> dict:
+    spans = [{
+        "traceId": trace_obj.trace_id,
+        "spanId": s.span_id,
+        **({"parentSpanId": s.parent_id} if s.parent_id else {}),
+        "name": s.name,
+        "kind": 1,
+        "startTimeUnixNano": str(s.start_ns),
+        "endTimeUnixNano": str(s.end_ns),
+        "attributes": [{"key": k, "value": _otlp_value(v)} for k, v in s.attributes.items()],
+        "status": {"code": 2 if s.status == "error" else 1},
+    } for s in trace_obj.spans]
+    return {"resourceSpans": [{
+        "resource": {"attributes": [{"key": "service.name", "value": {"stringValue": SERVICE_NAME}}]},
+        "scopeSpans": [{"scope": {"name": "db_risk.tracing"}, "spans": spans}],
+    }]}
+
+
+# --- Prometheus ---
+class StageMetrics:
+    """Per-stage latency histograms plus token / document counters, rendered in Prometheus text format."""
+
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = buckets
+        self._lock = threading.Lock()
+        self._histograms = {}  # stage -> [bucket counts..., +Inf count, sum]
+        self._counters = {}    # (metric, stage) -> value
+
+    def observe(self, span_obj: Span):
+        seconds = span_obj.duration_ms / 1000
+        with self._lock:
+            hist = self._histograms.setdefault(span_obj.name, [0] * (len(self.buckets) + 1) + [0.0])
+            for i, bound in enumerate(self.buckets):
+                if seconds <= bound:
+                    hist[i] += 1
+            hist[len(self.buckets)] += 1
+            hist[-1] += seconds
+            for key in ("prompt_tokens", "output_tokens", "docs_retrieved", "context_chars", "prompt_tokens_saved_est"):
+                value = span_obj.attributes.get(key)
+                if isinstance(value, (int, float)):
+                    counter = (f"rag_{key}_total", span_obj.name)
+                    self._counters[counter] = self._counters.get(counter, 0) + value
+
+    def render(self) -> str:
+        lines = ["# HELP rag_stage_duration_seconds Duration of each RAG query stage.",
+                 "# TYPE rag_stage_duration_seconds histogram"]
+        with self._lock:
+            for stage, hist in sorted(self._histograms.items()):
+                for bound, count in zip(self.buckets, hist):
+                    lines.append(f'rag_stage_duration_seconds_bucket{{stage="{stage}",le="{bound}"}} {count}')
+                lines.append(f'rag_stage_duration_seconds_bucket{{stage="{stage}",le="+Inf"}} {hist[len(self.buckets)]}')
+                lines.append(f'rag_stage_duration_seconds_sum{{stage="{stage}"}} {hist[-1]:.6f}')
+                lines.append(f'rag_stage_duration_seconds_count{{stage="{stage}"}} {hist[len(self.buckets)]}')
+            for metric in sorted({m for m, _ in self._counters}):
+                lines.append(f"# TYPE {metric} counter")
+                for (name, stage), value in sorted(self._counters.items()):
+                    if name == metric:
+                        lines.append(f'{metric}{{stage="{stage}"}} {value}')
+        return "\n".join(lines) + "\n"
+
+
+METRICS = StageMetrics()
+_file_lock = threading.Lock()
+
+
+def export(trace_obj: Trace):
+    """Sends a finished trace to the configured exporters; export failures are logged, never raised."""
+    for span_obj in trace_obj.spans:
+        METRICS.observe(span_obj)
+    for exporter in TRACE_EXPORTERS:
+        try:
+            if exporter == "otlp-file":
+                with _file_lock, open(TRACE_OTLP_FILE, "a", encoding="utf-8") as f:
+                    f.write(json.dumps(to_otlp(trace_obj)) + "\n")
+            elif exporter == "otlp-http":
+                request = urllib.request.Request(f"{TRACE_OTLP_ENDPOINT.rstrip('/')}/v1/traces",
+                                                 data=json.dumps(to_otlp(trace_obj)).encode("utf-8"),
+                                                 headers={"Content-Type": "application/json"})
+                urllib.request.urlopen(request, timeout=2).close()
+            elif exporter == "prometheus":
+                # Written atomically for the node_exporter textfile collector
+                tmp_path = f"{TRACE_PROM_FILE}.tmp"
+                with _file_lock:
+                    with open(tmp_path, "w", encoding="utf-8") as f:
+                        f.write(METRICS.render())
+                    os.replace(tmp_path, TRACE_PROM_FILE)
+            else:
+                logging.warning(f"Unknown trace exporter '{exporter}'.")
+        except Exception as e:
+            logging.warning(f"Trace export via {exporter} failed: {e}")
@@ -0,0 +1,382 @@
+# vector_compression.py
+"""
+Compressed vector search for the risk dossier collection.
+
+PGVector stores every chunk embedding at full float32 precision in
+langchain_pg_embedding. With pgvector >= 0.7 the search can instead walk an
+HNSW index over a compressed expression of that column and rescore the
+candidates at full precision:
+
+- "halfvec": embedding::halfvec(d), half the index size of a float32 index;
+- "binary":  binary_quantize(embedding)::bit(d), 1 bit per dimension, searched
+  by Hamming distance.
+
+The full-precision column is kept (ingestion and the LangChain store are
+unchanged); only the indexes differ, and the expression indexes are
+maintained by Postgres on every insert.
+
+    python vector_compression.py migrate --mode halfvec            # build the index (CONCURRENTLY)
+    python vector_compression.py migrate --mode binary --drop      # remove it again
+    python vector_compression.py report --queries 200 --out compression.json
+
+Then set KYC_VECTOR_COMPRESSION=halfvec (or binary) for the app, batch CLI
+and HTTP API; KYC_RESCORE_FACTOR sets how many candidates per result are
+rescored at full precision.
+
+Metadata filters (e.g. the review year) are applied to the rows the HNSW
+walk returns, so a selective filter can leave fewer than k. On pgvector
+>= 0.8 filtered searches turn on hnsw.iterative_scan, which keeps walking
+until enough rows pass; on older versions, or if the walk still comes up
+short, the search falls back to the store's full-precision search.
+"""
+import os
+import re
+import sys
+import json
+import time
+import logging
+import argparse
+
+EMBEDDING_TABLE = "langchain_pg_embedding"
+COLLECTION_TABLE = "langchain_pg_collection"
+COMPRESSION_MODES = ("off", "halfvec", "binary")
+DEFAULT_DIMENSIONS = 768  # models/embedding-001
+# HNSW candidate list size; raised to the number of candidates when that is larger
+KYC_HNSW_EF_SEARCH = int(os.getenv("KYC_HNSW_EF_SEARCH", "100"))
+HNSW_MAX_EF_SEARCH = 1000
+
+# Indexed expression and its ORDER BY distance, per mode; {d} is the embedding dimension
+INDEX_SPECS = {
+    "full": ("(embedding::vector({d}))", "vector_cosine_ops", "embedding::vector({d}) <=> CAST(:query AS vector({d}))"),
+    "halfvec": ("(embedding::halfvec({d}))", "halfvec_cosine_ops",
+                "embedding::halfvec({d}) <=> CAST(:query AS halfvec({d}))"),
+    "binary": ("(binary_quantize(embedding)::bit({d}))", "bit_hamming_ops",
+               "binary_quantize(embedding)::bit({d}) <~> binary_quantize(CAST(:query AS vector({d})))"),
+}
+
+_METADATA_KEY = re.compile(r"^\w+$")
+_iterative_scan_support = {}  # database URL -> pgvector >= 0.8
+
+
+def index_name(mode: str) -> str:
+    return f"{EMBEDDING_TABLE}_{mode}_hnsw"
+
+
+def _vector_literal(embedding) -> str:
+    return "[" + ",".join(repr(float(x)) for x in embedding) + "]"
+
+
+def _filter_sql(search_filter: dict | None) -> tuple:
+    """Equality filters on cmetadata as SQL; None when the filter uses operators this path does not handle."""
+    clauses, params = [], {}
+    for i, (key, value) in enumerate((search_filter or {}).items()):
+        if not _METADATA_KEY.match(key) or isinstance(value, (dict, list)) or value is None:
+            return None
+        clauses.append(f"AND cmetadata->>'{key}' = :filter_{i}")
+        params[f"filter_{i}"] = value if isinstance(value, str) else json.dumps(value)
+    return " ".join(clauses), params
+
+
+def search_sql(mode: str, dimensions: int, filter_sql: str = "") -> str:
+    """Candidates by the compressed distance (index scan), then exact cosine rescoring of those candidates."""
+    _, _, distance = INDEX_SPECS[mode]
+    return f"""
+        WITH candidates AS (
+            SELECT id, document, cmetadata, embedding
+            FROM {EMBEDDING_TABLE}
+            WHERE collection_id = :collection_id {filter_sql}
+            ORDER BY {distance.format(d=dimensions)}
+            LIMIT :candidates
+        )
+        SELECT id, document, cmetadata, embedding <=> CAST(:query AS vector({dimensions})) AS distance
+        FROM candidates
+        ORDER BY distance
+        LIMIT :k
+    """
+
+
+def _set_ef_search(session_or_conn, candidates: int, iterative_scan: bool = False):
+    from sqlalchemy import text
+    ef_search = min(HNSW_MAX_EF_SEARCH, max(KYC_HNSW_EF_SEARCH, candidates))
+    session_or_conn.execute(text(f"SET LOCAL hnsw.ef_search = {int(ef_search)}"))
+    if iterative_scan:
+        # Candidates are rescored afterwards, so the walk need not return them in strict order
+        session_or_conn.execute(text("SET LOCAL hnsw.iterative_scan = relaxed_order"))
+
+
+def _supports_iterative_scan(session_or_conn) -> bool:
+    url = str(session_or_conn.get_bind().url if hasattr(session_or_conn, "get_bind") else session_or_conn.engine.url)
+    if url not in _iterative_scan_support:
+        try:
+            _iterative_scan_support[url] = pgvector_version(session_or_conn) >= (0, 8, 0)
+        except RuntimeError as e:
+            logging.warning(f"Could not read the pgvector version ({e}); filtered searches may return fewer than k.")
+            _iterative_scan_support[url] = False
+    return _iterative_scan_support[url]
+
+
+def similarity_search(vector_store, embedding, k: int, search_filter: dict | None = None,
+                      mode: str = "off", rescore_factor: int = 4) -> list:
+    """
+    Drop-in for vector_store.similarity_search_by_vector that searches the
+    compressed index for `mode` and rescores k * rescore_factor candidates.
+    "off", a filter with operators, or a store that is not PGVector (the
+    local backend) uses the store's own search, as does a filtered search
+    that comes back with fewer than k rows.
+    """
+    if not hasattr(vector_store, "session_maker"):
+        return vector_store.similarity_search_by_vector(embedding, k=k, filter=search_filter)
+    parsed_filter = _filter_sql(search_filter) if mode != "off" else None
+    if parsed_filter is None:
+        if mode != "off":
+            logging.warning(f"Filter {search_filter} not supported by compressed search; using full precision.")
+        return vector_store.similarity_search_by_vector(embedding, k=k, filter=search_filter)
+    from sqlalchemy import text
+    from langchain_core.documents import Document
+
+    filter_sql, params = parsed_filter
+    candidates = max(k, k * rescore_factor)
+    with vector_store.session_maker() as session:
+        collection = vector_store.get_collection(session)
+        if collection is None:
+            logging.warning("Collection not found; nothing to search.")
+            return []
+        _set_ef_search(session, candidates, iterative_scan=bool(filter_sql) and _supports_iterative_scan(session))
+        rows = session.execute(text(search_sql(mode, len(embedding), filter_sql)), {
+            "collection_id": collection.uuid, "query": _vector_literal(embedding),
+            "candidates": candidates, "k": k, **params,
+        }).fetchall()
+    if filter_sql and len(rows) < k:
+        # Either fewer than k rows match, or the walk ran out before finding them; the full search knows which
+        logging.info(f"Compressed search with filter {search_filter} returned {len(rows)} of {k}; "
+                     "using full precision.")
+        return vector_store.similarity_search_by_vector(embedding, k=k, filter=search_filter)
+    return [Document(id=str(row.id), page_content=row.document, metadata=row.cmetadata or {}) for row in rows]
+
+
+# --- Migration ---
+def pgvector_version(conn) -> tuple:
+    from sqlalchemy import text
+    version = conn.execute(text("SELECT extversion FROM pg_extension WHERE extname = 'vector'")).scalar()
+    if version is None:
+        raise RuntimeError("The pgvector extension is not installed in this database.")
+    return tuple(int(part) for part in re.findall(r"\d+", version)[:3])
+
+
+def migrate(engine, mode: str, dimensions: int, drop: bool = False, maintenance_work_mem: str = "1GB") -> dict:
+    """Creates (or drops) the HNSW index for `mode` without blocking writes; returns build time and size."""
+    from sqlalchemy import text
+    name = index_name(mode)
+    with engine.connect().execution_options(isolation_level="AUTOCOMMIT") as conn:
+        if drop:
+            conn.execute(text(f"DROP INDEX CONCURRENTLY IF EXISTS {name}"))
+            logging.info(f"Dropped index {name}.")
+            return {"index": name, "dropped": True}
+        if mode != "full" and pgvector_version(conn) < (0, 7, 0):
+            raise RuntimeError(f"{mode} indexes need pgvector >= 0.7.0.")
+        expression, opclass, _ = INDEX_SPECS[mode]
+        if not re.match(r"^\d+\s*[kMG]?B$", maintenance_work_mem):
+            raise ValueError(f"Invalid maintenance_work_mem: {maintenance_work_mem}")
+        conn.execute(text(f"SET maintenance_work_mem = '{maintenance_work_mem}'"))
+        logging.info(f"Building {name} on {EMBEDDING_TABLE}; this scans every stored embedding...")
+        started = time.perf_counter()
+        conn.execute(text(f"CREATE INDEX CONCURRENTLY IF NOT EXISTS {name} ON {EMBEDDING_TABLE} "
+                          f"USING hnsw ({expression.format(d=dimensions)} {opclass})"))
+        build_seconds = time.perf_counter() - started
+        size = conn.execute(text("SELECT pg_relation_size(CAST(:name AS regclass))"), {"name": name}).scalar()
+    logging.info(f"Index {name} built in {build_seconds:.1f} s ({size / 2**20:.1f} MiB).")
+    return {"index": name, "build_seconds": round(build_seconds, 1), "size_mb": round(size / 2**20, 1)}
+
+
+# --- Recall / latency report ---
+def storage_report(conn) -> dict:
+    from sqlalchemy import text
+    table = conn.execute(text(f"SELECT pg_relation_size('{EMBEDDING_TABLE}'), "
+                              f"pg_total_relation_size('{EMBEDDING_TABLE}')")).one()
+    indexes = conn.execute(text("SELECT indexrelname, pg_relation_size(indexrelid) FROM pg_stat_user_indexes "
+                                "WHERE relname = :table ORDER BY 1"), {"table": EMBEDDING_TABLE}).fetchall()
+    return {"table_mb": round(table[0] / 2**20, 1), "total_mb": round(table[1] / 2**20, 1),
+            "indexes_mb": {name: round(size / 2**20, 1) for name, size in indexes}}
+
+
+def _sample_queries(conn, collection_id, count: int, noise: float, seed: int) -> list:
+    """
+    (query, review_year) pairs: stored embeddings plus a little noise, so
+    queries land near, not on, existing chunks, and the year of the sampled
+    chunk for the filtered runs (None when it has no year).
+    """
+    import numpy as np
+    from sqlalchemy import text
+    conn.execute(text("SELECT setseed(:seed)"), {"seed": (seed % 1000) / 1000})
+    rows = conn.execute(text(f"SELECT embedding::text, cmetadata->>'review_year' FROM {EMBEDDING_TABLE} "
+                             "WHERE collection_id = :c ORDER BY random() LIMIT :n"),
+                        {"c": collection_id, "n": count}).fetchall()
+    rng = np.random.default_rng(seed)
+    queries = []
+    for vector_text, year in rows:
+        vector = np.asarray(json.loads(vector_text), dtype=np.float32)
+        vector += rng.normal(0, noise * (np.abs(vector).mean() or 1), vector.shape).astype(np.float32)
+        queries.append((vector.tolist(), year))
+    return queries
+
+
+def _timed_ids(conn, sql: str, params: dict, candidates: int, exact: bool = False,
+               iterative_scan: bool = False) -> tuple:
+    from sqlalchemy import text
+    with conn.begin():
+        if exact:
+            # Ground truth: a sequential scan, whatever indexes exist
+            conn.execute(text("SET LOCAL enable_indexscan = off"))
+            conn.execute(text("SET LOCAL enable_bitmapscan = off"))
+        else:
+            _set_ef_search(conn, candidates, iterative_scan)
+        started = time.perf_counter()
+        ids = [row.id for row in conn.execute(text(sql), params)]
+        return ids, (time.perf_counter() - started) * 1000
+
+
+def run_report(engine, collection: str, queries: int, k: int, rescore_factor: int, noise: float, seed: int) -> dict:
+    """
+    Recall@k against an exact scan, and latency, for full precision and each
+    compressed mode; unfiltered and filtered on the sampled chunk's review
+    year (the app's year filter), with the search settings the app uses.
+    """
+    from sqlalchemy import text
+    with engine.connect() as conn:
+        collection_id = conn.execute(text(f"SELECT uuid FROM {COLLECTION_TABLE} WHERE name = :name"),
+                                     {"name": collection}).scalar()
+        if collection_id is None:
+            raise RuntimeError(f"Collection '{collection}' not found.")
+        conn.commit()
+        samples = _sample_queries(conn, collection_id, queries, noise, seed)
+        conn.commit()
+        if not samples:
+            raise RuntimeError(f"Collection '{collection}' has no embeddings.")
+        dimensions = len(samples[0][0])
+        iterative_scan = _supports_iterative_scan(conn)
+        conn.commit()
+        existing = {row[0] for row in conn.execute(text(
+            "SELECT indexname FROM pg_indexes WHERE tablename = :table"), {"table": EMBEDDING_TABLE})}
+        conn.commit()
+        candidates = k * rescore_factor
+        year_filter = "AND cmetadata->>'review_year' = :filter_0"
+
+        def exact_sql(filter_sql=""):
+            return f"""
+                SELECT id FROM {EMBEDDING_TABLE} WHERE collection_id = :collection_id {filter_sql}
+                ORDER BY embedding <=> CAST(:query AS vector({dimensions})) LIMIT :k
+            """
+
+        def mode_sql(mode, filter_sql=""):
+            if mode != "full":
+                return search_sql(mode, dimensions, filter_sql)
+            # "full" is float32 through its own HNSW index (if migrated), without rescoring
+            return f"""
+                SELECT id FROM {EMBEDDING_TABLE} WHERE collection_id = :collection_id {filter_sql}
+                ORDER BY {INDEX_SPECS["full"][2].format(d=dimensions)} LIMIT :k
+            """
+
+        modes = ("full", "halfvec", "binary")
+        latencies = {mode: [] for mode in ["exact", *modes]}
+        recalls = {mode: [] for mode in modes}
+        # Filtered: recall of the index walk alone, and how often it returned fewer than the matching rows
+        filtered_recalls = {mode: [] for mode in modes}
+        filtered_short = {mode: 0 for mode in modes}
+        for query, year in samples:
+            params = {"collection_id": collection_id, "query": _vector_literal(query), "k": k, "candidates": candidates}
+            truth, elapsed = _timed_ids(conn, exact_sql(), params, candidates, exact=True)
+            latencies["exact"].append(elapsed)
+            for mode in modes:
+                ids, elapsed = _timed_ids(conn, mode_sql(mode), params, candidates)
+                latencies[mode].append(elapsed)
+                recalls[mode].append(len(set(ids) & set(truth)) / max(len(truth), 1))
+            if year is None:
+                continue
+            params["filter_0"] = year
+            truth, _ = _timed_ids(conn, exact_sql(year_filter), params, candidates, exact=True)
+            for mode in modes:
+                ids, _ = _timed_ids(conn, mode_sql(mode, year_filter), params, candidates, iterative_scan=iterative_scan)
+                filtered_recalls[mode].append(len(set(ids) & set(truth)) / max(len(truth), 1))
+                filtered_short[mode] += len(ids) < len(truth)
+        storage = storage_report(conn)
+
+    def pct(values, q):
+        ordered = sorted(values)
+        return round(ordered[min(len(ordered) - 1, int(q * len(ordered)))], 2)
+
+    results = {}
+    for mode, values in latencies.items():
+        name = index_name(mode)
+        filtered = filtered_recalls.get(mode)
+        results[mode] = {
+            "recall_at_k": round(sum(recalls[mode]) / len(recalls[mode]), 4) if mode in recalls else 1.0,
+            "filtered_recall_at_k": (round(sum(filtered) / len(filtered), 4) if filtered
+                                     else (1.0 if mode == "exact" else None)),
+            "filtered_short_queries": filtered_short.get(mode, 0),
+            "p50_ms": pct(values, 0.5), "p95_ms": pct(values, 0.95),
+            # Without its index a mode is a sequential scan; the numbers say so
+            "index": name if name in existing else None,
+            "index_mb": storage["indexes_mb"].get(name),
+        }
+    return {"collection": collection, "queries": len(samples), "k": k, "rescore_factor": rescore_factor,
+            "dimensions": dimensions, "filtered_queries": sum(year is not None for _, year in samples),
+            "iterative_scan": iterative_scan, "modes": results, "storage": storage}
+
+
+def print_report(report: dict):
+    print(f"\nCollection {report['collection']}: {report['queries']} queries, k={report['k']}, "
+          f"rescoring {report['k'] * report['rescore_factor']} candidates, {report['dimensions']} dimensions")
+    print(f"Filtered by review year: {report['filtered_queries']} queries, "
+          f"iterative scan {'on' if report['iterative_scan'] else 'unavailable (pgvector < 0.8)'}")
+    print(f"{'mode':<10} {'recall@k':>9} {'filtered':>9} {'short':>6} {'p50 ms':>9} {'p95 ms':>9} {'index MB':>9}  index")
+    for mode, r in report["modes"].items():
+        filtered = r["filtered_recall_at_k"] if r["filtered_recall_at_k"] is not None else "-"
+        print(f"{mode:<10} {r['recall_at_k']:>9} {filtered:>9} {r['filtered_short_queries']:>6} "
+              f"{r['p50_ms']:>9} {r['p95_ms']:>9} "
+              f"{r['index_mb'] if r['index_mb'] is not None else '-':>9}  {r['index'] or '(sequential scan)'}")
+    storage = report["storage"]
+    print(f"\n{EMBEDDING_TABLE}: {storage['table_mb']} MB heap, {storage['total_mb']} MB with indexes and TOAST")
+
+
+def main():
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    from kyc_engine import PGVECTOR_CONNECTION_STRING, COLLECTION_NAME
+
+    parser = argparse.ArgumentParser(description="Compressed (halfvec / binary) vector indexes for PGVector.")
+    parser.add_argument("--pg-url", default=os.getenv("BENCH_PG_URL") or PGVECTOR_CONNECTION_STRING)
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    migrate_cmd = sub.add_parser("migrate", help="Build (or --drop) the HNSW index for a mode")
+    migrate_cmd.add_argument("--mode", choices=list(INDEX_SPECS), required=True)
+    migrate_cmd.add_argument("--dimensions", type=int, default=DEFAULT_DIMENSIONS)
+    migrate_cmd.add_argument("--drop", action="store_true")
+    migrate_cmd.add_argument("--maintenance-work-mem", default="1GB")
+
+    report_cmd = sub.add_parser("report", help="Recall@k and latency of each mode against an exact scan")
+    report_cmd.add_argument("--collection", default=COLLECTION_NAME)
+    report_cmd.add_argument("--queries", type=int, default=100)
+    report_cmd.add_argument("--k", type=int, default=30)
+    report_cmd.add_argument("--rescore-factor", type=int, default=int(os.getenv("KYC_RESCORE_FACTOR", "4")))
+    report_cmd.add_argument("--noise", type=float, default=0.05, help="Relative noise added to sampled embeddings")
+    report_cmd.add_argument("--seed", type=int, default=0)
+    report_cmd.add_argument("--out", help="Also write the report as JSON")
+    args = parser.parse_args()
+
+    from sqlalchemy import create_engine
+    engine = create_engine(args.pg_url)
+    try:
+        if args.command == "migrate":
+            print(json.dumps(migrate(engine, args.mode, args.dimensions, args.drop, args.maintenance_work_mem)))
+            return
+        report = run_report(engine, args.collection, args.queries, args.k, args.rescore_factor, args.noise, args.seed)
+    except RuntimeError as e:
+        sys.exit(str(e))
+    print_report(report)
+    if args.out:
+        with open(args.out, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+        print(f"Report written to {args.out}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,610 @@
+"""
+Shared gateway for LLM calls made by the apps in this repository.
+
+Every generate/stream call goes through one process-wide Gateway, which adds:
+
+* a global concurrency limit (LLM_MAX_CONCURRENCY in-flight calls),
+* per-model token buckets for requests and tokens per minute (LLM_MODEL_QUOTAS),
+* retries with exponential backoff and jitter for transient errors,
+* hedging: a duplicate request is sent when the first one is slower than the
+  model's recent p95 (or LLM_HEDGE_AFTER_SECONDS), and the first answer wins,
+* per-call latency/token metrics (listeners, Prometheus text, optional JSONL file).
+
+Backends: "gemini" (google.generativeai) and "stub" (offline, deterministic,
+with injectable latency and failures), selected with LLM_BACKEND.
+
+The apps import this file from the repository root:
+
+    sys.path.append(<repo root>)
+    import llm_gateway
+    response = llm_gateway.get_gateway().generate(prompt, model="gemini-2.5-flash",
+                                                  config={"temperature": 0.3})
+"""
+import os
+import re
+import json
+import time
+import random
+import hashlib
+import logging
+import threading
+from collections import deque
+from dataclasses import dataclass, asdict
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED, TimeoutError as FutureTimeout
+from typing import Callable, Dict, Iterator, Optional, Tuple
+
+LLM_BACKEND = os.getenv("LLM_BACKEND", "gemini").lower()
+LLM_MAX_CONCURRENCY = int(os.getenv("LLM_MAX_CONCURRENCY", "8"))
+LLM_TIMEOUT_SECONDS = float(os.getenv("LLM_TIMEOUT_SECONDS", "60"))
+LLM_MAX_RETRIES = int(os.getenv("LLM_MAX_RETRIES", "3"))
+LLM_BACKOFF_SECONDS = float(os.getenv("LLM_BACKOFF_SECONDS", "0.5"))
+LLM_BACKOFF_MAX_SECONDS = float(os.getenv("LLM_BACKOFF_MAX_SECONDS", "8"))
+# "auto": hedge after the model's recent p95 latency; a number of seconds; or "off"
+LLM_HEDGE_AFTER_SECONDS = os.getenv("LLM_HEDGE_AFTER_SECONDS", "auto").lower()
+# "model=rpm/tpm" pairs, e.g. "gemini-2.5-flash=1000/1000000,gemini-1.5-pro=60/250000" (0 = unlimited);
+# models without an entry use the defaults below
+LLM_MODEL_QUOTAS = os.getenv("LLM_MODEL_QUOTAS", "")
+LLM_DEFAULT_RPM = float(os.getenv("LLM_DEFAULT_RPM", "0"))
+LLM_DEFAULT_TPM = float(os.getenv("LLM_DEFAULT_TPM", "0"))
+# Appends one JSON line per call when set
+LLM_METRICS_FILE = os.getenv("LLM_METRICS_FILE", "")
+
+# Stub backend knobs
+LLM_STUB_LATENCY_SECONDS = float(os.getenv("LLM_STUB_LATENCY_SECONDS", "0.05"))
+LLM_STUB_FAILURE_RATE = float(os.getenv("LLM_STUB_FAILURE_RATE", "0"))
+LLM_STUB_SLOW_RATE = float(os.getenv("LLM_STUB_SLOW_RATE", "0"))
+
+# Samples needed before "auto" hedging kicks in, and how many recent latencies to keep
+HEDGE_MIN_SAMPLES = 20
+LATENCY_WINDOW = 200
+
+_RETRYABLE_ERRORS = {"ResourceExhausted", "TooManyRequests", "ServiceUnavailable", "InternalServerError",
+                     "DeadlineExceeded", "Aborted", "GatewayTimeout", "TimeoutError", "ConnectionError"}
+_RETRYABLE_STATUSES = {429, 500, 502, 503, 504}
+# Status-prefixed messages ("503 Service Unavailable"); a status code elsewhere in the text is not enough
+_RETRYABLE_STATUS_RE = re.compile(r"^\s*(?:HTTP\s*)?(429|500|502|503|504)\b")
+
+
+class LLMGatewayError(Exception):
+    def __init__(self, message: str, retryable: bool = False):
+        super().__init__(message)
+        self.retryable = retryable
+
+
+def is_retryable(error: Exception) -> bool:
+    if isinstance(error, LLMGatewayError):
+        return error.retryable
+    if any(cls.__name__ in _RETRYABLE_ERRORS for cls in type(error).__mro__):
+        return True
+    # google.api_core errors carry .code, HTTP client errors .status_code or .response.status_code
+    for status in (getattr(error, "code", None), getattr(error, "status_code", None),
+                   getattr(getattr(error, "response", None), "status_code", None)):
+        if isinstance(status, int):
+            return status in _RETRYABLE_STATUSES
+    return bool(_RETRYABLE_STATUS_RE.match(str(error)))
+
+
+def estimate_tokens(text: str) -> int:
+    # ~4 characters per token for English prose
+    return max(1, len(text or "") // 4)
+
+
+# --- Quotas ---
+class TokenBucket:
+    """Refills at `per_minute / 60` units per second up to one minute's worth. per_minute <= 0 means unlimited."""
+
+    def __init__(self, per_minute: float):
+        self.rate = per_minute / 60.0
+        self.capacity = per_minute
+        self.level = per_minute
+        self.updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _take(self, cost: float) -> float:
+        """Takes `cost` and returns 0, or returns the seconds to wait before it would be available."""
+        if self.rate <= 0:
+            return 0.0
+        cost = min(cost, self.capacity)
+        with self._lock:
+            now = time.monotonic()
+            self.level = min(self.capacity, self.level + (now - self.updated) * self.rate)
+            self.updated = now
+            if self.level >= cost:
+                self.level -= cost
+                return 0.0
+            return (cost - self.level) / self.rate
+
+    def try_acquire(self, cost: float = 1.0) -> bool:
+        return self._take(cost) == 0.0
+
+    def refund(self, cost: float = 1.0):
+        """Returns units taken for a call that did not go ahead."""
+        if self.rate <= 0:
+            return
+        with self._lock:
+            self.level = min(self.capacity, self.level + min(cost, self.capacity))
+
+    def acquire(self, cost: float = 1.0, deadline: Optional[float] = None) -> bool:
+        while True:
+            wait_seconds = self._take(cost)
+            if wait_seconds == 0.0:
+                return True
+            if deadline is not None and time.monotonic() + wait_seconds > deadline:
+                return False
+            time.sleep(wait_seconds)
+
+
+class ModelQuota:
+    def __init__(self, rpm: float, tpm: float):
+        self.requests = TokenBucket(rpm)
+        self.tokens = TokenBucket(tpm)
+
+    def acquire(self, tokens: int, deadline: float) -> bool:
+        if not self.requests.acquire(1, deadline):
+            return False
+        if not self.tokens.acquire(tokens, deadline):
+            # The call will not be made; give its request slot back
+            self.requests.refund(1)
+            return False
+        return True
+
+    def try_acquire(self, tokens: int) -> bool:
+        if not self.requests.try_acquire(1):
+            return False
+        if not self.tokens.try_acquire(tokens):
+            self.requests.refund(1)
+            return False
+        return True
+
+    def refund(self, tokens: int):
+        """Returns a request's quota when the call was never made."""
+        self.requests.refund(1)
+        self.tokens.refund(tokens)
+
+
+def parse_quotas(spec: str) -> Dict[str, Tuple[float, float]]:
+    quotas = {}
+    for item in filter(None, (part.strip() for part in spec.split(","))):
+        model, _, limits = item.partition("=")
+        rpm, _, tpm = limits.partition("/")
+        quotas[model.strip()] = (float(rpm or 0), float(tpm or 0))
+    return quotas
+
+
+# --- Backends ---
+@dataclass
+class BackendResult:
+    text: str
+    prompt_tokens: Optional[int] = None
+    output_tokens: Optional[int] = None
+
+
+class GeminiBackend:
+    """
+    google.generativeai backend. `model_factory(model_name, config)` returns a
+    GenerativeModel-like object; by default models are built (and cached) here.
+    """
+
+    def __init__(self, model_factory: Callable = None):
+        self._model_factory = model_factory or self._default_factory
+        self._models = {}
+        self._lock = threading.Lock()
+
+    def _default_factory(self, model_name: str, config: dict):
+        key = (model_name, json.dumps(config, sort_keys=True))
+        with self._lock:
+            if key not in self._models:
+                import google.generativeai as genai
+                if not self._models:
+                    genai.configure(api_key=os.getenv("GEMINI_API_KEY") or os.getenv("GOOGLE_API_KEY"))
+                self._models[key] = genai.GenerativeModel(model_name, generation_config=config)
+            return self._models[key]
+
+    @staticmethod
+    def _usage(usage_metadata) -> Tuple[Optional[int], Optional[int]]:
+        if usage_metadata is None:
+            return None, None
+        return (getattr(usage_metadata, "prompt_token_count", None),
+                getattr(usage_metadata, "candidates_token_count", None))
+
+    def generate(self, model: str, prompt: str, config: dict) -> BackendResult:
+        response = self._model_factory(model, config).generate_content(prompt)
+        return BackendResult(response.text, *self._usage(getattr(response, "usage_metadata", None)))
+
+    def stream(self, model: str, prompt: str, config: dict) -> Iterator[BackendResult]:
+        for chunk in self._model_factory(model, config).generate_content(prompt, stream=True):
+            yield BackendResult(chunk.text, *self._usage(getattr(chunk, "usage_metadata", None)))
+
+
+class StubBackend:
+    """
+    Offline backend for tests and benchmarks: a deterministic answer after a
+    simulated latency, with optional injected failures (503) and slow calls
+    (to exercise retries and hedging).
+    """
+
+    def __init__(self, latency: float = LLM_STUB_LATENCY_SECONDS, failure_rate: float = LLM_STUB_FAILURE_RATE,
+                 slow_rate: float = LLM_STUB_SLOW_RATE, slow_factor: float = 20.0,
+                 responder: Callable[[str, str], str] = None, seed: Optional[int] = None):
+        self.latency = latency
+        self.failure_rate = failure_rate
+        self.slow_rate = slow_rate
+        self.slow_factor = slow_factor
+        self.responder = responder or self._default_responder
+        self._rng = random.Random(seed)
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _default_responder(model: str, prompt: str) -> str:
+        digest = hashlib.sha256(prompt.encode("utf-8")).hexdigest()[:8]
+        return f"Stub response from {model} ({digest}) for a {estimate_tokens(prompt)}-token prompt."
+
+    def _simulate(self):
+        with self._lock:
+            fail = self._rng.random() < self.failure_rate
+            slow = self._rng.random() < self.slow_rate
+        time.sleep(self.latency * (self.slow_factor if slow else 1))
+        if fail:
+            raise LLMGatewayError("503 Service Unavailable (stub)", retryable=True)
+
+    def generate(self, model: str, prompt: str, config: dict) -> BackendResult:
+        self._simulate()
+        text = self.responder(model, prompt)
+        max_chars = int(config.get("max_output_tokens", 512)) * 4
+        text = text[:max_chars]
+        return BackendResult(text, estimate_tokens(prompt), estimate_tokens(text))
+
+    def stream(self, model: str, prompt: str, config: dict) -> Iterator[BackendResult]:
+        result = self.generate(model, prompt, config)
+        words = re.findall(r"\S+\s*", result.text) or [""]
+        for i, word in enumerate(words):
+            last = i == len(words) - 1
+            yield BackendResult(word, result.prompt_tokens if last else None, result.output_tokens if last else None)
+
+
+# --- Metrics ---
+@dataclass
+class LLMResponse:
+    text: str
+    model: str
+    backend: str
+    prompt_tokens: int
+    output_tokens: int
+    latency_ms: float
+    attempts: int = 1
+    hedged: bool = False
+    hedge_won: bool = False
+    status: str = "ok"
+    error: Optional[str] = None
+
+
+class GatewayMetrics:
+    """Per-model call counters and recent latencies, plus per-call listeners."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._models = {}
+        self._listeners = []
+
+    def add_listener(self, listener: Callable[[LLMResponse], None]):
+        self._listeners.append(listener)
+
+    def _model(self, model: str) -> dict:
+        if model not in self._models:
+            self._models[model] = {"calls": 0, "errors": 0, "retries": 0, "hedges": 0, "hedge_wins": 0,
+                                   "prompt_tokens": 0, "output_tokens": 0,
+                                   "latencies_ms": deque(maxlen=LATENCY_WINDOW),
+                                   "attempt_latencies_ms": deque(maxlen=LATENCY_WINDOW)}
+        return self._models[model]
+
+    def observe_attempt(self, model: str, latency_ms: float):
+        """Backend service time of one successful attempt (no queueing), which hedging keys off."""
+        with self._lock:
+            self._model(model)["attempt_latencies_ms"].append(latency_ms)
+
+    def record(self, response: LLMResponse):
+        with self._lock:
+            stats = self._model(response.model)
+            stats["calls"] += 1
+            stats["errors"] += int(response.status != "ok")
+            stats["retries"] += response.attempts - 1
+            stats["hedges"] += int(response.hedged)
+            stats["hedge_wins"] += int(response.hedge_won)
+            stats["prompt_tokens"] += response.prompt_tokens
+            stats["output_tokens"] += response.output_tokens
+            if response.status == "ok":
+                stats["latencies_ms"].append(response.latency_ms)
+        if LLM_METRICS_FILE:
+            try:
+                with self._lock, open(LLM_METRICS_FILE, "a", encoding="utf-8") as f:
+                    f.write(json.dumps({"ts": time.time(), **asdict(response), "text": None}) + "\n")
+            except OSError as e:
+                logging.warning(f"Could not write LLM metrics to {LLM_METRICS_FILE}: {e}")
+        for listener in self._listeners:
+            try:
+                listener(response)
+            except Exception as e:
+                logging.warning(f"LLM metrics listener failed: {e}")
+        logging.debug(f"LLM call {response.model} via {response.backend}: {response.latency_ms:.0f} ms, "
+                      f"{response.prompt_tokens}+{response.output_tokens} tokens, attempts={response.attempts}, "
+                      f"hedged={response.hedged}, status={response.status}")
+
+    def latency_quantile(self, model: str, q: float, min_samples: int = 1,
+                         series: str = "latencies_ms") -> Optional[float]:
+        with self._lock:
+            latencies = sorted(self._models.get(model, {}).get(series, ()))
+        if len(latencies) < max(1, min_samples):
+            return None
+        return latencies[min(len(latencies) - 1, int(q * len(latencies)))]
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            models = {m: {**{k: v for k, v in s.items() if not k.endswith("latencies_ms")},
+                          "_latencies": sorted(s["latencies_ms"])}
+                      for m, s in self._models.items()}
+        for stats in models.values():
+            latencies = stats.pop("_latencies")
+            for name, q in (("p50_ms", 0.5), ("p95_ms", 0.95), ("p99_ms", 0.99)):
+                stats[name] = round(latencies[min(len(latencies) - 1, int(q * len(latencies)))], 1) if latencies else None
+        return models
+
+    def render_prometheus(self) -> str:
+        lines = []
+        snapshot = self.snapshot()
+        for key in ("calls", "errors", "retries", "hedges", "hedge_wins", "prompt_tokens", "output_tokens"):
+            lines.append(f"# TYPE llm_{key}_total counter")
+            lines.extend(f'llm_{key}_total{{model="{m}"}} {s[key]}' for m, s in sorted(snapshot.items()))
+        lines.append("# TYPE llm_latency_ms summary")
+        for m, s in sorted(snapshot.items()):
+            for name, q in (("p50_ms", "0.5"), ("p95_ms", "0.95"), ("p99_ms", "0.99")):
+                if s[name] is not None:
+                    lines.append(f'llm_latency_ms{{model="{m}",quantile="{q}"}} {s[name]}')
+        return "\n".join(lines) + "\n"
+
+
+# --- Gateway ---
+class LLMStream:
+    """Iterates text chunks; `response` holds the call's LLMResponse once the stream is exhausted."""
+
+    def __init__(self, chunks: Iterator[str]):
+        self._chunks = chunks
+        self.response: Optional[LLMResponse] = None
+
+    def __iter__(self):
+        return self._chunks
+
+
+class Gateway:
+    def __init__(self, backend: str = LLM_BACKEND, max_concurrency: int = LLM_MAX_CONCURRENCY,
+                 quotas: Dict[str, Tuple[float, float]] = None, timeout: float = LLM_TIMEOUT_SECONDS,
+                 max_retries: int = LLM_MAX_RETRIES, hedge_after: str = LLM_HEDGE_AFTER_SECONDS):
+        self.default_backend = backend
+        self.timeout = timeout
+        self.max_retries = max_retries
+        self.hedge_after = str(hedge_after).lower()
+        self.metrics = GatewayMetrics()
+        self._backends = {"gemini": GeminiBackend(), "stub": StubBackend()}
+        self._quota_limits = parse_quotas(LLM_MODEL_QUOTAS) if quotas is None else dict(quotas)
+        self._quotas = {}
+        self._quotas_lock = threading.Lock()
+        # Slots are held by the backend call itself, so abandoned (timed out / losing hedge) calls still count
+        self._slots = threading.BoundedSemaphore(max_concurrency)
+        self._pool = ThreadPoolExecutor(max_workers=max_concurrency, thread_name_prefix="llm-gateway")
+
+    def register_backend(self, name: str, backend):
+        self._backends[name] = backend
+
+    def _backend(self, name: Optional[str]):
+        name = name or self.default_backend
+        if name not in self._backends:
+            raise LLMGatewayError(f"Unknown LLM backend '{name}'. Registered: {sorted(self._backends)}")
+        return name, self._backends[name]
+
+    def _quota(self, model: str) -> ModelQuota:
+        with self._quotas_lock:
+            if model not in self._quotas:
+                rpm, tpm = self._quota_limits.get(model, (LLM_DEFAULT_RPM, LLM_DEFAULT_TPM))
+                self._quotas[model] = ModelQuota(rpm, tpm)
+            return self._quotas[model]
+
+    def _hedge_delay(self, model: str) -> Optional[float]:
+        if self.hedge_after in ("off", "0", "0.0", "none", ""):
+            return None
+        if self.hedge_after == "auto":
+            p95 = self.metrics.latency_quantile(model, 0.95, min_samples=HEDGE_MIN_SAMPLES,
+                                                series="attempt_latencies_ms")
+            return p95 / 1000 if p95 is not None else None
+        return float(self.hedge_after)
+
+    def _call_with_slot(self, model: str, fn, *args):
+        started = time.monotonic()
+        try:
+            result = fn(*args)
+            self.metrics.observe_attempt(model, (time.monotonic() - started) * 1000)
+            return result
+        finally:
+            self._slots.release()
+
+    def _submit(self, deadline: float, model: str, fn, *args, blocking: bool = True):
+        timeout = max(0.0, deadline - time.monotonic())
+        if not self._slots.acquire(blocking, timeout if blocking else None):
+            if not blocking:
+                return None
+            raise LLMGatewayError("Timed out waiting for a free LLM concurrency slot", retryable=False)
+        return self._pool.submit(self._call_with_slot, model, fn, *args)
+
+    def _run_hedged(self, backend, model: str, prompt: str, config: dict, cost: int,
+                    deadline: float) -> Tuple[BackendResult, bool, bool]:
+        try:
+            primary = self._submit(deadline, model, backend.generate, model, prompt, config)
+        except LLMGatewayError:
+            # No slot freed up, so the quota generate() took was never spent
+            self._quota(model).refund(cost)
+            raise
+        pending, errors, hedged = {primary}, [], False
+        hedge_delay = self._hedge_delay(model)
+        if hedge_delay is not None:
+            done, _ = wait(pending, timeout=min(hedge_delay, max(0.0, deadline - time.monotonic())))
+            if not done and time.monotonic() < deadline and self._quota(model).try_acquire(cost):
+                hedge = self._submit(deadline, model, backend.generate, model, prompt, config, blocking=False)
+                if hedge is not None:
+                    pending.add(hedge)
+                    hedged = True
+                else:
+                    self._quota(model).refund(cost)
+        while pending:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            done, pending = wait(pending, timeout=remaining, return_when=FIRST_COMPLETED)
+            for future in done:
+                if future.exception() is None:
+                    return future.result(), hedged, future is not primary
+                errors.append(future.exception())
+        if errors and not pending:
+            raise errors[0]
+        raise LLMGatewayError(f"LLM call to {model} timed out after {self.timeout:.0f}s", retryable=True)
+
+    def _backoff(self, attempt: int) -> float:
+        # Full jitter
+        return random.uniform(0, min(LLM_BACKOFF_MAX_SECONDS, LLM_BACKOFF_SECONDS * 2 ** attempt))
+
+    def generate(self, prompt: str, model: str, config: dict = None, backend: str = None,
+                 timeout: float = None) -> LLMResponse:
+        """
+        Runs one completion under the concurrency limit and the model's quota,
+        retrying transient errors and hedging slow attempts. Raises the last
+        error once retries or the timeout are exhausted.
+        """
+        config = dict(config or {})
+        backend_name, backend_impl = self._backend(backend)
+        cost = estimate_tokens(prompt) + int(config.get("max_output_tokens", 0))
+        started = time.monotonic()
+        deadline = started + (timeout or self.timeout)
+        hedged = hedge_won = False
+        attempt = 0
+        while True:
+            attempt += 1
+            try:
+                if not self._quota(model).acquire(cost, deadline):
+                    raise LLMGatewayError(f"Quota for {model} exhausted until after the call deadline")
+                result, hedged, hedge_won = self._run_hedged(backend_impl, model, prompt, config, cost, deadline)
+                break
+            except Exception as e:
+                backoff = self._backoff(attempt - 1)
+                if attempt > self.max_retries or not is_retryable(e) or time.monotonic() + backoff >= deadline:
+                    self.metrics.record(LLMResponse("", model, backend_name, 0, 0,
+                                                    (time.monotonic() - started) * 1000, attempt, hedged,
+                                                    status="error", error=f"{type(e).__name__}: {e}"))
+                    raise
+                logging.warning(f"LLM call to {model} failed ({e}); retry {attempt}/{self.max_retries} in {backoff:.2f}s")
+                time.sleep(backoff)
+
+        response = LLMResponse(result.text, model, backend_name,
+                               result.prompt_tokens if result.prompt_tokens is not None else estimate_tokens(prompt),
+                               result.output_tokens if result.output_tokens is not None else estimate_tokens(result.text),
+                               (time.monotonic() - started) * 1000, attempt, hedged, hedge_won)
+        self.metrics.record(response)
+        return response
+
+    def _open_stream(self, backend, model: str, prompt: str, config: dict, cost: int, deadline: float):
+        """Starts a backend stream and waits for its first chunk. On success the caller owns the slot."""
+        if not self._slots.acquire(True, max(0.0, deadline - time.monotonic())):
+            self._quota(model).refund(cost)
+            raise LLMGatewayError("Timed out waiting for a free LLM concurrency slot")
+
+        def first_chunk():
+            chunks = iter(backend.stream(model, prompt, config))
+            return chunks, next(chunks, None)
+
+        future = self._pool.submit(first_chunk)
+        try:
+            return future.result(timeout=max(0.0, deadline - time.monotonic()))
+        except FutureTimeout:
+            # The slot stays taken until the abandoned call actually returns
+            future.add_done_callback(lambda _: self._slots.release())
+            raise LLMGatewayError(f"No response from {model} within {self.timeout:.0f}s", retryable=True)
+        except BaseException:
+            self._slots.release()
+            raise
+
+    def stream(self, prompt: str, model: str, config: dict = None, backend: str = None,
+               timeout: float = None) -> LLMStream:
+        """
+        Streams a completion. Retries apply until the first chunk arrives (after
+        that a failure would repeat text already shown); streams are never hedged.
+        Each later chunk must arrive within the timeout of the one before it.
+        """
+        config = dict(config or {})
+        backend_name, backend_impl = self._backend(backend)
+        cost = estimate_tokens(prompt) + int(config.get("max_output_tokens", 0))
+        stream = LLMStream(iter(()))
+
+        def chunks():
+            started = time.monotonic()
+            chunk_timeout = timeout or self.timeout
+            deadline = started + chunk_timeout
+            attempt = 0
+            while True:
+                attempt += 1
+                try:
+                    if not self._quota(model).acquire(cost, deadline):
+                        raise LLMGatewayError(f"Quota for {model} exhausted until after the call deadline")
+                    iterator, first = self._open_stream(backend_impl, model, prompt, config, cost, deadline)
+                    break
+                except Exception as e:
+                    backoff = self._backoff(attempt - 1)
+                    if attempt > self.max_retries or not is_retryable(e) or time.monotonic() + backoff >= deadline:
+                        self.metrics.record(LLMResponse("", model, backend_name, 0, 0,
+                                                        (time.monotonic() - started) * 1000, attempt,
+                                                        status="error", error=f"{type(e).__name__}: {e}"))
+                        raise
+                    logging.warning(f"LLM stream from {model} failed ({e}); retry {attempt}/{self.max_retries} in {backoff:.2f}s")
+                    time.sleep(backoff)
+
+            texts, prompt_tokens, output_tokens, status, error = [], None, None, "ok", None
+            holds_slot = True
+            try:
+                chunk = first
+                while chunk is not None:
+                    prompt_tokens = chunk.prompt_tokens if chunk.prompt_tokens is not None else prompt_tokens
+                    output_tokens = chunk.output_tokens if chunk.output_tokens is not None else output_tokens
+                    texts.append(chunk.text)
+                    yield chunk.text
+                    future = self._pool.submit(next, iterator, None)
+                    try:
+                        chunk = future.result(timeout=chunk_timeout)
+                    except FutureTimeout:
+                        # As in _open_stream, the stalled call keeps the slot until it returns
+                        holds_slot = False
+                        future.add_done_callback(lambda _: self._slots.release())
+                        raise LLMGatewayError(f"LLM stream from {model} stalled for {chunk_timeout:.0f}s", retryable=True)
+            except BaseException as e:
+                status, error = "error", f"{type(e).__name__}: {e}"
+                raise
+            finally:
+                if holds_slot:
+                    self._slots.release()
+                text = "".join(texts)
+                stream.response = LLMResponse(
+                    text, model, backend_name,
+                    prompt_tokens if prompt_tokens is not None else estimate_tokens(prompt),
+                    output_tokens if output_tokens is not None else estimate_tokens(text),
+                    (time.monotonic() - started) * 1000, attempt, status=status, error=error)
+                self.metrics.record(stream.response)
+
+        stream._chunks = chunks()
+        return stream
+
+
+_gateway = None
+_gateway_lock = threading.Lock()
+
+
+def get_gateway() -> Gateway:
+    """The process-wide gateway, so every caller shares its limits and metrics."""
+    global _gateway
+    with _gateway_lock:
+        if _gateway is None:
+            _gateway = Gateway()
+        return _gateway
@@ -0,0 +1,63 @@
+import os
+import time
+import hashlib
+from types import SimpleNamespace
+
+# Simulated per-call latency for offline runs
+FAKE_GEMINI_LATENCY_SECONDS = float(os.getenv("FAKE_GEMINI_LATENCY_SECONDS", "0.05"))
+
+
+def _count_tokens(text: str) -> int:
+    # Roughly 4 characters per token, as for the real tokenizer on English text
+    return max(1, len(text) // 4)
+
+
+class FakeGenerativeModel:
+    """
+    Offline stand-in for genai.GenerativeModel (GEMINI_BACKEND=fake). Returns
+    deterministic, correctly structured risk reports and lifestyle plans
+    derived from a hash of the prompt, so batch runs and CI need no API key.
+    """
+
+    def __init__(self, model_name: str, generation_config: dict = None):
+        self.model_name = model_name
+        self.generation_config = generation_config or {}
+
+    def _answer(self, prompt: str) -> str:
+        seed = int(hashlib.sha256(prompt.encode("utf-8")).hexdigest(), 16)
+        if "risk score" in prompt.lower():
+            score = seed % 101
+            urgent = "Yes - risk score above 80, arrange clinical review" if score > 80 else "No - no acute findings"
+            return (
+                "Top risk factors:\n"
+                "- Cardiovascular strain from the reported lifestyle\n"
+                "- Metabolic risk from the listed conditions\n"
+                "- Medication adherence\n"
+                f"Risk score: {score}/100 - based on the factors above.\n"
+                f"Urgent flags: {urgent}\n"
+            )
+        return (
+            "1. Walk 30 minutes on at least five days a week.\n"
+            "2. Replace sugary drinks with water and add vegetables to two meals a day.\n"
+            "3. Keep a fixed sleep schedule of 7-8 hours.\n"
+        )
+
+    def _usage(self, prompt: str, text: str):
+        return SimpleNamespace(prompt_token_count=_count_tokens(prompt), candidates_token_count=_count_tokens(text),
+                               total_token_count=_count_tokens(prompt) + _count_tokens(text))
+
+    def generate_content(self, prompt: str, stream: bool = False):
+        text = self._answer(prompt)
+        max_chars = int(self.generation_config.get("max_output_tokens", 512)) * 4
+        text = text[:max_chars]
+        if not stream:
+            time.sleep(FAKE_GEMINI_LATENCY_SECONDS)
+            return SimpleNamespace(text=text, usage_metadata=self._usage(prompt, text))
+        return self._stream(prompt, text)
+
+    def _stream(self, prompt: str, text: str):
+        lines = text.splitlines(keepends=True)
+        for i, line in enumerate(lines):
+            time.sleep(FAKE_GEMINI_LATENCY_SECONDS / max(1, len(lines)))
+            usage = self._usage(prompt, text) if i == len(lines) - 1 else None
+            yield SimpleNamespace(text=line, usage_metadata=usage)
@@ -1,36 +1,177 @@
 import os
-import google.generativeai as genai
+import sys
+import json
+import logging
+import threading
+import contextvars
+from contextlib import contextmanager
+from typing import Optional
 from dotenv import load_dotenv
+from .response_cache import ResponseCache, cache_key
  
 # Load environment variables from .env file
 load_dotenv()
+
+# llm_gateway.py is shared by all apps and lives at the repository root (imported after
+# load_dotenv, since it reads its LLM_* settings at import)
+sys.path.append(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))))
+import llm_gateway
  
 # Fetch API key and model from environment
 GEMINI_API_KEY = os.getenv("GEMINI_API_KEY")
 GEMINI_MODEL = os.getenv("GEMINI_MODEL", "gemini-1.5-pro")
+GEMINI_TEMPERATURE = float(os.getenv("GEMINI_TEMPERATURE", "0.7"))
+# "auto": cache only deterministic (temperature 0) calls; "off"
+GEMINI_CACHE = os.getenv("GEMINI_CACHE", "auto").lower()
+if GEMINI_CACHE not in ("auto", "off"):
+    logging.warning(f"Unknown GEMINI_CACHE '{GEMINI_CACHE}'; response caching is off.")
+# "gemini" for the real API, "fake" for the offline stand-in used by batch runs and CI
+GEMINI_BACKEND = os.getenv("GEMINI_BACKEND", "gemini").lower()
  
-# Configure Gemini SDK
-genai.configure(api_key=GEMINI_API_KEY)
- 
- 
-def call_gemini(prompt: str, max_output_tokens: int = 512) -> str:
+if GEMINI_BACKEND == "fake":
+    from .fake_gemini import FakeGenerativeModel
+else:
+    import google.generativeai as genai
+
+    # Configure Gemini SDK
+    genai.configure(api_key=GEMINI_API_KEY)
+
+_models = {}
+_models_lock = threading.Lock()
+_response_cache = None
+_usage = contextvars.ContextVar("gemini_usage", default=None)
+
+
+class Usage:
+    """Token and call counts for the Gemini calls made inside a track_usage() block."""
+
+    def __init__(self):
+        self.calls = 0
+        self.cached_calls = 0
+        self.prompt_tokens = 0
+        self.output_tokens = 0
+        self._lock = threading.Lock()
+
+    def add(self, response: llm_gateway.LLMResponse = None, cached: bool = False):
+        with self._lock:
+            self.calls += 1
+            self.cached_calls += int(cached)
+            if response is not None:
+                self.prompt_tokens += response.prompt_tokens
+                self.output_tokens += response.output_tokens
+
+
+@contextmanager
+def track_usage():
+    """Collects usage for calls made in this context (including agent threads started by engine.run_agents)."""
+    usage = Usage()
+    token = _usage.set(usage)
+    try:
+        yield usage
+    finally:
+        _usage.reset(token)
+
+
+def _record_usage(response: llm_gateway.LLMResponse = None, cached: bool = False):
+    usage = _usage.get()
+    if usage is not None:
+        usage.add(response, cached)
+
+
+def get_model(model_name: str, generation_config: dict):
+    """One GenerativeModel per (model, generation_config), reused across calls."""
+    key = (model_name, json.dumps(generation_config, sort_keys=True))
+    with _models_lock:
+        if key not in _models:
+            if GEMINI_BACKEND == "fake":
+                _models[key] = FakeGenerativeModel(model_name, generation_config=generation_config)
+            else:
+                _models[key] = genai.GenerativeModel(model_name, generation_config=generation_config)
+        return _models[key]
+
+
+# The shared gateway builds its "gemini" models through get_model, so GEMINI_BACKEND=fake still applies
+llm_gateway.get_gateway().register_backend("gemini", llm_gateway.GeminiBackend(model_factory=get_model))
+
+
+def get_response_cache() -> ResponseCache:
+    global _response_cache
+    with _models_lock:
+        if _response_cache is None:
+            _response_cache = ResponseCache()
+        return _response_cache
+
+
+def _cache_enabled(temperature: float, use_cache: Optional[bool]) -> bool:
+    if use_cache is not None:
+        return use_cache
+    return GEMINI_CACHE == "auto" and temperature == 0
+
+
+def _generation_config(max_output_tokens: int, temperature: Optional[float]) -> dict:
+    return {
+        "max_output_tokens": max_output_tokens,
+        "temperature": GEMINI_TEMPERATURE if temperature is None else temperature,
+        "top_p": 0.9,
+        "top_k": 40,
+    }
+
+
+def call_gemini(prompt: str, max_output_tokens: int = 512, temperature: Optional[float] = None,
+                use_cache: Optional[bool] = None) -> str:
     """
     Calls the Gemini model with the given prompt.
     Returns generated text response.
+    Responses are served from the disk cache when caching is enabled: by
+    default only for temperature 0, since sampled output is not repeatable.
     """
+    generation_config = _generation_config(max_output_tokens, temperature)
+    cached = _cache_enabled(generation_config["temperature"], use_cache)
+    key = cache_key(GEMINI_MODEL, generation_config, prompt) if cached else None
+    if cached:
+        response_text = get_response_cache().get(key)
+        if response_text is not None:
+            _record_usage(cached=True)
+            return response_text
+
     try:
-        model = genai.GenerativeModel(GEMINI_MODEL)
-        response = model.generate_content(
-            prompt,
-            generation_config={
-                "max_output_tokens": max_output_tokens,
-                "temperature": 0.7,
-                "top_p": 0.9,
-                "top_k": 40,
-            }
-        )
- 
-        return response.text
- 
+        response = llm_gateway.get_gateway().generate(prompt, GEMINI_MODEL, generation_config)
+        response_text = response.text
+        _record_usage(response)
+    except Exception as e:
+        return f"[Gemini API Error] {str(e)}"
+
+    if cached:
+        get_response_cache().put(key, response_text)
+    return response_text
+
+
+def stream_gemini(prompt: str, max_output_tokens: int = 512, temperature: Optional[float] = None,
+                  use_cache: Optional[bool] = None):
+    """
+    Like call_gemini, but yields text chunks as the model streams them.
+    A cached response is yielded as a single chunk.
+    """
+    generation_config = _generation_config(max_output_tokens, temperature)
+    cached = _cache_enabled(generation_config["temperature"], use_cache)
+    key = cache_key(GEMINI_MODEL, generation_config, prompt) if cached else None
+    if cached:
+        response_text = get_response_cache().get(key)
+        if response_text is not None:
+            _record_usage(cached=True)
+            yield response_text
+            return
+
+    chunks = []
+    try:
+        stream = llm_gateway.get_gateway().stream(prompt, GEMINI_MODEL, generation_config)
+        for text in stream:
+            chunks.append(text)
+            yield text
+        _record_usage(stream.response)
     except Exception as e:
-        return f"[Gemini API Error] {str(e)}"
\ No newline at end of file
+        yield f"[Gemini API Error] {str(e)}"
+        return
+
+    if cached:
+        get_response_cache().put(key, "".join(chunks))
@@ -1,5 +1,5 @@
-from .gemini_client import call_gemini
-from utils import render_prompt
+from .gemini_client import call_gemini, stream_gemini
+from prompts import PromptTemplate, CONTEXT_TOKEN_BUDGET
  
 PROMPT_TEMPLATE = """You are a friendly certified lifestyle coach.
 User context:
@@ -8,7 +8,17 @@ User context:
 Provide a concise, actionable 3-step lifestyle plan tailored for the user.
 Keep it short (max ~200 words). Use bulleted steps.
 """
- 
+
+# ~200 words of bullets is roughly 270 tokens
+LIFESTYLE_TEMPLATE = PromptTemplate("lifestyle", PROMPT_TEMPLATE, budgets={"context": CONTEXT_TOKEN_BUDGET},
+                                    max_output_tokens=320)
+
+
 def get_lifestyle_advice(context: str) -> str:
-    prompt = render_prompt(PROMPT_TEMPLATE, {'context': context})
-    return call_gemini(prompt)
\ No newline at end of file
+    prompt = LIFESTYLE_TEMPLATE.render(context=context)
+    return call_gemini(prompt, max_output_tokens=LIFESTYLE_TEMPLATE.max_output_tokens)
+
+
+def stream_lifestyle_advice(context: str):
+    prompt = LIFESTYLE_TEMPLATE.render(context=context)
+    return stream_gemini(prompt, max_output_tokens=LIFESTYLE_TEMPLATE.max_output_tokens)
@@ -1,5 +1,5 @@
-from .gemini_client import call_gemini
-from utils import render_prompt
+from .gemini_client import call_gemini, stream_gemini
+from prompts import PromptTemplate, CONTEXT_TOKEN_BUDGET
  
 RISK_PROMPT = """You are a clinical decision support assistant (non-diagnostic). Given the user context below,
 provide a short structured risk summary including:
@@ -10,7 +10,17 @@ provide a short structured risk summary including:
 Context:
 {context}
 """
- 
+
+# A short structured summary fits comfortably in 384 tokens
+RISK_TEMPLATE = PromptTemplate("risk", RISK_PROMPT, budgets={"context": CONTEXT_TOKEN_BUDGET},
+                               max_output_tokens=384)
+
+
 def get_risk_report(context: str) -> str:
-    prompt = render_prompt(RISK_PROMPT, {'context': context})
-    return call_gemini(prompt)
\ No newline at end of file
+    prompt = RISK_TEMPLATE.render(context=context)
+    return call_gemini(prompt, max_output_tokens=RISK_TEMPLATE.max_output_tokens)
+
+
+def stream_risk_report(context: str):
+    prompt = RISK_TEMPLATE.render(context=context)
+    return stream_gemini(prompt, max_output_tokens=RISK_TEMPLATE.max_output_tokens)
@@ -1,7 +1,7 @@
 import streamlit as st
 from dotenv import load_dotenv
 import os
-from orchestrator import orchestrate
+from orchestrator import orchestrate_stream, compose_final, combined_plan
  
 load_dotenv()
  
@@ -18,19 +18,43 @@ with col1:
         if not context.strip():
             st.error('Please provide user context.')
         else:
-            with st.spinner('Calling agents...'):
-                try:
-                    result = orchestrate(context)
-                except Exception as e:
-                    st.exception(e)
-                    result = None
-            if result:
-                st.subheader('Final Recommendation')
-                st.code(result['final_recommendation'])
-                st.subheader('Risk Report (raw)')
-                st.text(result['risk_report'])
-                st.subheader('Lifestyle Advice (raw)')
-                st.text(result['lifestyle_advice'])
+            st.subheader('Risk Report')
+            risk_panel = st.empty()
+            st.subheader('Lifestyle Advice')
+            lifestyle_panel = st.empty()
+            st.subheader('Combined Plan')
+            plan_panel = st.empty()
+            plan_panel.caption('Waiting for the urgent-flag line of the risk report...')
+            panels = {'risk': risk_panel, 'lifestyle': lifestyle_panel}
+            texts = {name: '' for name in panels}
+            timings, urgent = {}, None
+            try:
+                for kind, name, payload in orchestrate_stream(context):
+                    if kind == 'chunk':
+                        texts[name] += payload
+                        panels[name].text(texts[name])
+                    elif kind == 'urgent':
+                        urgent = payload
+                        plan_panel.code(combined_plan(urgent))
+                    elif kind == 'done':
+                        texts[name] = payload['text']
+                        panels[name].text(texts[name])
+                        timings.setdefault('agents', {})[name] = {'status': payload['status'],
+                                                                  'latency_ms': payload['total_ms'],
+                                                                  'ttft_ms': payload['ttft_ms']}
+                    elif kind == 'timings':
+                        timings = payload
+            except Exception as e:
+                st.exception(e)
+            if urgent is None:
+                plan_panel.code(combined_plan(None))
+            st.subheader('Final Recommendation')
+            st.code(compose_final(texts['risk'], texts['lifestyle'], urgent))
+            st.subheader('Timing')
+            if 'critical_path' in timings:
+                st.caption(f"Total {timings['total_ms']:.0f} ms; critical path "
+                           f"{' -> '.join(timings['critical_path'])} ({timings['critical_path_ms']:.0f} ms)")
+            st.table([{'agent': name, **info} for name, info in timings.get('agents', {}).items()])
  
 with col2:
     st.info('Notes')
@@ -0,0 +1,172 @@
+"""
+Batch runner for prompt changes.
+
+Runs orchestrate() over a JSONL file of user contexts, concurrently and
+under a request rate limit, checks the structure of every answer and
+writes one row per context (outputs, latency, token counts, checks) to
+Parquet.
+
+Each input line is {"id": ..., "context": "..."} or a bare JSON string.
+
+    python batch_eval.py contexts.jsonl --out results.parquet --rpm 60
+    python batch_eval.py contexts.jsonl --out results.parquet --fake --strict
+"""
+import os
+import re
+import sys
+import json
+import time
+import argparse
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+_RISK_SCORE_RE = re.compile(r"risk\s+score\b\D{0,40}?(\d{1,3})(?:\s*/\s*100)?", re.IGNORECASE)
+_STEP_RE = re.compile(r"^\s*(?:[-*•]|\d+[.)]|step\s+\d+)", re.IGNORECASE | re.MULTILINE)
+
+
+class RateLimiter:
+    """Token bucket allowing `per_minute` requests per minute, with bursts up to `burst`."""
+
+    def __init__(self, per_minute: float, burst: int = 1):
+        self.rate = per_minute / 60.0
+        self.capacity = max(1, burst)
+        self.tokens = float(self.capacity)
+        self.updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self, cost: float = 1.0):
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= cost:
+                    self.tokens -= cost
+                    return
+                wait_seconds = (cost - self.tokens) / self.rate
+            time.sleep(wait_seconds)
+
+
+def read_contexts(path: str) -> list:
+    contexts = []
+    with open(path, "r", encoding="utf-8") as f:
+        for line_no, line in enumerate(f, 1):
+            if not line.strip():
+                continue
+            item = json.loads(line)
+            if isinstance(item, str):
+                item = {"context": item}
+            item.setdefault("id", str(line_no))
+            contexts.append(item)
+    return contexts
+
+
+def parse_risk_score(risk_report: str):
+    match = _RISK_SCORE_RE.search(risk_report or "")
+    return int(match.group(1)) if match else None
+
+
+def check_structure(risk_report: str, lifestyle_advice: str) -> dict:
+    from orchestrator import parse_urgent_flag
+
+    score = parse_risk_score(risk_report)
+    urgent = parse_urgent_flag(risk_report or "")
+    steps = len(_STEP_RE.findall(lifestyle_advice or ""))
+    checks = {
+        "risk_score": score,
+        "urgent_flag": urgent,
+        "lifestyle_steps": steps,
+        "has_risk_score": score is not None and 0 <= score <= 100,
+        "has_urgent_flag": urgent is not None,
+        "has_lifestyle_plan": steps >= 3,
+        "no_api_error": "[Gemini API Error]" not in (risk_report or "") + (lifestyle_advice or ""),
+    }
+    checks["checks_passed"] = all(checks[k] for k in ("has_risk_score", "has_urgent_flag",
+                                                      "has_lifestyle_plan", "no_api_error"))
+    return checks
+
+
+def evaluate_one(item: dict, limiter: RateLimiter, requests_per_context: int) -> dict:
+    from orchestrator import orchestrate
+    from agents.gemini_client import track_usage
+
+    limiter.acquire(requests_per_context)
+    started = time.perf_counter()
+    row = {"id": item["id"], "context": item["context"]}
+    try:
+        with track_usage() as usage:
+            result = orchestrate(item["context"])
+        timings = result["timings"]
+        row.update({
+            "risk_report": result["risk_report"],
+            "lifestyle_advice": result["lifestyle_advice"],
+            "error": None,
+            "critical_path_ms": timings["critical_path_ms"],
+            **{f"{name}_latency_ms": info["latency_ms"] for name, info in timings["agents"].items()},
+            **{f"{name}_status": info["status"] for name, info in timings["agents"].items()},
+            "gemini_calls": usage.calls,
+            "cached_calls": usage.cached_calls,
+            "prompt_tokens": usage.prompt_tokens,
+            "output_tokens": usage.output_tokens,
+        })
+        row.update(check_structure(result["risk_report"], result["lifestyle_advice"]))
+    except Exception as e:
+        row.update({"error": f"{type(e).__name__}: {e}", "checks_passed": False})
+    row["latency_ms"] = (time.perf_counter() - started) * 1000
+    return row
+
+
+def run_batch(contexts: list, rpm: float = 60, concurrency: int = 4):
+    """Evaluates every context and returns a DataFrame in input order."""
+    import pandas as pd
+    from orchestrator import AGENTS
+
+    limiter = RateLimiter(rpm, burst=concurrency * len(AGENTS))
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        rows = list(pool.map(lambda item: evaluate_one(item, limiter, len(AGENTS)), contexts))
+    return pd.DataFrame(rows)
+
+
+def summarize(results) -> dict:
+    latency = results["latency_ms"]
+    return {
+        "contexts": int(len(results)),
+        "checks_passed": int(results["checks_passed"].fillna(False).astype(bool).sum()),
+        "errors": int(results["error"].notna().sum()),
+        "latency_ms_p50": round(float(latency.quantile(0.5)), 1),
+        "latency_ms_p95": round(float(latency.quantile(0.95)), 1),
+        "prompt_tokens": int(results["prompt_tokens"].fillna(0).sum()) if "prompt_tokens" in results else 0,
+        "output_tokens": int(results["output_tokens"].fillna(0).sum()) if "output_tokens" in results else 0,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run orchestrate() over a JSONL file of user contexts.")
+    parser.add_argument("contexts", help="JSONL file: {\"id\", \"context\"} objects or bare strings")
+    parser.add_argument("--out", default="batch_results.parquet", help="Parquet output path")
+    parser.add_argument("--rpm", type=float, default=60, help="Gemini requests per minute")
+    parser.add_argument("--concurrency", type=int, default=4, help="Contexts in flight at once")
+    parser.add_argument("--fake", action="store_true", help="Use the local fake Gemini backend (no API key needed)")
+    parser.add_argument("--strict", action="store_true", help="Exit non-zero if any structure check fails")
+    args = parser.parse_args()
+
+    if args.fake:
+        # Must be set before the agents (and gemini_client) are imported
+        os.environ["GEMINI_BACKEND"] = "fake"
+
+    contexts = read_contexts(args.contexts)
+    results = run_batch(contexts, rpm=args.rpm, concurrency=args.concurrency)
+    results.to_parquet(args.out, index=False)
+    summary = summarize(results)
+    print(json.dumps(summary, indent=2))
+    print(f"Wrote {len(results)} row(s) to {args.out}")
+
+    failed = results[~results["checks_passed"].fillna(False).astype(bool)]
+    for _, row in failed.iterrows():
+        print(f"[fail] {row['id']}: {row.get('error') or 'structure checks failed'}")
+    if args.strict and not failed.empty:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,162 @@
+import os
+import time
+import contextvars
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from dataclasses import dataclass, field
+from typing import Callable, Dict, List, Optional
+
+AGENT_TIMEOUT_SECONDS = float(os.getenv("AGENT_TIMEOUT_SECONDS", "60"))
+AGENT_MAX_WORKERS = int(os.getenv("AGENT_MAX_WORKERS", "4"))
+
+STATUS_OK = "ok"
+STATUS_ERROR = "error"
+STATUS_TIMEOUT = "timeout"
+STATUS_SKIPPED = "skipped"
+
+
+@dataclass
+class AgentSpec:
+    """One node of the agent DAG. fn receives the run inputs plus the outputs of depends_on, keyed by agent name."""
+    name: str
+    fn: Callable[[Dict[str, str]], str]
+    depends_on: tuple = ()
+    timeout: float = AGENT_TIMEOUT_SECONDS
+
+
+@dataclass
+class AgentResult:
+    name: str
+    status: str
+    output: Optional[str] = None
+    error: Optional[str] = None
+    started_ms: float = 0.0   # relative to the start of the run
+    finished_ms: float = 0.0
+
+    @property
+    def latency_ms(self) -> float:
+        return self.finished_ms - self.started_ms
+
+
+@dataclass
+class RunReport:
+    results: Dict[str, AgentResult]
+    total_ms: float
+    critical_path: List[str] = field(default_factory=list)
+
+    @property
+    def critical_path_ms(self) -> float:
+        return sum(self.results[name].latency_ms for name in self.critical_path)
+
+    def output(self, name: str) -> Optional[str]:
+        result = self.results.get(name)
+        return result.output if result and result.status == STATUS_OK else None
+
+    def timings(self) -> dict:
+        return {
+            "total_ms": round(self.total_ms, 1),
+            "critical_path": self.critical_path,
+            "critical_path_ms": round(self.critical_path_ms, 1),
+            "agents": {name: {"status": r.status, "latency_ms": round(r.latency_ms, 1), "error": r.error}
+                       for name, r in self.results.items()},
+        }
+
+
+def _check_dag(agents: List[AgentSpec]):
+    names = [agent.name for agent in agents]
+    if len(set(names)) != len(names):
+        raise ValueError(f"Duplicate agent names: {names}")
+    known = set(names)
+    for agent in agents:
+        missing = set(agent.depends_on) - known
+        if missing:
+            raise ValueError(f"Agent '{agent.name}' depends on unknown agent(s): {sorted(missing)}")
+    # Kahn's algorithm; anything left over sits on a cycle
+    remaining = {agent.name: set(agent.depends_on) for agent in agents}
+    while remaining:
+        ready = [name for name, deps in remaining.items() if not deps]
+        if not ready:
+            raise ValueError(f"Agent dependencies contain a cycle: {sorted(remaining)}")
+        for name in ready:
+            del remaining[name]
+        for deps in remaining.values():
+            deps.difference_update(ready)
+
+
+def _critical_path(agents: List[AgentSpec], results: Dict[str, AgentResult]) -> List[str]:
+    """Walks back from the last agent to finish through whichever dependency finished last."""
+    by_name = {agent.name: agent for agent in agents}
+    ran = [r for r in results.values() if r.status != STATUS_SKIPPED]
+    if not ran:
+        return []
+    path = [max(ran, key=lambda r: r.finished_ms).name]
+    while True:
+        deps = [results[d] for d in by_name[path[-1]].depends_on if results[d].status != STATUS_SKIPPED]
+        if not deps:
+            return list(reversed(path))
+        path.append(max(deps, key=lambda r: r.finished_ms).name)
+
+
+def run_agents(agents: List[AgentSpec], inputs: Dict[str, str], max_workers: int = AGENT_MAX_WORKERS,
+               on_result: Optional[Callable[[AgentResult], None]] = None) -> RunReport:
+    """
+    Runs the agent DAG on a thread pool: every agent starts as soon as its
+    dependencies have succeeded. Agents past their timeout are reported as
+    timed out (their thread is abandoned, not killed) and agents depending on
+    a failed or timed-out agent are skipped, so callers always get partial results.
+    on_result, if given, is called with each agent's result as soon as it is known.
+    """
+    _check_dag(agents)
+    started = time.perf_counter()
+
+    def now_ms():
+        return (time.perf_counter() - started) * 1000
+
+    results: Dict[str, AgentResult] = {}
+
+    def record(result: AgentResult):
+        results[result.name] = result
+        if on_result is not None:
+            on_result(result)
+
+    pending = {agent.name: agent for agent in agents}
+    running = {}  # future -> (agent, started_ms)
+    pool = ThreadPoolExecutor(max_workers=max_workers)
+    try:
+        while pending or running:
+            for name, agent in list(pending.items()):
+                dep_results = [results.get(d) for d in agent.depends_on]
+                if any(r is not None and r.status != STATUS_OK for r in dep_results):
+                    record(AgentResult(name, STATUS_SKIPPED, error="dependency did not complete",
+                                       started_ms=now_ms(), finished_ms=now_ms()))
+                    del pending[name]
+                elif all(r is not None for r in dep_results):
+                    agent_inputs = dict(inputs, **{d: results[d].output for d in agent.depends_on})
+                    # Copy the caller's context so per-run state (e.g. Gemini usage tracking) follows the agent
+                    context = contextvars.copy_context()
+                    running[pool.submit(context.run, agent.fn, agent_inputs)] = (agent, now_ms())
+                    del pending[name]
+            if not running:
+                continue
+
+            next_deadline = min(start + agent.timeout * 1000 for agent, start in running.values())
+            done, _ = wait(running, timeout=max(0.0, next_deadline - now_ms()) / 1000, return_when=FIRST_COMPLETED)
+            for future in done:
+                agent, start = running.pop(future)
+                try:
+                    record(AgentResult(agent.name, STATUS_OK, output=future.result(),
+                                       started_ms=start, finished_ms=now_ms()))
+                except Exception as e:
+                    record(AgentResult(agent.name, STATUS_ERROR, error=str(e),
+                                       started_ms=start, finished_ms=now_ms()))
+            for future, (agent, start) in list(running.items()):
+                if now_ms() - start >= agent.timeout * 1000:
+                    future.cancel()
+                    del running[future]
+                    record(AgentResult(agent.name, STATUS_TIMEOUT, error=f"timed out after {agent.timeout:g}s",
+                                       started_ms=start, finished_ms=now_ms()))
+    finally:
+        # Don't block on abandoned (timed-out) calls
+        pool.shutdown(wait=False, cancel_futures=True)
+
+    ordered = {agent.name: results[agent.name] for agent in agents}
+    return RunReport(ordered, now_ms(), _critical_path(agents, ordered))
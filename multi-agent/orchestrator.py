@@ -1,17 +1,63 @@
 #orchastor.py
-from agents.lifestyle_agent import get_lifestyle_advice
+import re
+import time
+import queue
+import threading
+import contextvars
 
-from agents.risk_agent import get_risk_report
- 
-def orchestrate(context: str) -> dict:
+from agents.lifestyle_agent import get_lifestyle_advice, stream_lifestyle_advice
 
-    """Synchronous orchestration: call risk agent then lifestyle agent and merge outputs."""
+from agents.risk_agent import get_risk_report, stream_risk_report
 
-    risk = get_risk_report(context)
+from engine import STATUS_OK, STATUS_TIMEOUT, AgentSpec, RunReport, run_agents
 
-    lifestyle = get_lifestyle_advice(context)
- 
-    final = f"""Final Recommendation:
+# Agent DAG: risk and lifestyle are independent and run concurrently.
+# A future agent can set depends_on=("risk",) and read inputs["risk"].
+AGENTS = [
+    AgentSpec("risk", lambda inputs: get_risk_report(inputs["context"])),
+    AgentSpec("lifestyle", lambda inputs: get_lifestyle_advice(inputs["context"])),
+]
+
+
+def _agent_text(report: RunReport, name: str) -> str:
+    output = report.output(name)
+    if output is not None:
+        return output
+    result = report.results[name]
+    return f"[{name} agent {result.status}: {result.error}]"
+
+
+STREAM_AGENTS = {
+    "risk": stream_risk_report,
+    "lifestyle": stream_lifestyle_advice,
+}
+
+# e.g. "- Urgent flags: Yes - chest pain on exertion", "**Urgent flags (yes/no):** no", "No urgent flags."
+_URGENT_RE = re.compile(r"urgent\s+flags?\b[^\n]*?\b(yes|no)\b", re.IGNORECASE)
+_NO_URGENT_RE = re.compile(r"\bno\s+urgent\s+flags?\b", re.IGNORECASE)
+
+
+def parse_urgent_flag(risk_text: str):
+    """True/False once the urgent-flag line is present in the risk report, else None."""
+    text = re.sub(r"\(yes/no\)", "", risk_text, flags=re.IGNORECASE)
+    match = _URGENT_RE.search(text)
+    if match is not None:
+        return match.group(1).lower() == "yes"
+    return False if _NO_URGENT_RE.search(text) else None
+
+
+def combined_plan(urgent) -> str:
+    if urgent is None:
+        return """- If any urgent flags are present in the risk report, recommend clinical follow-up.
+
+- Otherwise follow the 3-step lifestyle plan and re-assess in 4 weeks."""
+    if urgent:
+        return "- Urgent flags are present in the risk report: recommend clinical follow-up before starting the lifestyle plan."
+    return "- No urgent flags in the risk report: follow the 3-step lifestyle plan and re-assess in 4 weeks."
+
+
+def compose_final(risk: str, lifestyle: str, urgent=None) -> str:
+    return f"""Final Recommendation:
  
 Risk Report:
 
@@ -23,11 +69,20 @@ Lifestyle Advice:
  
 Combined Plan:
 
-- If any urgent flags are present in the risk report, recommend clinical follow-up.
-
-- Otherwise follow the 3-step lifestyle plan and re-assess in 4 weeks.
+{combined_plan(urgent)}
 
 """.strip()
+
+
+def orchestrate(context: str, agents: list = None) -> dict:
+
+    """Runs the agent DAG (independent agents concurrently) and merges outputs; failed agents leave a placeholder."""
+
+    report = run_agents(agents or AGENTS, {"context": context})
+
+    risk = _agent_text(report, "risk")
+
+    lifestyle = _agent_text(report, "lifestyle")
  
     return {
 
@@ -35,8 +90,86 @@ Combined Plan:
 
         "lifestyle_advice": lifestyle,
 
-        "final_recommendation": final,
+        "final_recommendation": compose_final(risk, lifestyle, parse_urgent_flag(risk)),
+
+        "timings": report.timings(),
 
     }
 
- 
\ No newline at end of file
+
+def _streaming_spec(name: str, stream_fn, events: queue.Queue, first_token_ms: dict) -> AgentSpec:
+    """Wraps a token stream as a DAG agent: chunks go to `events` as they arrive, the full text is the output."""
+    def fn(inputs):
+        started, parts = time.perf_counter(), []
+        for text in stream_fn(inputs["context"]):
+            if name not in first_token_ms:
+                first_token_ms[name] = (time.perf_counter() - started) * 1000
+            parts.append(text)
+            events.put(("chunk", name, text))
+        return "".join(parts)
+    return AgentSpec(name, fn)
+
+
+def orchestrate_stream(context: str, agents: dict = None):
+    """
+    Streams every agent through the DAG engine, so each one is bound by its
+    timeout. Yields events as they happen: ("chunk", agent, text) for each
+    token chunk, ("urgent", "risk", bool) as soon as the risk report's
+    urgent-flag line has been generated, ("done", agent, {"text", "status",
+    "ttft_ms", "total_ms"}) when an agent finishes, fails or times out (text
+    is then whatever was streamed plus a placeholder), and finally
+    ("timings", None, RunReport.timings() plus each agent's ttft_ms).
+    """
+    agents = agents or STREAM_AGENTS
+    events, first_token_ms = queue.Queue(), {}
+    specs = [_streaming_spec(name, stream_fn, events, first_token_ms) for name, stream_fn in agents.items()]
+
+    def run():
+        try:
+            events.put(("report", None, run_agents(specs, {"context": context},
+                                                   on_result=lambda r: events.put(("result", r.name, r)))))
+        except Exception as e:
+            events.put(("report", None, e))
+
+    threading.Thread(target=contextvars.copy_context().run, args=(run,), daemon=True).start()
+
+    # The engine enforces the agent timeouts; this bound only guards against the engine itself stalling
+    deadline = time.perf_counter() + max(spec.timeout for spec in specs) + 5
+    streamed = {name: [] for name in agents}
+    finished, risk_text, urgent = set(), "", None
+    while True:
+        try:
+            kind, name, payload = events.get(timeout=max(0.0, deadline - time.perf_counter()))
+        except queue.Empty:
+            for name in streamed.keys() - finished:
+                yield ("done", name, {"text": "".join(streamed[name]) + f"[{name} agent timeout]",
+                                      "status": STATUS_TIMEOUT, "ttft_ms": first_token_ms.get(name),
+                                      "total_ms": None})
+            return
+        if kind == "report":
+            if isinstance(payload, Exception):
+                raise payload
+            timings = payload.timings()
+            for agent_name, info in timings["agents"].items():
+                ttft = first_token_ms.get(agent_name)
+                info["ttft_ms"] = round(ttft, 1) if ttft is not None else None
+            yield ("timings", None, timings)
+            return
+        if name in finished:
+            continue  # late chunks from an agent that already timed out
+        if kind == "chunk":
+            streamed[name].append(payload)
+            yield (kind, name, payload)
+        else:
+            finished.add(name)
+            text = payload.output if payload.status == STATUS_OK else (
+                "".join(streamed[name]) + f"[{name} agent {payload.status}: {payload.error}]")
+            kind, payload = "done", {"text": text, "status": payload.status,
+                                     "ttft_ms": first_token_ms.get(name), "total_ms": payload.latency_ms}
+            yield (kind, name, payload)
+        if name == "risk" and urgent is None:
+            risk_text = payload["text"] if kind == "done" else risk_text + payload
+            # Only trust complete lines, unless the report has finished
+            urgent = parse_urgent_flag(risk_text if kind == "done" else risk_text[:risk_text.rfind("\n") + 1])
+            if urgent is not None:
+                yield ("urgent", "risk", urgent)
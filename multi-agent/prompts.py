@@ -0,0 +1,126 @@
+import os
+import re
+import math
+from string import Formatter
+from typing import Dict, Iterable, Tuple
+
+# Default budget for the free-text user context inside a prompt
+CONTEXT_TOKEN_BUDGET = int(os.getenv("CONTEXT_TOKEN_BUDGET", "1500"))
+
+_TOKEN_RE = re.compile(r"\w+|[^\w\s]")
+_SENTENCE_RE = re.compile(r"[^.!?\n]+[.!?]?\n?|\n")
+# Sentences mentioning these are kept first when an oversized context is condensed
+_SALIENT_RE = re.compile(
+    r"\d|diagnos|condition|diabet|hypertens|blood|pressure|bmi|cholesterol|heart|cardiac|asthma|copd|"
+    r"kidney|liver|cancer|stroke|medication|mg\b|dose|allerg|smok|alcohol|pregnan|pain|surgery|age|year",
+    re.IGNORECASE,
+)
+
+
+def count_tokens(text: str) -> int:
+    """
+    Local token estimate: words and punctuation, with long words costing one
+    token per ~4 characters. Close enough to Gemini's tokenizer for budgeting
+    without a count_tokens API round trip.
+    """
+    return sum(max(1, math.ceil(len(piece) / 4)) for piece in _TOKEN_RE.findall(text))
+
+
+def truncate_to_budget(text: str, max_tokens: int) -> str:
+    """Keeps the head and tail of the text, dropping the middle."""
+    if count_tokens(text) <= max_tokens:
+        return text
+    pieces = re.findall(r"\S+\s*", text)
+    costs = [count_tokens(piece) for piece in pieces]
+    budget = max_tokens - 4  # room for the marker
+    head, used = 0, 0
+    while head < len(pieces) and used + costs[head] <= budget // 2:
+        used += costs[head]
+        head += 1
+    tail = len(pieces)
+    while tail > head and used + costs[tail - 1] <= budget:
+        tail -= 1
+        used += costs[tail]
+    return "".join(pieces[:head]).rstrip() + " [...] " + "".join(pieces[tail:]).lstrip()
+
+
+def condense_to_budget(text: str, max_tokens: int) -> str:
+    """
+    Extractive summary: keeps the most clinically salient sentences (numbers,
+    conditions, medications...) in their original order until the budget is
+    used, falling back to head/tail truncation for a single huge sentence.
+    """
+    if count_tokens(text) <= max_tokens:
+        return text
+    sentences = [s for s in _SENTENCE_RE.findall(text) if s.strip()]
+    ranked = sorted(range(len(sentences)), key=lambda i: (-len(_SALIENT_RE.findall(sentences[i])), i))
+    keep, used = set(), 0
+    for i in ranked:
+        cost = count_tokens(sentences[i])
+        if used + cost <= max_tokens:
+            keep.add(i)
+            used += cost
+    if not keep:
+        return truncate_to_budget(text, max_tokens)
+    return " ".join(sentences[i].strip() for i in sorted(keep))
+
+
+FIT_STRATEGIES = {"truncate": truncate_to_budget, "condense": condense_to_budget}
+
+
+class PromptTemplate:
+    """
+    A str.format-style template compiled once at import. Field names are
+    checked against the declared variables at load time, budgeted variables
+    are cut down to their token budget on render, and the template carries
+    the output token limit its agent should request.
+    """
+
+    def __init__(self, name: str, template: str, variables: Iterable[str] = ("context",),
+                 budgets: Dict[str, int] = None, max_output_tokens: int = 512, fit_strategy: str = "condense"):
+        self.name = name
+        self.template = template
+        self.variables = tuple(variables)
+        self.budgets = dict(budgets or {})
+        self.max_output_tokens = max_output_tokens
+        if fit_strategy not in FIT_STRATEGIES:
+            raise ValueError(f"Prompt '{name}': unknown fit strategy '{fit_strategy}'")
+        self._fit = FIT_STRATEGIES[fit_strategy]
+        self._parts = self._compile(template)
+
+    def _compile(self, template: str) -> list:
+        parts, fields = [], set()
+        for literal, field_name, format_spec, conversion in Formatter().parse(template):
+            if field_name is not None:
+                if not field_name.isidentifier():
+                    raise ValueError(f"Prompt '{self.name}': only named fields are supported, got '{{{field_name}}}'")
+                if format_spec or conversion:
+                    raise ValueError(f"Prompt '{self.name}': format specs/conversions are not supported in '{{{field_name}}}'")
+                fields.add(field_name)
+            parts.append((literal, field_name))
+        undeclared = fields - set(self.variables)
+        unused = set(self.variables) - fields
+        if undeclared or unused:
+            raise ValueError(f"Prompt '{self.name}': undeclared fields {sorted(undeclared)}, unused variables {sorted(unused)}")
+        unknown_budgets = set(self.budgets) - fields
+        if unknown_budgets:
+            raise ValueError(f"Prompt '{self.name}': budgets for unknown variables {sorted(unknown_budgets)}")
+        return parts
+
+    def render_with_stats(self, **values) -> Tuple[str, dict]:
+        missing = set(self.variables) - set(values)
+        if missing:
+            raise KeyError(f"Prompt '{self.name}' is missing variable(s): {sorted(missing)}")
+        truncated = []
+        for var, budget in self.budgets.items():
+            text = str(values[var])
+            fitted = self._fit(text, budget)
+            if fitted is not text:
+                truncated.append(var)
+            values[var] = fitted
+        prompt = "".join(literal + (str(values[field]) if field else "") for literal, field in self._parts)
+        return prompt, {"input_tokens": count_tokens(prompt), "truncated": truncated,
+                        "max_output_tokens": self.max_output_tokens}
+
+    def render(self, **values) -> str:
+        return self.render_with_stats(**values)[0]